@@ -1,13 +1,241 @@
 import os
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, Optional, Tuple
+
 from dotenv import load_dotenv
 
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-ASAAS_API_KEY = os.getenv("ASAAS_API_KEY")
 
-# Verificar se as variáveis essenciais estão definidas
-if not SUPABASE_URL or not SUPABASE_KEY or not SUPABASE_SERVICE_KEY or not ASAAS_API_KEY:
-    raise EnvironmentError("Uma ou mais variáveis de ambiente essenciais (SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_KEY, ASAAS_API_KEY) não estão configuradas.") 
\ No newline at end of file
+@dataclass(frozen=True)
+class Settings:
+    """
+    Configuração da aplicação. Cada campo vem da variável de ambiente com o mesmo nome em maiúsculas
+    (ex.: profile_cache_ttl <- PROFILE_CACHE_TTL); sem a variável, vale o padrão abaixo.
+
+    Ler as variáveis não valida nada: `validate()` (chamado por get_settings, na subida da aplicação
+    ou na primeira chamada ao Supabase) verifica as essenciais e os valores, para que testes e
+    ferramentas possam importar o pacote sem o .env.
+    """
+
+    # Conexão (obrigatórias)
+    supabase_url: Optional[str] = None
+    supabase_key: Optional[str] = None
+    supabase_service_key: Optional[str] = None
+    asaas_api_key: Optional[str] = None
+    # URL base da API do Asaas (sandbox por padrão; em produção use https://api.asaas.com/v3)
+    asaas_api_url: str = "https://api-sandbox.asaas.com/v3"
+
+    # Validação do JWT do Supabase
+    # "local": verifica assinatura, exp, aud e sub no próprio processo (segredo do projeto ou JWKS)
+    # "remote": chama supabase.auth.get_user a cada requisição (comportamento original)
+    auth_verify_mode: str = "local"
+    # Segredo JWT do projeto (Project Settings > API > JWT Secret), usado para tokens HS256
+    supabase_jwt_secret: Optional[str] = None
+    supabase_jwt_audience: str = "authenticated"
+    # Padrão: {SUPABASE_URL}/auth/v1/.well-known/jwks.json
+    supabase_jwks_url: Optional[str] = None
+    supabase_jwks_cache_ttl: int = 600
+    # Se a verificação local não puder ser feita (ex.: sem segredo e JWKS indisponível), cai para get_user remoto
+    auth_remote_fallback: bool = True
+
+    # Backend compartilhado dos caches de perfil, assinaturas ativas e dados do Asaas e dos limites de login.
+    # Vazio: cada worker usa só a própria memória. Com uma URL redis:// (ou rediss://), os workers leem e
+    # gravam no mesmo servidor e as invalidações chegam a todos por pub/sub
+    cache_backend_url: str = ""
+    # Prefixo das chaves e canais, para dividir o servidor com outras aplicações
+    cache_key_prefix: str = "subauth:"
+    # Timeout (segundos) de cada operação no backend; ao estourar, a leitura conta como falta de cache
+    cache_backend_timeout: float = 0.25
+
+    # Cache dos perfis de public.users usados por get_current_user
+    profile_cache_max_size: int = 10000
+    profile_cache_ttl: float = 60
+
+    # Cache das assinaturas ativas usadas por require_active_subscription
+    entitlement_cache_max_size: int = 10000
+    entitlement_cache_ttl: float = 30
+    # Usuários sem assinatura ativa ficam em cache por menos tempo (cache negativo)
+    entitlement_negative_cache_ttl: float = 10
+
+    # Dados do Asaas em GET /subscriptions/{id}?expand=asaas (cache por assinatura, invalidado por webhooks e cancelamentos)
+    asaas_details_cache_max_size: int = 10000
+    asaas_details_cache_ttl: float = 60
+    # Cobranças mais recentes incluídas na resposta
+    asaas_details_payments_limit: int = 5
+
+    # Histórico de cobranças (GET /subscriptions/{id}/payments): as primeiras páginas ficam em cache por pouco tempo
+    asaas_payments_cache_ttl: float = 15
+    # Páginas do Asaas buscadas ao mesmo tempo ao montar o histórico completo (?all=true)
+    asaas_payments_prefetch_concurrency: int = 4
+
+    # Cliente HTTP do Asaas (pool de conexões compartilhado)
+    asaas_connect_timeout: float = 5
+    asaas_read_timeout: float = 30
+    asaas_pool_timeout: float = 5
+    asaas_max_connections: int = 100
+    asaas_max_keepalive_connections: int = 20
+
+    # Tamanho do pool de threads usado para as chamadas síncronas do supabase-py
+    supabase_executor_max_workers: int = 32
+
+    # Clientes PostgREST por token de usuário (consultas com o JWT de quem fez a requisição, para a RLS valer)
+    supabase_user_client_pool_size: int = 1000
+    # Tempo máximo de um cliente no pool; tokens que expiram antes saem na expiração
+    supabase_user_client_ttl: float = 3600
+
+    # Retentativas e circuit breaker das chamadas ao Asaas
+    asaas_retry_max_attempts: int = 3
+    asaas_retry_base_delay: float = 0.2
+    asaas_retry_max_delay: float = 5
+    asaas_cb_failure_threshold: int = 5
+    asaas_cb_recovery_timeout: float = 30
+
+    # Webhooks do Asaas: token configurado no painel do Asaas (enviado no cabeçalho asaas-access-token)
+    asaas_webhook_token: Optional[str] = None
+    webhook_queue_max_size: int = 10000
+    webhook_batch_max_size: int = 500
+    webhook_batch_max_wait: float = 1.0
+    webhook_dedup_max_size: int = 100000
+    webhook_dedup_ttl: float = 86400
+
+    # Acesso às rotas administrativas (/admin), decidido pelo token verificado: usuários com
+    # app_metadata.role igual a ADMIN_ROLE (definido com a chave de serviço) ou com o e-mail de
+    # auth.users em ADMIN_EMAILS (separados por vírgula)
+    admin_emails: FrozenSet[str] = frozenset()
+    admin_role: str = "admin"
+
+    # Controle de admissão: requisições simultâneas por grupo de rotas e fila de espera curta;
+    # acima disso a resposta é 503 com Retry-After (grupo "asaas": registro, criação e cancelamento de
+    # assinatura; grupo "auth": login e logout)
+    admission_asaas_max_concurrent: int = 32
+    admission_asaas_max_queue: int = 64
+    admission_auth_max_concurrent: int = 16
+    admission_auth_max_queue: int = 64
+    admission_queue_timeout: float = 2
+    admission_retry_after: float = 1
+
+    # Tentativas de login por minuto (token bucket) por IP e por e-mail, com rajada máxima; 0 desativa
+    login_rate_per_ip: float = 30
+    login_burst_per_ip: int = 10
+    login_rate_per_email: float = 5
+    login_burst_per_email: int = 5
+    login_rate_limit_max_keys: int = 100000
+    # Retry-After (segundos) de /auth/login e /auth/refresh quando o Supabase Auth limita a taxa ou está indisponível
+    auth_retry_after: float = 5
+
+    # Operações em lote do /admin (cancelamento e troca de plano/valor)
+    bulk_max_items: int = 1000
+    bulk_write_batch_size: int = 100
+    # Chamadas simultâneas ao Asaas por operação e ritmo máximo (req/s) somando todas as operações do processo
+    asaas_bulk_concurrency: int = 8
+    asaas_bulk_rate_per_second: float = 10
+    asaas_bulk_burst: int = 10
+
+    # Registro de usuários
+    # "sync": cria o cliente no Asaas durante a requisição (comportamento original, 201)
+    # "async": responde 202 assim que o usuário e o perfil existem; o cliente do Asaas é criado por um worker
+    registration_mode: str = "sync"
+    provisioning_poll_interval: float = 5
+    provisioning_batch_size: int = 10
+    provisioning_lease_seconds: int = 120
+    provisioning_max_attempts: int = 8
+    provisioning_retry_base_delay: float = 5
+    provisioning_retry_max_delay: float = 600
+
+    # Cabeçalho Idempotency-Key em POST /auth/register e POST /subscriptions/create
+    idempotency_cache_max_size: int = 10000
+    idempotency_ttl: float = 86400
+    # Tempo máximo que uma repetição espera a requisição original com a mesma chave terminar
+    idempotency_wait_timeout: float = 60
+
+    # Variáveis com valor que não pôde ser lido (o campo fica com o padrão); informadas por validate()
+    env_errors: Tuple[str, ...] = field(default=(), repr=False, compare=False)
+
+    @property
+    def jwks_url(self) -> Optional[str]:
+        if self.supabase_jwks_url:
+            return self.supabase_jwks_url
+        if self.supabase_url:
+            return f"{self.supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json"
+        return None
+
+    @classmethod
+    def from_env(cls, **overrides: Any) -> "Settings":
+        """Settings lidos das variáveis de ambiente; `overrides` substitui campos específicos."""
+        values, errors = {}, {}
+        for f in fields(cls):
+            if f.name == "env_errors":
+                continue
+            name = f.name.upper()
+            raw = os.getenv(name)
+            if raw is None:
+                continue
+            try:
+                values[f.name] = _PARSERS.get(f.type, str)(raw)
+            except ValueError:
+                errors[f.name] = f"{name}={raw!r} não é um valor válido"
+            else:
+                normalize = _NORMALIZERS.get(f.name)
+                if normalize is not None:
+                    values[f.name] = normalize(values[f.name])
+        env_errors = tuple(message for name, message in errors.items() if name not in overrides)
+        return cls(**{**values, **overrides, "env_errors": env_errors})
+
+    def validate(self, require_connection: bool = True) -> "Settings":
+        """
+        Levanta EnvironmentError com todos os problemas encontrados; retorna a própria instância.
+        Com require_connection=False, as variáveis de conexão (SUPABASE_*, ASAAS_API_KEY) podem faltar.
+        """
+        problems = list(self.env_errors)
+        required = {
+            "SUPABASE_URL": self.supabase_url,
+            "SUPABASE_KEY": self.supabase_key,
+            "SUPABASE_SERVICE_KEY": self.supabase_service_key,
+            "ASAAS_API_KEY": self.asaas_api_key,
+        }
+        missing = [name for name, value in required.items() if not value]
+        if missing and require_connection:
+            problems.append(f"variáveis essenciais não configuradas: {', '.join(missing)}")
+        if self.auth_verify_mode not in ("local", "remote"):
+            problems.append("AUTH_VERIFY_MODE deve ser 'local' ou 'remote'")
+        if self.registration_mode not in ("sync", "async"):
+            problems.append("REGISTRATION_MODE deve ser 'sync' ou 'async'")
+        if problems:
+            raise EnvironmentError(f"Configuração inválida: {'; '.join(problems)}.")
+        return self
+
+
+def _parse_bool(raw: str) -> bool:
+    return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _parse_emails(raw: str) -> FrozenSet[str]:
+    return frozenset(email.strip().lower() for email in raw.split(",") if email.strip())
+
+
+_PARSERS: Dict[Any, Callable[[str], Any]] = {
+    bool: _parse_bool,
+    int: int,
+    float: float,
+    FrozenSet[str]: _parse_emails,
+}
+
+_NORMALIZERS: Dict[str, Callable[[Any], Any]] = {
+    "auth_verify_mode": lambda value: value.strip().lower(),
+    "registration_mode": lambda value: value.strip().lower(),
+    "admin_role": lambda value: value.strip(),
+    "asaas_api_url": lambda value: value.rstrip("/"),
+}
+
+
+# Configuração do processo, lida na importação e sem validação. Os caches, workers e limites criados
+# na importação dos módulos usam estes valores; a conexão usada pela aplicação vem de create_app.
+settings = Settings.from_env()
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Settings do processo já validados (levanta EnvironmentError se a configuração for inválida)."""
+    return settings.validate()
@@ -1,80 +1,239 @@
+import hashlib
+from typing import Optional
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from supabase import Client
+from postgrest import SyncPostgrestClient
 # from gotrue.errors import AuthApiException # Remover importação específica que está falhando
 # Pode ser necessário capturar uma exceção mais genérica ou específica do cliente Supabase/GoTrue
 
-from .utils.supabase import supabase_client # Usar a instância global
-from .models.user import UserProfile, UserDB
+from .utils.supabase import supabase_clients, get_supabase_client, run_supabase
+from .utils.jwt_verifier import jwt_verifier, TokenInvalidError, TokenVerificationUnavailable
+from .utils.singleflight import single_flight
+from .utils.user_caches import profile_cache, entitlement_cache, ACTIVE_SUBSCRIPTION_STATUSES
+from .core.config import settings
+from .models.user import UserProfile, UserDB, SessionContext
 
 # Define o esquema OAuth2 para obter o token
 # tokenUrl="auth/login" refere-se à rota onde o cliente pode obter um token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), supabase: Client = Depends(lambda: supabase_client)) -> UserProfile:
+async def _resolve_claims(token: str, supabase: Client) -> dict:
     """
-    Dependency para obter o usuário logado com base no token JWT.
-    Verifica o token no Supabase Auth e busca dados adicionais na tabela public.users.
+    Retorna as claims do token já verificado: 'sub' (id do usuário), 'email' e 'app_metadata'.
+    No modo "local" o JWT é verificado no próprio processo; o get_user remoto
+    fica como fallback quando a verificação local não pode ser concluída.
     """
-    try:
+    if settings.auth_verify_mode == "local":
         try:
-            # Obter o usuário usando o token JWT fornecido
-            user_auth_response = supabase.auth.get_user(jwt=token)
-        except Exception as e:
-            error_detail = str(e).lower()
-            # A biblioteca supabase-py pode levantar exceções específicas para erros de JWT.
-            # Idealmente, importaríamos e capturaríamos essas exceções específicas (ex: gotrue.errors.AuthJWTError)
-            # Por enquanto, continuamos analisando a string do erro.
-            if "invalid" in error_detail or "expired" in error_detail or "unauthorized" in error_detail or "jwt" in error_detail:
-                print(f"Erro de autenticação Supabase ao validar JWT: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Token inválido ou expirado",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-            else:
-                print(f"Erro inesperado ao chamar supabase.auth.get_user: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Erro interno ao validar token: {e}",
-                )
-
-        if not user_auth_response or not user_auth_response.user:
+            return await jwt_verifier.verify(token)
+        except TokenInvalidError as e:
+            print(f"Erro de autenticação ao validar JWT localmente: {e}")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Não autenticado ou usuário não encontrado no token",
+                detail="Token inválido ou expirado",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        except TokenVerificationUnavailable as e:
+            if not settings.auth_remote_fallback:
+                print(f"Verificação local do JWT indisponível e fallback remoto desativado: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Não foi possível validar o token no momento.",
+                )
+            print(f"Verificação local do JWT indisponível, usando supabase.auth.get_user: {e}")
 
-        user_id = user_auth_response.user.id
-
-        # Modificado para não usar .single() e tratar o caso de 0 ou múltiplas linhas
-        response = supabase.from_('users').select('*').eq('id', str(user_id)).execute()
+    # Requisições simultâneas com o mesmo token (comum em SPAs) compartilham um único get_user
+    token_key = hashlib.sha256(token.encode()).hexdigest()
+    return await single_flight.do("supabase_get_user", token_key, lambda: _get_claims_remote(token, supabase))
 
-        if not response.data or len(response.data) == 0:
-            print(f"Usuário {user_id} autenticado via JWT, mas não encontrado na tabela public.users")
+async def _get_claims_remote(token: str, supabase: Client) -> dict:
+    try:
+        # Obter o usuário usando o token JWT fornecido
+        user_auth_response = await run_supabase(supabase.auth.get_user, jwt=token)
+    except Exception as e:
+        error_detail = str(e).lower()
+        # A biblioteca supabase-py pode levantar exceções específicas para erros de JWT.
+        # Idealmente, importaríamos e capturaríamos essas exceções específicas (ex: gotrue.errors.AuthJWTError)
+        # Por enquanto, continuamos analisando a string do erro.
+        if "invalid" in error_detail or "expired" in error_detail or "unauthorized" in error_detail or "jwt" in error_detail:
+            print(f"Erro de autenticação Supabase ao validar JWT: {e}")
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Dados do perfil do usuário não encontrados."
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token inválido ou expirado",
+                headers={"WWW-Authenticate": "Bearer"},
             )
-        elif len(response.data) > 1:
-            # Este caso indica uma inconsistência de dados (múltiplos perfis para o mesmo user_id)
-            print(f"ERRO CRÍTICO: Múltiplos perfis encontrados para o user_id {user_id} na tabela public.users")
+        else:
+            print(f"Erro inesperado ao chamar supabase.auth.get_user: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Inconsistência nos dados do usuário."
+                detail=f"Erro interno ao validar token: {e}",
             )
-        
-        # Se chegou aqui, temos exatamente um usuário
-        user_profile_data = response.data[0]
-        return UserProfile(**user_profile_data)
+
+    if not user_auth_response or not user_auth_response.user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Não autenticado ou usuário não encontrado no token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    # Os mesmos campos que a verificação local lê do JWT, vindos de auth.users
+    user = user_auth_response.user
+    return {"sub": user.id, "email": user.email, "app_metadata": user.app_metadata or {}}
+
+async def get_verified_claims(token: str = Depends(oauth2_scheme), supabase: Client = Depends(get_supabase_client)) -> dict:
+    """
+    Dependency com as claims do token, depois de verificá-lo (localmente ou no Supabase Auth).
+    O FastAPI a executa uma única vez por requisição, mesmo quando várias dependencies a usam.
+    """
+    try:
+        return await _resolve_claims(token, supabase)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Erro inesperado ao validar o token: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro interno do servidor ao processar autenticação: {e}"
+        )
+
+async def get_verified_user_id(claims: dict = Depends(get_verified_claims)) -> str:
+    """Dependency com o id do usuário dono do token (claim 'sub'), depois de verificá-lo."""
+    return str(claims["sub"])
+
+async def get_user_postgrest(token: str = Depends(oauth2_scheme), user_id: str = Depends(get_verified_user_id)) -> SyncPostgrestClient:
+    """
+    Dependency com um cliente PostgREST que consulta com o JWT do usuário da requisição,
+    então as políticas de RLS de users/subscriptions valem. O cliente vem de um pool por token;
+    só tokens já verificados entram nele, para que tokens forjados (ex.: com exp distante)
+    não despejem os clientes de usuários reais.
+    """
+    return supabase_clients.for_token(token)
+
+async def _load_session_context(user_id: str, supabase: SyncPostgrestClient) -> SessionContext:
+    # Perfil e assinaturas em uma única ida ao banco (RPC get_session_context)
+    response = await run_supabase(supabase.rpc('get_session_context', {'p_user_id': user_id}).execute)
+    if not response.data:
+        print(f"Usuário {user_id} autenticado via JWT, mas não encontrado na tabela public.users")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dados do perfil do usuário não encontrados."
+        )
+
+    context = SessionContext(**response.data)
+    await profile_cache.set(user_id, context)
+    # Aproveita as assinaturas já carregadas para preencher o cache de require_active_subscription
+    plans = frozenset(s.plan for s in context.subscriptions if s.status in ACTIVE_SUBSCRIPTION_STATUSES)
+    await entitlement_cache.set(user_id, plans, ttl=None if plans else settings.entitlement_negative_cache_ttl)
+    return context
+
+async def get_current_session(token: str = Depends(oauth2_scheme), user_id: str = Depends(get_verified_user_id)) -> SessionContext:
+    """
+    Dependency para obter o perfil e as assinaturas do usuário logado com base no token JWT.
+    O token é verificado por get_verified_user_id (localmente ou no Supabase Auth, conforme AUTH_VERIFY_MODE);
+    o contexto vem do cache ou, em uma única chamada, da RPC get_session_context
+    (feita com o JWT do usuário, sob RLS).
+    """
+    try:
+        cached_context = await profile_cache.get(user_id)
+        if cached_context is not None:
+            return cached_context
+
+        # Com o cache vazio, requisições simultâneas do mesmo usuário compartilham uma única RPC
+        return await single_flight.do(
+            "session_context", user_id, lambda: _load_session_context(user_id, supabase_clients.for_token(token))
+        )
 
     except HTTPException as e_http:
         raise e_http
     except Exception as e_general:
-        # Esta captura genérica deve agora pegar menos casos, pois o PGRST116 foi tratado acima.
-        print(f"Erro inesperado na dependência get_current_user: {e_general}")
+        print(f"Erro inesperado na dependência get_current_session: {e_general}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Erro interno do servidor ao processar autenticação: {e_general}"
-        ) 
\ No newline at end of file
+        )
+
+async def get_current_user(session: SessionContext = Depends(get_current_session)) -> UserProfile:
+    """
+    Dependency para obter o usuário logado com base no token JWT.
+    Retorna o perfil de public.users carregado por get_current_session.
+    """
+    return session.profile
+
+async def get_active_plans(user_id: str, supabase: SyncPostgrestClient) -> frozenset:
+    """
+    Retorna os planos com assinatura ativa do usuário, a partir do cache quando possível.
+    Um único select traz todos os planos, então qualquer require_active_subscription reaproveita o resultado.
+    """
+    cached_plans = await entitlement_cache.get(user_id)
+    if cached_plans is not None:
+        return cached_plans
+
+    return await single_flight.do("active_plans", user_id, lambda: _load_active_plans(user_id, supabase))
+
+async def _load_active_plans(user_id: str, supabase: SyncPostgrestClient) -> frozenset:
+    query = supabase.from_('subscriptions')\
+        .select('plan')\
+        .eq('user_id', user_id)\
+        .in_('status', list(ACTIVE_SUBSCRIPTION_STATUSES))
+    response = await run_supabase(query.execute)
+
+    plans = frozenset(row.get('plan') for row in (response.data or []))
+    await entitlement_cache.set(user_id, plans, ttl=None if plans else settings.entitlement_negative_cache_ttl)
+    return plans
+
+def require_active_subscription(plan: Optional[str] = None):
+    """
+    Fábrica de dependency para rotas restritas a assinantes.
+    Sem `plan`, basta qualquer assinatura ativa; com `plan`, exige uma assinatura ativa desse plano.
+    Retorna o usuário logado, como get_current_user.
+
+    Exemplo: `@router.get("/relatorios", dependencies=[Depends(require_active_subscription(plan="premium"))])`
+    """
+    async def dependency(
+        current_user: UserProfile = Depends(get_current_user),
+        supabase: SyncPostgrestClient = Depends(get_user_postgrest)
+    ) -> UserProfile:
+        try:
+            plans = await get_active_plans(str(current_user.id), supabase)
+        except Exception as e:
+            print(f"Erro ao verificar assinaturas ativas do usuário {current_user.id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Erro interno do servidor ao verificar a assinatura: {e}"
+            )
+
+        if not plans or (plan is not None and plan not in plans):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Requer uma assinatura ativa do plano '{plan}'." if plan else "Requer uma assinatura ativa."
+            )
+        return current_user
+
+    return dependency
+
+def is_admin(claims: dict) -> bool:
+    """
+    Administrador: app_metadata.role igual a ADMIN_ROLE ou e-mail de auth.users em ADMIN_EMAILS.
+    Só vale o que está no token verificado: app_metadata só é alterado com a chave de serviço, e o e-mail
+    de public.users não conta, porque o próprio usuário pode editar o perfil.
+    """
+    if (claims.get("app_metadata") or {}).get("role") == settings.admin_role:
+        return True
+    # O Supabase Auth guarda o e-mail em minúsculas, como ADMIN_EMAILS; a comparação é exata
+    return claims.get("email") in settings.admin_emails
+
+async def require_admin(
+    current_user: UserProfile = Depends(get_current_user),
+    claims: dict = Depends(get_verified_claims)
+) -> UserProfile:
+    """
+    Dependency para rotas administrativas: o token do usuário logado precisa ser de um administrador (is_admin).
+    """
+    if not is_admin(claims):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acesso restrito a administradores."
+        )
+    return current_user
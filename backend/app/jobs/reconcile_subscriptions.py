@@ -0,0 +1,285 @@
+"""
+Reconciliação entre as assinaturas do Asaas e a tabela public.subscriptions.
+
+Percorre GET /subscriptions do Asaas página a página (buscando a próxima página enquanto
+processa a atual), compara cada página com as linhas de public.subscriptions de mesmo
+subscription_id e emite um diff em NDJSON:
+
+- status_drift: status local diferente do status no Asaas
+- plan_mismatch: plano local diferente do plano gravado no Asaas (externalReference). Só as
+  assinaturas criadas por esta API gravam o plano ali; sem externalReference o plano local é mantido
+- missing_in_db: assinatura existe no Asaas mas não no banco
+- missing_in_asaas: linha no banco sem assinatura correspondente no Asaas (nem entre as removidas)
+
+As linhas missing_in_* trazem em "action" o que a correção faz: "insert" (missing_in_db com usuário
+local), "cancel" (missing_in_asaas vira cancelled) ou "none" (só relatório: sem usuário local, já
+cancelada ou criada há menos de MISSING_IN_ASAAS_MIN_AGE, que pode ainda não ter aparecido na listagem).
+
+As correções são aplicadas em lotes pela RPC reconcile_apply_fixes, que só altera os campos
+corrigidos e grava status_event_at quando o status muda, para que webhooks mais antigos não
+desfaçam a correção. Nada é carregado por inteiro: os IDs vistos no Asaas ficam na tabela
+subscription_reconcile_seen durante a execução, e as linhas só do banco são lidas paginadas.
+
+Uso (no diretório backend/):
+    python -m app.jobs.reconcile_subscriptions [--dry-run] [--output diff.ndjson]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+from ..utils.asaas import asaas_client, asaas_request
+from ..utils.supabase import get_supabase_admin, run_supabase, shutdown_supabase_executor
+
+ASAAS_MAX_PAGE_SIZE = 100
+# Status gravado por POST /subscriptions/{id}/cancel e pelo webhook SUBSCRIPTION_DELETED
+CANCELLED_STATUS = "cancelled"
+# Status locais que são compatíveis com o status da assinatura no Asaas
+# (OVERDUE vem dos webhooks de cobrança; a assinatura continua ACTIVE no Asaas)
+COMPATIBLE_STATUSES = {("OVERDUE", "ACTIVE")}
+UNKNOWN_PLAN = "desconhecido"
+# Linhas do banco mais novas que isso em relação ao início da execução não são canceladas por
+# missing_in_asaas: a assinatura pode ter sido criada no Asaas depois que a página dela foi lida.
+# Também cobre diferenças de relógio entre este processo e o banco (created_at em UTC)
+MISSING_IN_ASAAS_MIN_AGE = timedelta(hours=1)
+
+
+def expected_status(asaas_subscription: dict) -> str:
+    if asaas_subscription.get("deleted"):
+        return CANCELLED_STATUS
+    return asaas_subscription.get("status")
+
+
+async def iter_asaas_pages(page_size: int) -> AsyncIterator[list]:
+    """Gera as páginas de assinaturas do Asaas, sempre com a próxima página já em andamento."""
+
+    async def fetch(offset: int) -> dict:
+        response = await asaas_request(
+            "GET", "subscriptions", data={"offset": offset, "limit": page_size, "includeDeleted": "true"}
+        )
+        return response.json()
+
+    offset = 0
+    next_page = asyncio.create_task(fetch(offset))
+    try:
+        while next_page is not None:
+            page = await next_page
+            rows = page.get("data") or []
+            offset += len(rows)
+            next_page = asyncio.create_task(fetch(offset)) if page.get("hasMore") and rows else None
+            yield rows
+    finally:
+        if next_page is not None and not next_page.done():
+            next_page.cancel()
+
+
+class Reconciler:
+    def __init__(self, dry_run: bool, batch_size: int, output):
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.output = output
+        self.run_id = str(uuid.uuid4())
+        self.started_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.pending_fixes = []
+        self.counts = {
+            "asaas_rows": 0,
+            "db_rows": 0,
+            "status_drift": 0,
+            "plan_mismatch": 0,
+            "missing_in_db": 0,
+            "missing_in_asaas": 0,
+            "fixes_applied": 0,
+        }
+
+    def emit(self, kind: str, **fields) -> None:
+        self.counts[kind] += 1
+        self.output.write(json.dumps({"type": kind, **fields}, default=str) + "\n")
+
+    async def compare_page(self, asaas_rows: list) -> None:
+        ids = [row["id"] for row in asaas_rows]
+        # Marca os IDs como vistos nesta execução e devolve as linhas locais correspondentes (1 round trip)
+        response = await run_supabase(
+            get_supabase_admin().rpc('reconcile_compare_page', {'p_run_id': self.run_id, 'p_subscription_ids': ids}).execute
+        )
+        db_rows = {row["subscription_id"]: row for row in (response.data or [])}
+        self.counts["db_rows"] += len(db_rows)
+
+        missing = []
+        for asaas_row in asaas_rows:
+            sid = asaas_row["id"]
+            asaas_status = expected_status(asaas_row)
+            asaas_plan = asaas_row.get("externalReference")
+            db_row = db_rows.get(sid)
+
+            if db_row is None:
+                # Assinaturas já removidas no Asaas e inexistentes no banco não precisam de correção
+                if not asaas_row.get("deleted"):
+                    missing.append(asaas_row)
+                continue
+
+            # Campos None não são alterados por reconcile_apply_fixes
+            fix = {"subscription_id": sid, "user_id": None, "status": None, "plan": None}
+            changed = False
+            if db_row["status"] != asaas_status and (db_row["status"], asaas_status) not in COMPATIBLE_STATUSES:
+                self.emit("status_drift", subscription_id=sid, db=db_row["status"], asaas=asaas_status)
+                fix["status"] = asaas_status
+                changed = True
+            if asaas_plan and db_row["plan"] != asaas_plan:
+                self.emit("plan_mismatch", subscription_id=sid, db=db_row["plan"], asaas=asaas_plan)
+                fix["plan"] = asaas_plan
+                changed = True
+            if changed:
+                self.pending_fixes.append(fix)
+
+        if missing:
+            await self.handle_missing_in_db(missing)
+
+        if len(self.pending_fixes) >= self.batch_size:
+            await self.flush_fixes()
+
+    async def handle_missing_in_db(self, asaas_rows: list) -> None:
+        customers = list({row.get("customer") for row in asaas_rows if row.get("customer")})
+        users_by_customer = {}
+        if customers:
+            query = get_supabase_admin().from_('users').select('id, asaas_customer_id').in_('asaas_customer_id', customers)
+            response = await run_supabase(query.execute)
+            users_by_customer = {row["asaas_customer_id"]: row["id"] for row in (response.data or [])}
+
+        for asaas_row in asaas_rows:
+            user_id = users_by_customer.get(asaas_row.get("customer"))
+            self.emit(
+                "missing_in_db",
+                subscription_id=asaas_row["id"],
+                customer=asaas_row.get("customer"),
+                asaas=expected_status(asaas_row),
+                user_id=user_id,
+                action="insert" if user_id else "none",
+            )
+            if user_id:
+                # Sem usuário local não há como inserir (user_id é obrigatório para a RLS)
+                self.pending_fixes.append({
+                    "subscription_id": asaas_row["id"],
+                    "user_id": user_id,
+                    "status": expected_status(asaas_row),
+                    "plan": asaas_row.get("externalReference") or UNKNOWN_PLAN,
+                })
+
+    async def scan_missing_in_asaas(self, page_size: int) -> None:
+        after = ""
+        while True:
+            response = await run_supabase(
+                get_supabase_admin().rpc(
+                    'reconcile_missing_in_asaas',
+                    {'p_run_id': self.run_id, 'p_after': after, 'p_limit': page_size},
+                ).execute
+            )
+            rows = response.data or []
+            for row in rows:
+                cancel = row["status"] != CANCELLED_STATUS and self._older_than_run(row.get("created_at"))
+                self.emit(
+                    "missing_in_asaas",
+                    subscription_id=row["subscription_id"],
+                    user_id=row["user_id"],
+                    db=row["status"],
+                    action="cancel" if cancel else "none",
+                )
+                if cancel:
+                    self.pending_fixes.append(
+                        {"subscription_id": row["subscription_id"], "user_id": None, "status": CANCELLED_STATUS, "plan": None}
+                    )
+            if len(self.pending_fixes) >= self.batch_size:
+                await self.flush_fixes()
+            if len(rows) < page_size:
+                break
+            after = rows[-1]["subscription_id"]
+
+    def _older_than_run(self, created_at: Optional[str]) -> bool:
+        if not created_at:
+            return False
+        try:
+            # created_at é TIMESTAMP sem fuso; o PostgREST pode mandar frações com menos de 6 dígitos
+            created = datetime.fromisoformat(created_at[:19])
+        except ValueError:
+            return False
+        return created < self.started_at - MISSING_IN_ASAAS_MIN_AGE
+
+    async def flush_fixes(self) -> None:
+        if not self.pending_fixes:
+            return
+        batch, self.pending_fixes = self.pending_fixes, []
+        if self.dry_run:
+            return
+        await run_supabase(get_supabase_admin().rpc('reconcile_apply_fixes', {'fixes': batch}).execute)
+        self.counts["fixes_applied"] += len(batch)
+
+    async def finish(self) -> None:
+        await run_supabase(get_supabase_admin().rpc('reconcile_finish', {'p_run_id': self.run_id}).execute)
+
+
+async def reconcile(dry_run: bool, page_size: int, batch_size: int, output, progress_interval: float) -> dict:
+    reconciler = Reconciler(dry_run=dry_run, batch_size=batch_size, output=output)
+    started = time.monotonic()
+    last_report = started
+
+    def report(final: bool = False) -> None:
+        elapsed = max(time.monotonic() - started, 1e-9)
+        rate = reconciler.counts["asaas_rows"] / elapsed
+        label = "Concluído" if final else "Progresso"
+        print(f"{label}: {reconciler.counts['asaas_rows']} assinaturas do Asaas em {elapsed:.1f}s ({rate:.0f} linhas/s)", file=sys.stderr)
+
+    await asaas_client.start()
+    try:
+        async for asaas_rows in iter_asaas_pages(page_size):
+            if not asaas_rows:
+                continue
+            reconciler.counts["asaas_rows"] += len(asaas_rows)
+            await reconciler.compare_page(asaas_rows)
+            if time.monotonic() - last_report >= progress_interval:
+                report()
+                last_report = time.monotonic()
+
+        await reconciler.flush_fixes()
+        await reconciler.scan_missing_in_asaas(page_size)
+        await reconciler.flush_fixes()
+    finally:
+        try:
+            await reconciler.finish()
+        finally:
+            await asaas_client.close()
+
+    report(final=True)
+    elapsed = time.monotonic() - started
+    return {
+        **reconciler.counts,
+        "dry_run": dry_run,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(reconciler.counts["asaas_rows"] / elapsed, 1) if elapsed else None,
+    }
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="apenas emite o diff, sem aplicar correções")
+    parser.add_argument("--page-size", type=int, default=ASAAS_MAX_PAGE_SIZE, help="itens por página do Asaas (máx. 100)")
+    parser.add_argument("--batch-size", type=int, default=500, help="correções por chamada de reconcile_apply_fixes")
+    parser.add_argument("--output", help="arquivo para o diff em NDJSON (padrão: stdout)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="segundos entre relatórios de linhas/s")
+    args = parser.parse_args(argv)
+
+    page_size = max(1, min(args.page_size, ASAAS_MAX_PAGE_SIZE))
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        summary = asyncio.run(reconcile(args.dry_run, page_size, args.batch_size, output, args.progress_interval))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        shutdown_supabase_executor()
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,97 @@
-from fastapi import FastAPI
-from .routers import auth, users, subscriptions
 
-app = FastAPI(title="Template SaaS com Supabase e Asaas", version="1.0.0")
+from contextlib import asynccontextmanager
+from typing import Optional
 
-# Incluir os roteadores
-app.include_router(auth.router, prefix="/auth", tags=["auth"])
-app.include_router(users.router, prefix="/users", tags=["users"])
-app.include_router(subscriptions.router, prefix="/subscriptions", tags=["subscriptions"])
+from fastapi import FastAPI, Response
+from .routers import auth, users, subscriptions, webhooks, admin
+from .utils.asaas import asaas_client
+from .utils.supabase import supabase_clients, shutdown_supabase_executor
+from .utils.jwt_verifier import jwt_verifier
+from .utils.subscription_updates import subscription_updates
+from .utils.provisioning import provisioning_worker
+from .utils.idempotency import idempotency_store
+from .utils.admission import admission_stats
+from .utils.singleflight import single_flight
+from .utils.cache_backend import shared_caches
+from .utils.metrics import AppStatsCollector, MetricsMiddleware, registry, render_metrics
+from .core.config import Settings, get_settings, settings as process_settings
 
-@app.get("/", summary="Health Check")
-async def read_root():
-    return {"status": "API está online"}
+# Os caches, workers e clientes são globais do processo, então o collector é registrado uma única vez
+registry.register(AppStatsCollector(
+    shared_caches=shared_caches,
+    supabase_clients=supabase_clients,
+    asaas_client=asaas_client,
+    subscription_updates=subscription_updates,
+    provisioning_worker=provisioning_worker,
+    idempotency_store=idempotency_store,
+    admission_stats=admission_stats,
+    single_flight=single_flight,
+))
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Monta a aplicação. Sem `settings`, usa as variáveis de ambiente (get_settings); em ambos os casos a
+    configuração é validada só na subida (lifespan): importar este módulo não exige .env nem cria clientes.
+    De `settings` valem a conexão com o Supabase, o Asaas e o backend de cache e a verificação do JWT;
+    os caches, limites e workers criados na importação usam os valores do ambiente (config.settings).
+
+    Os clientes Supabase, o cliente do Asaas e o verificador de JWT são do processo; a subida
+    os configura com `settings`, então rode uma aplicação por processo.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if settings is None:
+            app_settings = get_settings()
+        else:
+            # Os caches, limites e workers do processo continuam usando os valores do ambiente
+            process_settings.validate(require_connection=False)
+            app_settings = settings.validate()
+        app.state.settings = app_settings
+        supabase_clients.configure(app_settings)
+        jwt_verifier.configure(app_settings.supabase_jwt_secret, app_settings.jwks_url)
+        asaas_client.configure(app_settings.asaas_api_url, app_settings.asaas_api_key)
+        supabase_clients.warm_up()
+        # Backend dos caches de perfil, assinaturas e Asaas e dos limites de login (memória ou Redis)
+        await shared_caches.start(app_settings.cache_backend_url)
+        # Abre o pool de conexões do Asaas na subida e fecha no desligamento do worker
+        await asaas_client.start()
+        # Worker que grava em lotes as mudanças de status recebidas pelos webhooks do Asaas
+        subscription_updates.start()
+        # Worker que cria os clientes do Asaas dos registros aceitos com 202
+        if process_settings.registration_mode == "async":
+            provisioning_worker.start()
+        yield
+        await provisioning_worker.stop()
+        await subscription_updates.stop()
+        await asaas_client.close()
+        await shared_caches.close()
+        shutdown_supabase_executor()
+        supabase_clients.close()
+
+    app = FastAPI(title="Template SaaS com Supabase e Asaas", version="1.0.0", lifespan=lifespan)
+    app.add_middleware(MetricsMiddleware)
+
+    # Incluir os roteadores
+    app.include_router(auth.router, prefix="/auth", tags=["auth"])
+    app.include_router(users.router, prefix="/users", tags=["users"])
+    app.include_router(subscriptions.router, prefix="/subscriptions", tags=["subscriptions"])
+    app.include_router(webhooks.router, prefix="/webhooks", tags=["webhooks"])
+    app.include_router(admin.router, prefix="/admin", tags=["admin"])
+
+    @app.get("/", summary="Health Check")
+    async def read_root():
+        return {"status": "API está online"}
+
+    @app.get("/metrics", summary="Métricas no formato de texto do Prometheus", include_in_schema=False)
+    async def metrics():
+        body, content_type = render_metrics()
+        return Response(content=body, headers={"Content-Type": content_type})
+
+    return app
+
+app = create_app()
 
 # Nota: Para rodar esta aplicação, você precisará de um arquivo .env
-# com as variáveis SUPABASE_URL, SUPABASE_KEY e ASAAS_API_KEY.
-# Use `uvicorn app.main:app --reload` no diretório backend/app 
\ No newline at end of file
+# com as variáveis SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_KEY e ASAAS_API_KEY.
+# Use `uvicorn app.main:app --reload` no diretório backend/
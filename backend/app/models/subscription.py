@@ -1,7 +1,7 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from uuid import UUID
-from datetime import datetime
+from datetime import date, datetime
 
 # Modelos para a tabela subscriptions no banco de dados
 class SubscriptionDB(BaseModel):
@@ -86,4 +86,47 @@ class SubscriptionDetails(BaseModel):
      status: str
      plan: str
      created_at: datetime
-     updated_at: datetime 
\ No newline at end of file
+     updated_at: datetime 
+
+# Dados do Asaas incluídos com GET /subscriptions/{subscription_id}?expand=asaas
+class AsaasPaymentSummary(BaseModel):
+    id: str
+    status: str
+    value: Optional[float] = None
+    due_date: Optional[date] = None
+    payment_date: Optional[date] = None
+    billing_type: Optional[str] = None
+    invoice_url: Optional[str] = None
+
+class AsaasSubscriptionInfo(BaseModel):
+    status: Optional[str] = None
+    value: Optional[float] = None
+    cycle: Optional[str] = None
+    billing_type: Optional[str] = None
+    next_due_date: Optional[date] = None
+    description: Optional[str] = None
+    latest_payments: List[AsaasPaymentSummary] = [] # Mais recente primeiro
+
+# Histórico de cobranças (GET /subscriptions/{subscription_id}/payments)
+class PaymentListResponse(BaseModel):
+    items: List[AsaasPaymentSummary]
+    next_cursor: Optional[str] = None # Passe em ?cursor= para obter a próxima página
+    total_count: Optional[int] = None # Total de cobranças da assinatura no Asaas
+
+class SubscriptionDetailsExpanded(SubscriptionDetails):
+    asaas: Optional[AsaasSubscriptionInfo] = None # Presente apenas com ?expand=asaas
+
+# Operações em lote do /admin (POST /admin/subscriptions/bulk-cancel e /bulk-update)
+class BulkCancelRequest(BaseModel):
+    subscription_ids: List[str]
+
+class BulkUpdateRequest(BaseModel):
+    subscription_ids: List[str]
+    plan: Optional[str] = None # Novo plano (gravado em public.subscriptions e no externalReference do Asaas)
+    value: Optional[float] = None # Novo valor da assinatura no Asaas
+    update_pending_payments: bool = False # Aplica o novo valor também às cobranças pendentes
+
+# Modelo para resposta da listagem paginada (GET /subscriptions)
+class SubscriptionListResponse(BaseModel):
+    items: List[SubscriptionDetails]
+    next_cursor: Optional[str] = None # Passe em ?cursor= para obter a próxima página
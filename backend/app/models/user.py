@@ -1,8 +1,10 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
 
+from .subscription import SubscriptionDetails
+
 # Modelos para a tabela users no banco de dados
 class UserDB(BaseModel):
     id: UUID
@@ -35,6 +37,18 @@ class UserLogin(BaseModel):
     email: str
     password: str
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+# Resposta de POST /auth/login e POST /auth/refresh
+class TokenResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    # Troque em POST /auth/refresh por uma nova sessão antes de expires_at, em vez de repetir o login
+    refresh_token: str
+    expires_in: Optional[int] = None # segundos
+    expires_at: Optional[int] = None # epoch em segundos
+
 # Modelo para resposta da API (GET /users/me)
 class UserProfile(BaseModel):
     id: UUID
@@ -45,4 +59,28 @@ class UserProfile(BaseModel):
     asaas_customer_id: Optional[str] = None
     address: Optional[str] = None
     phone: Optional[str] = None
-    description: Optional[str] = None 
\ No newline at end of file
+    description: Optional[str] = None 
+
+# Perfil + assinaturas do usuário logado, carregados juntos pela RPC get_session_context
+class SessionContext(BaseModel):
+    profile: UserProfile
+    subscriptions: List[SubscriptionDetails] = []
+
+    def find_subscription(self, subscription_id: str) -> Optional[SubscriptionDetails]:
+        for subscription in self.subscriptions:
+            if subscription.subscription_id == subscription_id:
+                return subscription
+        return None
+
+# Registro assíncrono (REGISTRATION_MODE=async)
+class RegistrationAccepted(BaseModel):
+    user_id: UUID
+    provisioning_status: str
+    status_url: str
+
+class ProvisioningStatus(BaseModel):
+    user_id: UUID
+    status: str # pending, processing, completed ou failed
+    attempts: int = 0
+    last_error: Optional[str] = None
+    asaas_customer_id: Optional[str] = None
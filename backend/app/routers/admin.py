@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+
+import httpx
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+
+from ..core.config import settings
+from ..dependencies import require_admin
+from ..models.subscription import BulkCancelRequest, BulkUpdateRequest
+from ..models.user import UserProfile
+from ..utils.asaas import asaas_request
+from ..utils.asaas_details import invalidate_asaas_details
+from ..utils.bulk import BulkJob, unique
+from ..utils.pagination import apply_keyset, next_cursor
+from ..utils.supabase import get_supabase_admin, run_supabase
+from ..utils.user_caches import invalidate_user_profile, invalidate_user_entitlements
+
+router = APIRouter()
+
+EXPORT_PAGE_SIZE = 1000
+EXPORT_COLUMNS = ["id", "user_id", "subscription_id", "status", "plan", "created_at", "updated_at"]
+# IDs por consulta ao carregar as assinaturas de uma operação em lote (limita o tamanho da URL do PostgREST)
+BULK_LOOKUP_CHUNK_SIZE = 200
+
+async def _iter_subscription_pages(status_filter: Optional[str], plan: Optional[str]) -> AsyncIterator[list]:
+    """Percorre public.subscriptions com paginação keyset no servidor, uma página por vez."""
+    cursor = None
+    while True:
+        query = get_supabase_admin().from_('subscriptions').select(','.join(EXPORT_COLUMNS))
+        if status_filter:
+            query = query.eq('status', status_filter)
+        if plan:
+            query = query.eq('plan', plan)
+        query = apply_keyset(query, cursor, desc=False).limit(EXPORT_PAGE_SIZE + 1)
+        response = await run_supabase(query.execute)
+        rows = response.data or []
+        yield rows[:EXPORT_PAGE_SIZE]
+        cursor = next_cursor(rows, EXPORT_PAGE_SIZE)
+        if cursor is None:
+            break
+
+async def _ndjson_stream(status_filter: Optional[str], plan: Optional[str]) -> AsyncIterator[str]:
+    async for rows in _iter_subscription_pages(status_filter, plan):
+        if rows:
+            yield "".join(json.dumps(row, default=str) + "\n" for row in rows)
+
+async def _csv_stream(status_filter: Optional[str], plan: Optional[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    async for rows in _iter_subscription_pages(status_filter, plan):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+@router.get("/subscriptions/export", summary="Exporta todas as assinaturas em NDJSON ou CSV (admin)")
+async def export_subscriptions(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status_filter: Optional[str] = Query(None, alias="status"),
+    plan: Optional[str] = Query(None),
+    admin_user: UserProfile = Depends(require_admin)
+):
+    """
+    Exporta public.subscriptions em streaming. As linhas são buscadas em páginas de
+    EXPORT_PAGE_SIZE e enviadas ao cliente à medida que chegam, sem acumular a exportação em memória.
+    """
+    print(f"Exportação de assinaturas ({format}) solicitada por {admin_user.email}")
+    if format == "csv":
+        return StreamingResponse(
+            _csv_stream(status_filter, plan),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="subscriptions.csv"'},
+        )
+    return StreamingResponse(
+        _ndjson_stream(status_filter, plan),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="subscriptions.ndjson"'},
+    )
+
+def _validate_bulk_ids(subscription_ids: List[str]) -> List[str]:
+    ids = unique(sid.strip() for sid in subscription_ids if sid and sid.strip())
+    if not ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Informe ao menos um subscription_id.")
+    if len(ids) > settings.bulk_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"No máximo {settings.bulk_max_items} assinaturas por operação (recebidas {len(ids)})."
+        )
+    return ids
+
+async def _load_subscriptions(subscription_ids: List[str]) -> dict:
+    """Carrega de uma vez as assinaturas da operação: subscription_id -> linha de public.subscriptions."""
+    rows = {}
+    for start in range(0, len(subscription_ids), BULK_LOOKUP_CHUNK_SIZE):
+        chunk = subscription_ids[start:start + BULK_LOOKUP_CHUNK_SIZE]
+        query = get_supabase_admin().from_('subscriptions')\
+            .select('subscription_id, user_id, status, plan')\
+            .in_('subscription_id', chunk)
+        response = await run_supabase(query.execute)
+        for row in response.data or []:
+            rows[row['subscription_id']] = row
+    return rows
+
+def _describe_asaas_error(error: Exception) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"Asaas respondeu {error.response.status_code}: {error.response.text[:500]}"
+    if isinstance(error, httpx.HTTPError):
+        return f"Erro na comunicação com Asaas: {error}"
+    return f"Erro inesperado: {error}"
+
+async def _invalidate_caches(values: List[dict]) -> None:
+    for user_id in {v["user_id"] for v in values if v.get("user_id")}:
+        await invalidate_user_profile(user_id)
+        await invalidate_user_entitlements(user_id)
+    for value in values:
+        await invalidate_asaas_details(value.get("subscription_id"))
+
+async def _prepare_bulk(name: str, subscription_ids: List[str]) -> tuple:
+    """
+    Valida os IDs e carrega as assinaturas. Retorna (linhas do banco por subscription_id,
+    IDs a processar, linhas de resultado já definidas para os IDs descartados).
+    """
+    ids = _validate_bulk_ids(subscription_ids)
+    try:
+        known = await _load_subscriptions(ids)
+    except Exception as e:
+        print(f"{name}: erro ao carregar assinaturas: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro interno do servidor: {e}")
+
+    runnable, rejected = [], []
+    for sid in ids:
+        row = known.get(sid)
+        if row is None:
+            rejected.append({"subscription_id": sid, "result": "error", "error": "Assinatura não encontrada em public.subscriptions."})
+        elif row["status"] == "cancelled":
+            rejected.append({"subscription_id": sid, "result": "skipped", "reason": "Assinatura já cancelada."})
+        else:
+            runnable.append(sid)
+    return known, runnable, rejected
+
+def _bulk_response(job: BulkJob, rejected: List[dict]) -> StreamingResponse:
+    for line in rejected:
+        job.emit(line)
+    return StreamingResponse(job.start().lines(), media_type="application/x-ndjson")
+@router.post("/subscriptions/bulk-cancel", summary="Cancela várias assinaturas no Asaas e no banco (admin)")
+async def bulk_cancel_subscriptions(payload: BulkCancelRequest, admin_user: UserProfile = Depends(require_admin)):
+    """
+    Cancela as assinaturas informadas no Asaas, com concorrência e ritmo limitados
+    (ASAAS_BULK_CONCURRENCY, ASAAS_BULK_RATE_PER_SECOND), e grava o status 'cancelled' em lotes.
+    Responde em NDJSON: uma linha por assinatura à medida que terminam e uma linha final com o resumo.
+    """
+    known, runnable, rejected = await _prepare_bulk("Cancelamento em lote", payload.subscription_ids)
+
+    async def cancel(subscription_id: str) -> dict:
+        await asaas_request("DELETE", f"subscriptions/{subscription_id}")
+        return {"subscription_id": subscription_id, "user_id": known[subscription_id]["user_id"], "status": "cancelled"}
+
+    async def write_batch(values: List[dict]) -> dict:
+        # Mesma RPC dos webhooks; o event_at impede que eventos mais antigos reativem a assinatura
+        event_at = datetime.now(timezone.utc).isoformat()
+        updates = [{"subscription_id": v["subscription_id"], "status": "cancelled", "event_at": event_at} for v in values]
+        response = await run_supabase(get_supabase_admin().rpc('apply_subscription_status_updates', {'updates': updates}).execute)
+        await _invalidate_caches(values)
+        # A RPC devolve só as linhas alteradas; as demais já tinham um evento mais recente (ou saíram da tabela)
+        applied = {row["subscription_id"] for row in response.data or []}
+        return {
+            v["subscription_id"]: "Cancelada no Asaas, mas o banco já tinha um status mais recente; status não alterado."
+            for v in values if v["subscription_id"] not in applied
+        }
+
+    print(f"Cancelamento em lote de {len(runnable)} assinaturas solicitado por {admin_user.email}")
+    job = BulkJob("Cancelamento em lote", runnable, cancel, write_batch, settings.bulk_write_batch_size,
+                  describe_error=_describe_asaas_error)
+    return _bulk_response(job, rejected)
+
+@router.post("/subscriptions/bulk-update", summary="Altera plano e/ou valor de várias assinaturas (admin)")
+async def bulk_update_subscriptions(payload: BulkUpdateRequest, admin_user: UserProfile = Depends(require_admin)):
+    """
+    Atualiza o valor (e o plano, guardado no externalReference) das assinaturas no Asaas,
+    com concorrência e ritmo limitados, e grava o novo plano em public.subscriptions em lotes.
+    Responde em NDJSON, como /subscriptions/bulk-cancel.
+    """
+    if payload.plan is None and payload.value is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Informe plan e/ou value.")
+
+    # Chave de idempotência por operação e assinatura: permite repetir POSTs que receberem 429/5xx
+    job_id = uuid.uuid4().hex
+    asaas_payload = {}
+    if payload.value is not None:
+        asaas_payload["value"] = payload.value
+        asaas_payload["updatePendingPayments"] = payload.update_pending_payments
+    if payload.plan is not None:
+        asaas_payload["externalReference"] = payload.plan
+
+    known, runnable, rejected = await _prepare_bulk("Atualização em lote", payload.subscription_ids)
+
+    async def update(subscription_id: str) -> dict:
+        await asaas_request(
+            "POST", f"subscriptions/{subscription_id}", data=asaas_payload,
+            idempotency_key=f"bulk-update-{job_id}-{subscription_id}",
+        )
+        row = known[subscription_id]
+        result = {"subscription_id": subscription_id, "user_id": row["user_id"], "plan": payload.plan or row["plan"]}
+        if payload.value is not None:
+            result["value"] = payload.value
+        return result
+
+    async def write_batch(values: List[dict]) -> None:
+        if payload.plan is None:
+            return # O valor fica só no Asaas; public.subscriptions não guarda valor
+        updates = [{"subscription_id": v["subscription_id"], "plan": payload.plan} for v in values]
+        await run_supabase(get_supabase_admin().rpc('update_subscription_plans', {'updates': updates}).execute)
+        await _invalidate_caches(values)
+
+    print(f"Atualização em lote de {len(runnable)} assinaturas ({asaas_payload}) solicitada por {admin_user.email}")
+    job = BulkJob("Atualização em lote", runnable, update, write_batch, settings.bulk_write_batch_size,
+                  describe_error=_describe_asaas_error)
+    return _bulk_response(job, rejected)
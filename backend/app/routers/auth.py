@@ -1,35 +1,102 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from supabase import Client
-import requests
+import hashlib
+import logging
+import math
+import secrets
+import httpx
+from typing import Optional
+from uuid import UUID
 from fastapi.security import OAuth2PasswordBearer
 from postgrest.exceptions import APIError
+from gotrue.errors import AuthApiError, AuthError, AuthRetryableError
 
-from ..models.user import UserRegister, UserLogin, UserProfile
-from ..utils.supabase import supabase_client, supabase_admin
-from ..utils.asaas import asaas_request, create_asaas_customer
-from ..dependencies import get_current_user
+from ..models.user import UserRegister, UserLogin, UserProfile, RegistrationAccepted, ProvisioningStatus, RefreshTokenRequest, TokenResponse
+from ..utils.supabase import get_supabase_client, get_supabase_admin, run_supabase
+from ..utils.asaas import asaas_request, create_asaas_customer, CircuitOpenError
+from ..utils.provisioning import provisioning_worker
+from ..utils.idempotency import idempotency_store, request_fingerprint, scoped_key, validate_idempotency_key
+from ..utils.admission import admission, check_login_rate
+from ..utils.singleflight import single_flight
+from ..dependencies import get_current_user, oauth2_scheme
+from ..utils.user_caches import invalidate_user_profile
+from ..core.config import settings
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-@router.post("/register", summary="Registra um novo usuário e cria um cliente no Asaas", response_model=UserProfile, status_code=201)
-async def register_user(user_data: UserRegister):
-    print("DEBUG: Rota /auth/register iniciada")
+def _status_token_hash(status_token: str) -> str:
+    # Só o hash fica no banco: quem lê a tabela não consegue montar a URL de status
+    return hashlib.sha256(status_token.encode()).hexdigest()
+
+async def _register_user_async(user_data: UserRegister) -> JSONResponse:
+    """
+    Registro com REGISTRATION_MODE=async: cria o usuário no Supabase Auth e, numa única RPC, o perfil
+    e o job de provisionamento. O cliente do Asaas é criado depois pelo provisioning_worker.
+    """
+    auth_response = await run_supabase(
+        get_supabase_admin().auth.sign_up,
+        {"email": user_data.email, "password": user_data.password}
+    )
+    if not auth_response or not auth_response.user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Erro ao registrar no Supabase Auth.")
+    user_id = str(auth_response.user.id)
+    # Logo após o registro o cliente pode não ter token de acesso (ex.: confirmação de e-mail pendente);
+    # a status_url usa um token aleatório em vez do user_id, que não é segredo
+    status_token = secrets.token_urlsafe(32)
+
+    rpc_params = {
+        'user_id': user_id,
+        'user_email': user_data.email,
+        'user_username': user_data.username,
+        'user_name': user_data.name,
+        'user_cpf_cnpj': user_data.cpf_cnpj,
+        'user_address': user_data.address,
+        'user_phone': user_data.phone,
+        'user_description': user_data.description,
+        'user_status_token_hash': _status_token_hash(status_token),
+    }
+    rpc_result = await run_supabase(get_supabase_admin().rpc('insert_new_user_pending', rpc_params).execute)
+    result = rpc_result.data[0] if isinstance(rpc_result.data, list) and rpc_result.data else rpc_result.data
+    if not isinstance(result, dict) or result.get('success') is not True:
+        error = result.get('error') if isinstance(result, dict) else result
+        logger.error("Usuário %s permanecerá no Supabase Auth mas não está completamente registrado: %s", user_id, error)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Falha na etapa de inserção de dados: {error}")
+
+    await invalidate_user_profile(user_id)
+    provisioning_worker.notify()
+    logger.info("Usuário %s registrado; criação do cliente Asaas enfileirada", user_id)
+    accepted = RegistrationAccepted(
+        user_id=user_id,
+        provisioning_status="pending",
+        status_url=f"/auth/register/status/{status_token}",
+    )
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=accepted.model_dump(mode="json"))
+
+async def _register_user(user_data: UserRegister, idempotency_key: Optional[str] = None):
+    if settings.registration_mode == "async":
+        try:
+            return await _register_user_async(user_data)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception("Erro inesperado no registro assíncrono")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro interno inesperado no servidor: {str(e)}")
     try:
-        print(f"DEBUG: Dados recebidos para registro: {user_data.email}")
         # 1. Registrar usuário no Supabase Auth
-        print("DEBUG: Tentando registrar usuário no Supabase Auth...")
-        auth_response = supabase_admin.auth.sign_up(
+        auth_response = await run_supabase(
+            get_supabase_admin().auth.sign_up,
             {"email": user_data.email, "password": user_data.password}
         )
-        print(f"DEBUG: Resposta Supabase Auth sign_up: {auth_response}")
 
         if not auth_response or not auth_response.user:
-            print("DEBUG: Erro no registro do Supabase Auth ou usuário nulo.")
+            logger.warning("Supabase Auth não retornou usuário no registro")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Erro ao registrar no Supabase Auth.")
 
         user_id = auth_response.user.id
-        print(f"DEBUG: Usuário registrado no Supabase Auth com ID: {user_id}")
+        logger.debug("Usuário %s registrado no Supabase Auth", user_id)
 
         # Nota importante: Não estamos mais tentando excluir o usuário do Auth em caso de falha
         # Como isso exige permissões administrativas especiais, estamos optando por uma abordagem
@@ -46,30 +113,31 @@ async def register_user(user_data: UserRegister):
             "description": user_data.description
         }
         
-        print(f"DEBUG: Payload SIMPLIFICADO para criar cliente Asaas: {asaas_customer_payload}")
         try:
-            print("DEBUG: Tentando criar cliente no Asaas (simplificado)...")
-            asaas_customer_data = create_asaas_customer(asaas_customer_payload)
-            print(f"DEBUG: Resposta Asaas create_customer: {asaas_customer_data}")
+            asaas_customer_data = await create_asaas_customer(asaas_customer_payload, idempotency_key=idempotency_key)
             asaas_customer_id = asaas_customer_data.get("id")
 
             if not asaas_customer_id:
-                print("DEBUG: Cliente Asaas não criado ou ID nulo.")
                 # Não tentamos mais apagar o usuário Auth, apenas registramos o erro
-                print(f"DEBUG: ATENÇÃO: Usuário {user_id} permanecerá no Supabase Auth mas não está completamente registrado.")
+                logger.error("Asaas não retornou o ID do cliente; usuário %s permanecerá no Supabase Auth mas não está completamente registrado", user_id)
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro ao criar cliente no Asaas: ID do cliente não retornado. Resposta Asaas: {asaas_customer_data}")
             
-            print(f"DEBUG: Cliente Asaas criado com ID: {asaas_customer_id}")
+            logger.debug("Cliente Asaas %s criado para o usuário %s", asaas_customer_id, user_id)
 
-        except requests.exceptions.RequestException as e_asaas_req:
-            print(f"DEBUG: Erro de requisição ao Asaas: {e_asaas_req}")
+        except CircuitOpenError as e_asaas_open:
+            logger.error("Asaas indisponível (circuito aberto); usuário %s permanecerá no Supabase Auth mas não está completamente registrado: %s", user_id, e_asaas_open)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Asaas temporariamente indisponível. Tente novamente em instantes.",
+                headers={"Retry-After": str(int(e_asaas_open.retry_after) + 1)},
+            )
+        except httpx.HTTPError as e_asaas_req:
             # Não tentamos mais apagar o usuário Auth, apenas registramos o erro
-            print(f"DEBUG: ATENÇÃO: Usuário {user_id} permanecerá no Supabase Auth mas não está completamente registrado.")
+            logger.error("Erro de requisição ao Asaas; usuário %s permanecerá no Supabase Auth mas não está completamente registrado: %s", user_id, e_asaas_req)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro na comunicação com Asaas: {e_asaas_req}")
         except Exception as e_asaas_generic:
-            print(f"DEBUG: Erro genérico ao criar cliente Asaas: {e_asaas_generic}")
             # Não tentamos mais apagar o usuário Auth, apenas registramos o erro
-            print(f"DEBUG: ATENÇÃO: Usuário {user_id} permanecerá no Supabase Auth mas não está completamente registrado.")
+            logger.exception("Erro ao criar cliente Asaas; usuário %s permanecerá no Supabase Auth mas não está completamente registrado", user_id)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro inesperado ao processar com Asaas: {e_asaas_generic}")
 
         # 3. Inserir dados adicionais do usuário utilizando função RPC em vez de inserção direta
@@ -77,7 +145,6 @@ async def register_user(user_data: UserRegister):
         asaas_customer_id_for_rollback = asaas_customer_id
 
         try:
-            print("DEBUG: Tentando inserir usuário através da função RPC insert_new_user...")
             rpc_params = {
                 'user_id': user_id_for_debug,
                 'user_email': user_data.email,
@@ -90,9 +157,8 @@ async def register_user(user_data: UserRegister):
                 'user_description': user_data.description
             }
             
-            rpc_call_result = supabase_admin.rpc('insert_new_user', rpc_params).execute()
+            rpc_call_result = await run_supabase(get_supabase_admin().rpc('insert_new_user', rpc_params).execute)
             
-            print(f"DEBUG: Resposta DIRETA da função RPC (pós-execute, se não houve exceção APIError): data='{rpc_call_result.data}', error='{rpc_call_result.error}', status_code='{rpc_call_result.status_code}'")
 
             rpc_error_detail_msg = None
             is_rpc_successful = False
@@ -100,7 +166,6 @@ async def register_user(user_data: UserRegister):
             if rpc_call_result.error:
                 if isinstance(rpc_call_result.error, dict) and rpc_call_result.error.get('success') is True:
                     is_rpc_successful = True
-                    print(f"DEBUG: RPC indica sucesso via rpc_call_result.error. Dados: {rpc_call_result.error}")
                 else:
                     err_msg = getattr(rpc_call_result.error, 'message', str(rpc_call_result.error))
                     rpc_error_detail_msg = f"Campo 'error' presente na resposta da RPC (não exceção): {err_msg}"
@@ -124,7 +189,6 @@ async def register_user(user_data: UserRegister):
                 if data_to_check and isinstance(data_to_check, dict):
                     if data_to_check.get('success') is True:
                         is_rpc_successful = True
-                        print(f"DEBUG: RPC indica sucesso nos dados retornados em rpc_call_result.data. Dados: {data_to_check}")
                     else:
                         error_from_data = data_to_check.get('error', 'Campo "error" não encontrado ou "success" não é true nos dados da RPC.')
                         rpc_error_detail_msg = f"RPC não indicou sucesso ('success': true) nos dados de rpc_call_result.data: {error_from_data}. Dados: {data_to_check}"
@@ -133,108 +197,248 @@ async def register_user(user_data: UserRegister):
 
             if not is_rpc_successful:
                 final_error_message = f"Falha na etapa de inserção de dados (análise da resposta RPC): {rpc_error_detail_msg or 'Erro desconhecido na lógica de processamento da RPC.'}"
-                print(f"DEBUG: {final_error_message}")
+                logger.error("Usuário %s: %s", user_id_for_debug, final_error_message)
                 
                 if asaas_customer_id_for_rollback:
                     try:
-                        print(f"DEBUG: Tentando rollback (falha na análise da RPC) - deletar cliente Asaas {asaas_customer_id_for_rollback}.")
-                        asaas_request("DELETE", f"customers/{asaas_customer_id_for_rollback}")
-                        print(f"DEBUG: Cliente Asaas {asaas_customer_id_for_rollback} deletado.")
+                        await asaas_request("DELETE", f"customers/{asaas_customer_id_for_rollback}")
+                        logger.info("Rollback: cliente Asaas %s removido", asaas_customer_id_for_rollback)
                     except Exception as e_delete_asaas:
-                        print(f"DEBUG: Erro ao deletar cliente Asaas {asaas_customer_id_for_rollback} durante rollback: {e_delete_asaas}")
+                        logger.error("Erro ao remover o cliente Asaas %s durante o rollback: %s", asaas_customer_id_for_rollback, e_delete_asaas)
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=final_error_message)
 
         except HTTPException:
             raise
         except APIError as e_api_error:
-            print(f"DEBUG: APIError da PostgREST capturada. Tipo: {type(e_api_error)}, Detalhes: {e_api_error}")
-            
             error_payload = None
             try:
                 error_payload = e_api_error.json()
-                print(f"DEBUG: Payload JSON da APIError: {error_payload}")
-            except Exception as json_parse_err:
-                print(f"DEBUG: Não foi possível parsear JSON da APIError ou e_api_error.json() não é um método/não existe: {json_parse_err}. Conteúdo da exceção: {e_api_error}")
+            except Exception:
+                pass # Sem corpo JSON: tratada como falha abaixo
 
             if isinstance(error_payload, dict) and error_payload.get('success') is True:
-                print(f"DEBUG: APIError continha um payload de SUCESSO da RPC: {error_payload}. Tratando como sucesso e prosseguindo SEM rollback.")
+                logger.debug("APIError da RPC insert_new_user com payload de sucesso; seguindo sem rollback")
             else:
-                print(f"DEBUG: APIError tratada como FALHA. Payload: {error_payload if error_payload else 'N/A'}. Rollback será efetuado.")
                 if asaas_customer_id_for_rollback:
                     try:
-                        print(f"DEBUG: Tentando rollback (APIError como falha) - deletar cliente Asaas {asaas_customer_id_for_rollback}.")
-                        asaas_request("DELETE", f"customers/{asaas_customer_id_for_rollback}")
-                        print(f"DEBUG: Cliente Asaas {asaas_customer_id_for_rollback} deletado.")
+                        await asaas_request("DELETE", f"customers/{asaas_customer_id_for_rollback}")
+                        logger.info("Rollback: cliente Asaas %s removido", asaas_customer_id_for_rollback)
                     except Exception as e_delete_asaas_api_err:
-                        print(f"DEBUG: Erro ao deletar cliente Asaas {asaas_customer_id_for_rollback} durante rollback: {e_delete_asaas_api_err}")
+                        logger.error("Erro ao remover o cliente Asaas %s durante o rollback: %s", asaas_customer_id_for_rollback, e_delete_asaas_api_err)
                 
                 final_error_message = f"Erro da API PostgREST ao salvar dados do usuário: {str(error_payload or e_api_error)}"
-                print(f"DEBUG: ATENÇÃO: Usuário {user_id_for_debug} permanecerá no Supabase Auth mas não está completamente registrado devido a: {final_error_message}")
+                logger.error("Usuário %s permanecerá no Supabase Auth mas não está completamente registrado: %s", user_id_for_debug, final_error_message)
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=final_error_message)
         
         except Exception as e_general_unexpected:
-            print(f"DEBUG: Exceção GENÉRICA INESPERADA capturada (não HTTPException, não APIError). Tipo: {type(e_general_unexpected)}, Conteúdo: {e_general_unexpected}")
+            logger.exception("Erro inesperado ao salvar os dados do usuário %s", user_id_for_debug)
             if asaas_customer_id_for_rollback:
                 try:
-                    print(f"DEBUG: Tentando rollback (exceção genérica) - deletar cliente Asaas {asaas_customer_id_for_rollback}.")
-                    asaas_request("DELETE", f"customers/{asaas_customer_id_for_rollback}")
-                    print(f"DEBUG: Cliente Asaas {asaas_customer_id_for_rollback} deletado.")
+                    await asaas_request("DELETE", f"customers/{asaas_customer_id_for_rollback}")
+                    logger.info("Rollback: cliente Asaas %s removido", asaas_customer_id_for_rollback)
                 except Exception as e_delete_asaas_general_err:
-                    print(f"DEBUG: Erro ao deletar cliente Asaas {asaas_customer_id_for_rollback} durante rollback: {e_delete_asaas_general_err}")
-            
-            print(f"DEBUG: ATENÇÃO: Usuário {user_id_for_debug} permanecerá no Supabase Auth mas não está completamente registrado devido a erro inesperado.")
+                    logger.error("Erro ao remover o cliente Asaas %s durante o rollback: %s", asaas_customer_id_for_rollback, e_delete_asaas_general_err)
+            logger.error("Usuário %s permanecerá no Supabase Auth mas não está completamente registrado", user_id_for_debug)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro crítico e inesperado no servidor: {e_general_unexpected}")
 
-        print(f"DEBUG: Usuário {user_id_for_debug} registrado e dados salvos com sucesso (após lógica RPC e tratamento de exceções).")
-        print(f"DEBUG: Buscando perfil do usuário {user_id_for_debug} para resposta.")
-        profile_response = supabase_admin.from_('users').select("*").eq('id', str(user_id)).single().execute()
-        print(f"DEBUG: Resposta da busca de perfil: {profile_response}")
+        logger.info("Usuário %s registrado", user_id_for_debug)
+        await invalidate_user_profile(user_id_for_debug)
+        profile_response = await run_supabase(get_supabase_admin().from_('users').select("*").eq('id', str(user_id)).single().execute)
         if not profile_response.data:
-            print(f"DEBUG: Falha ao buscar perfil do usuário {user_id} após registro.")
+            logger.warning("Perfil do usuário %s não encontrado após o registro", user_id)
             return {"message": "Usuário registrado com sucesso, mas falha ao obter perfil detalhado.", "user_id": user_id}
         
         return UserProfile(**profile_response.data)
 
     except HTTPException as e_http:
-        print(f"DEBUG: HTTPException capturada na rota /register: {e_http.detail}")
         raise e_http
     except Exception as e_general:
-        print(f"DEBUG: Exceção genérica não tratada na rota /register: {e_general}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Erro inesperado no registro")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro interno inesperado no servidor: {str(e_general)}")
 
-@router.post("/login", summary="Realiza login e retorna tokens")
-async def login_user(user_data: UserLogin, supabase: Client = Depends(lambda: supabase_client)):
+@router.post(
+    "/register",
+    summary="Registra um novo usuário e cria um cliente no Asaas",
+    response_model=UserProfile,
+    status_code=201,
+    dependencies=[Depends(admission("asaas"))],
+    responses={202: {"model": RegistrationAccepted, "description": "Registro aceito; cliente do Asaas em provisionamento (REGISTRATION_MODE=async)"}},
+)
+async def register_user(user_data: UserRegister, idempotency_key: Optional[str] = Header(None)):
+    """
+    Com o cabeçalho Idempotency-Key, uma repetição do mesmo registro (ex.: após timeout no cliente)
+    devolve a resposta original sem chamar Supabase ou Asaas novamente.
+    """
+    idempotency_key = validate_idempotency_key(idempotency_key)
+    if idempotency_key is None:
+        return await _register_user(user_data)
+    key = scoped_key("register", user_data.email.strip().lower(), idempotency_key)
+    return await idempotency_store.run(
+        key,
+        request_fingerprint(user_data),
+        lambda: _register_user(user_data, idempotency_key=key),
+        status_code=status.HTTP_201_CREATED,
+    )
+
+def _provisioning_status(user_id, asaas_customer_id: Optional[str], job: Optional[dict]) -> ProvisioningStatus:
+    if job is None:
+        # Usuários registrados no modo síncrono não têm job: o cliente já foi criado no registro
+        return ProvisioningStatus(
+            user_id=user_id,
+            status="completed" if asaas_customer_id else "failed",
+            asaas_customer_id=asaas_customer_id,
+        )
+    return ProvisioningStatus(
+        user_id=user_id,
+        status=job['status'],
+        attempts=job['attempts'],
+        last_error=job.get('last_error'),
+        asaas_customer_id=asaas_customer_id,
+    )
+
+@router.get("/register/status/{status_token}", summary="Consulta o provisionamento do cliente Asaas pelo token devolvido no registro", response_model=ProvisioningStatus)
+async def get_registration_status_by_token(status_token: str):
+    """Para o cliente que ainda não tem sessão: o token da status_url do 202 identifica o registro."""
+    job_response = await run_supabase(
+        get_supabase_admin().from_('user_provisioning_jobs')
+        .select('user_id, status, attempts, last_error')
+        .eq('status_token_hash', _status_token_hash(status_token))
+        .execute
+    )
+    if not job_response.data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Registro não encontrado.")
+    job = job_response.data[0]
+    user_response = await run_supabase(
+        get_supabase_admin().from_('users').select('asaas_customer_id').eq('id', job['user_id']).execute
+    )
+    asaas_customer_id = user_response.data[0].get('asaas_customer_id') if user_response.data else None
+    return _provisioning_status(job['user_id'], asaas_customer_id, job)
+
+@router.get("/register/{user_id}/status", summary="Consulta o provisionamento do cliente Asaas do usuário logado", response_model=ProvisioningStatus)
+async def get_registration_status(user_id: UUID, current_user: UserProfile = Depends(get_current_user)):
+    # Só o próprio usuário; 404 em vez de 403 para não confirmar que o id existe
+    if current_user.id != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Registro não encontrado.")
+    job_response = await run_supabase(
+        get_supabase_admin().from_('user_provisioning_jobs')
+        .select('status, attempts, last_error')
+        .eq('user_id', str(user_id))
+        .execute
+    )
+    job = job_response.data[0] if job_response.data else None
+    return _provisioning_status(user_id, current_user.asaas_customer_id, job)
+
+def _token_response(session) -> TokenResponse:
+    return TokenResponse(
+        access_token=session.access_token,
+        refresh_token=session.refresh_token,
+        expires_in=session.expires_in,
+        expires_at=session.expires_at,
+    )
+
+def _auth_unavailable(e: Exception) -> Optional[HTTPException]:
+    """
+    Limite de taxa do Supabase Auth vira 429 e falhas de rede/5xx viram 503, ambos com Retry-After,
+    para que o cliente espere e repita a mesma chamada em vez de voltar ao login com senha.
+    """
+    headers = {"Retry-After": str(math.ceil(settings.auth_retry_after))}
+    if isinstance(e, AuthError) and getattr(e, "status", None) == 429:
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Muitas requisições ao serviço de autenticação. Tente novamente em instantes.",
+            headers=headers,
+        )
+    if isinstance(e, AuthRetryableError) or (isinstance(e, AuthApiError) and e.status >= 500):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Serviço de autenticação temporariamente indisponível. Tente novamente em instantes.",
+            headers=headers,
+        )
+    return None
+
+@router.post("/login", response_model=TokenResponse, summary="Realiza login e retorna tokens", dependencies=[Depends(admission("auth"))])
+async def login_user(request: Request, user_data: UserLogin, supabase: Client = Depends(get_supabase_client)):
+    """
+    Autentica com e-mail e senha. Além do access_token, retorna o refresh_token e a expiração:
+    renove a sessão em POST /auth/refresh, que não passa pela verificação de senha.
+    """
+    # Limite de tentativas por IP e por e-mail (429 com Retry-After) antes de chamar o Supabase Auth
+    await check_login_rate(request.client.host if request.client else None, user_data.email)
     try:
-        auth_response = supabase.auth.sign_in_with_password(
+        auth_response = await run_supabase(
+            supabase.auth.sign_in_with_password,
             {"email": user_data.email, "password": user_data.password}
         )
-        if auth_response.session is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas")
-
-        return {
-            "access_token": auth_response.session.access_token,
-            "token_type": "bearer"
-        }
     except Exception as e:
         # Supabase client pode levantar exceções para credenciais inválidas também
         if "Invalid login credentials" in str(e):
              raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas")
+        unavailable = _auth_unavailable(e)
+        if unavailable is not None:
+            logger.warning("Supabase Auth indisponível no login: %s", e)
+            raise unavailable
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+    if auth_response.session is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas")
+    return _token_response(auth_response.session)
+
+@router.post("/refresh", response_model=TokenResponse, summary="Troca um refresh token por uma nova sessão", dependencies=[Depends(admission("auth"))])
+async def refresh_session(payload: RefreshTokenRequest, supabase: Client = Depends(get_supabase_client)):
+    """
+    Troca o refresh_token recebido no login (ou na última renovação) por uma nova sessão.
+    O Supabase rotaciona o refresh token: guarde o novo, o anterior deixa de valer.
+    """
+    refresh_token = payload.refresh_token.strip()
+    if not refresh_token:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Informe o refresh_token.")
+
+    # Abas do mesmo usuário costumam renovar juntas com o mesmo refresh token; como ele só pode ser
+    # usado uma vez, as requisições simultâneas compartilham a mesma troca. O resultado só é entregue
+    # a quem apresentou esse mesmo token.
+    token_key = hashlib.sha256(refresh_token.encode()).hexdigest()
+    try:
+        auth_response = await single_flight.do(
+            "supabase_refresh_session", token_key, lambda: run_supabase(supabase.auth.refresh_session, refresh_token)
+        )
+    except Exception as e:
+        unavailable = _auth_unavailable(e)
+        if unavailable is not None:
+            logger.warning("Supabase Auth indisponível ao renovar sessão: %s", e)
+            raise unavailable
+        if isinstance(e, AuthError):
+            # Token inexistente, expirado, revogado ou já usado
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Refresh token inválido ou expirado. Faça login novamente.",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        logger.exception("Erro inesperado ao renovar sessão")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro interno ao renovar sessão: {e}")
+
+    if auth_response.session is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token inválido ou expirado. Faça login novamente.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return _token_response(auth_response.session)
+
 # A rota de logout geralmente é feita no frontend invalidando o token.
 # No entanto, se quisermos invalidar a sessão no backend:
-@router.post("/logout", summary="Realiza logout (invalida a sessão no Supabase)")
-async def logout_user(current_user: UserProfile = Depends(get_current_user), supabase: Client = Depends(lambda: supabase_client)):
+@router.post("/logout", summary="Realiza logout (invalida a sessão no Supabase)", dependencies=[Depends(admission("auth"))])
+async def logout_user(
+    current_user: UserProfile = Depends(get_current_user),
+    token: str = Depends(oauth2_scheme),
+    supabase: Client = Depends(get_supabase_client),
+):
     try:
-        # O cliente Supabase, ao usar a dependência get_current_user,
-        # já deve estar configurado com o token da requisição.
-        # Chamar sign_out() irá invalidar a sessão associada a este cliente.
-        supabase.auth.sign_out()
+        # O cliente Supabase é compartilhado por todas as requisições: auth.sign_out() encerraria a sessão
+        # guardada nele, não a de quem chamou. admin.sign_out(token) revoga a sessão do token da requisição.
+        await run_supabase(supabase.auth.admin.sign_out, token)
         return {"message": "Logout realizado com sucesso"}
     except Exception as e:
-         print(f"Erro durante o logout: {e}")
+         logger.error("Erro durante o logout: %s", e)
          raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro durante o logout: {e}")
 
 # Remover a definição temporária de get_current_user_token que não é usada aqui.
@@ -1,26 +1,77 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from supabase import Client
-import requests
+import json
+from typing import AsyncIterator, List, Optional
 
-from ..dependencies import get_current_user
-from ..models.subscription import SubscriptionCreatePayload, SubscriptionDB, SubscriptionCancelResponse, SubscriptionDetails, CreditCardHolderInfoAsaas
-from ..models.user import UserProfile
-from ..utils.asaas import asaas_request
-from ..utils.supabase import supabase_client
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Request, Query
+from fastapi.responses import StreamingResponse
+from postgrest import SyncPostgrestClient
+import httpx
+
+from ..dependencies import get_current_user, get_current_session, get_user_postgrest
+from ..utils.user_caches import invalidate_user_profile, invalidate_user_entitlements
+from ..models.subscription import SubscriptionCreatePayload, SubscriptionDB, SubscriptionCancelResponse, SubscriptionDetails, SubscriptionDetailsExpanded, CreditCardHolderInfoAsaas, SubscriptionListResponse, PaymentListResponse, AsaasPaymentSummary
+from ..models.user import UserProfile, SessionContext
+from ..utils.asaas import asaas_request, CircuitOpenError
+from ..utils.asaas_details import get_asaas_details, get_payments_page, iter_all_payments, invalidate_asaas_details
+from ..utils.supabase import get_supabase_admin, run_supabase
+from ..utils.pagination import apply_keyset, next_cursor, decode_offset_cursor, InvalidCursorError
+from ..utils.idempotency import idempotency_store, request_fingerprint, scoped_key, validate_idempotency_key
+from ..utils.admission import admission
+from ..utils.singleflight import single_flight
+from ..utils.etag import conditional_response, json_representation, session_representations
 
 router = APIRouter()
 
-@router.post("/create", summary="Cria uma nova assinatura no Asaas e registra no banco de dados")
+async def _find_owned_subscription(subscription_id: str, session: SessionContext, supabase: SyncPostgrestClient) -> Optional[SubscriptionDetails]:
+    """
+    Procura a assinatura entre as já carregadas no contexto da sessão; só consulta o banco se ela
+    não estiver lá (ex.: criada por outro worker depois que o contexto foi para o cache).
+    """
+    subscription = session.find_subscription(subscription_id)
+    if subscription is not None:
+        return subscription
+
+    user_id = str(session.profile.id)
+
+    async def lookup() -> Optional[SubscriptionDetails]:
+        query = supabase.from_('subscriptions')\
+            .select('*')\
+            .eq('subscription_id', subscription_id)\
+            .eq('user_id', user_id)\
+            .limit(1)
+        response = await run_supabase(query.execute)
+        return SubscriptionDetails(**response.data[0]) if response.data else None
+
+    # Leituras simultâneas da mesma assinatura compartilham um único select
+    return await single_flight.do("subscription_lookup", (user_id, subscription_id), lookup)
+
+@router.post("/create", summary="Cria uma nova assinatura no Asaas e registra no banco de dados", dependencies=[Depends(admission("asaas"))])
 async def create_subscription(
     request: Request,
     subscription_payload: SubscriptionCreatePayload,
     current_user: UserProfile = Depends(get_current_user),
-    supabase: Client = Depends(lambda: supabase_client)
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Cria uma nova assinatura no Asaas para o usuário autenticado
     e registra os detalhes no banco de dados.
+    Com o cabeçalho Idempotency-Key, repetições da mesma criação devolvem a resposta original.
     """
+    idempotency_key = validate_idempotency_key(idempotency_key)
+    if idempotency_key is None:
+        return await _create_subscription(request, subscription_payload, current_user)
+    key = scoped_key("subscription", str(current_user.id), idempotency_key)
+    return await idempotency_store.run(
+        key,
+        request_fingerprint(subscription_payload),
+        lambda: _create_subscription(request, subscription_payload, current_user, idempotency_key=key),
+    )
+
+async def _create_subscription(
+    request: Request,
+    subscription_payload: SubscriptionCreatePayload,
+    current_user: UserProfile,
+    idempotency_key: Optional[str] = None
+):
     if not current_user.asaas_customer_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -36,6 +87,8 @@ async def create_subscription(
         "value": subscription_payload.value,
         "cycle": subscription_payload.cycle,
         "description": subscription_payload.description,
+        # Guarda o plano no Asaas para que a reconciliação (app.jobs.reconcile_subscriptions) possa compará-lo
+        "externalReference": subscription_payload.plan,
     }
 
     if subscription_payload.billing_type == "CREDIT_CARD":
@@ -86,7 +139,7 @@ async def create_subscription(
         # Chamar a API do Asaas para criar a assinatura
         # O endpoint para criar assinatura é POST /v3/subscriptions
         # Ref: https://docs.asaas.com/reference/criar-nova-assinatura
-        asaas_response = asaas_request("POST", "subscriptions", data=asaas_payload)
+        asaas_response = await asaas_request("POST", "subscriptions", data=asaas_payload, idempotency_key=idempotency_key)
         asaas_subscription_data = asaas_response.json()
         asaas_subscription_id = asaas_subscription_data.get("id")
         asaas_subscription_status = asaas_subscription_data.get("status")
@@ -99,15 +152,19 @@ async def create_subscription(
              )
 
         # Inserir os dados da assinatura na tabela public.subscriptions
-        # Nota: A política RLS deve permitir que o usuário autenticado insira seus próprios dados (feito na RLS policy)
+        # Gravada com a chave de serviço: os usuários não têm política de INSERT em subscriptions, já que
+        # status e plano liberam o acesso das rotas com require_active_subscription
         # Assumimos que a coluna 'plan' na tabela subscriptions do Supabase existirá e será preenchida com o campo 'plan' do payload de entrada.
-        response = supabase.from_('subscriptions').insert({
+        insert_query = get_supabase_admin().from_('subscriptions').insert({
             'user_id': str(current_user.id),
             'subscription_id': asaas_subscription_id,
             'status': asaas_subscription_status, # Usar o status retornado pelo Asaas
             'plan': subscription_payload.plan # Usar o plano do payload de entrada
             # created_at e updated_at serão definidos automaticamente pelo banco de dados
-        }).execute()
+        })
+        response = await run_supabase(insert_query.execute)
+        await invalidate_user_profile(current_user.id)
+        await invalidate_user_entitlements(current_user.id)
 
         # Verificar se a inserção no banco de dados foi bem-sucedida
         if not response.data:
@@ -126,7 +183,14 @@ async def create_subscription(
         # Para simplificar, retornaremos uma confirmação e o ID do Asaas e status.
         return {"subscription_id": asaas_subscription_id, "status": asaas_subscription_status}
 
-    except requests.exceptions.RequestException as e:
+    except CircuitOpenError as e:
+        print(f"Asaas indisponível ao criar assinatura: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Asaas temporariamente indisponível. Tente novamente em instantes.",
+            headers={"Retry-After": str(int(e.retry_after) + 1)},
+        )
+    except httpx.HTTPError as e:
         detail = f"Erro na comunicação com Asaas: {e}"
         status_code_val = status.HTTP_500_INTERNAL_SERVER_ERROR
         if hasattr(e, 'response') and e.response is not None:
@@ -144,35 +208,111 @@ async def create_subscription(
         print(f"Erro inesperado ao criar assinatura: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro interno do servidor: {e}")
 
-@router.get("/{subscription_id}", response_model=SubscriptionDetails, summary="Retorna os detalhes de uma assinatura")
+@router.get(
+    "",
+    response_model=SubscriptionListResponse,
+    summary="Lista as assinaturas do usuário logado (paginação por cursor)",
+    responses={304: {"description": "Página sem alterações desde o ETag enviado em If-None-Match"}},
+)
+async def list_subscriptions(
+    request: Request,
+    status_filter: Optional[str] = Query(None, alias="status", description="Filtra pelo status da assinatura"),
+    plan: Optional[str] = Query(None, description="Filtra pelo plano"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Valor de next_cursor da página anterior"),
+    current_user: UserProfile = Depends(get_current_user),
+    supabase: SyncPostgrestClient = Depends(get_user_postgrest)
+):
+    """
+    Lista as assinaturas do usuário autenticado, das mais recentes para as mais antigas.
+    Usa paginação keyset em (created_at, id): cada página custa o mesmo, independente da posição.
+    Responde com ETag da página; com If-None-Match igual, a resposta é 304 sem corpo.
+    """
+    try:
+        query = supabase.from_('subscriptions')\
+            .select('*')\
+            .eq('user_id', str(current_user.id))
+        if status_filter:
+            query = query.eq('status', status_filter)
+        if plan:
+            query = query.eq('plan', plan)
+        query = apply_keyset(query, cursor).limit(limit + 1)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        response = await run_supabase(query.execute)
+    except Exception as e:
+        print(f"Erro ao listar assinaturas do usuário {current_user.id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro interno do servidor: {e}"
+        )
+
+    rows = response.data or []
+    page = SubscriptionListResponse(
+        items=[SubscriptionDetails(**row) for row in rows[:limit]],
+        next_cursor=next_cursor(rows, limit),
+    )
+    return conditional_response(request, json_representation(page))
+
+@router.get(
+    "/{subscription_id}",
+    response_model=SubscriptionDetailsExpanded,
+    summary="Retorna os detalhes de uma assinatura",
+    responses={304: {"description": "Assinatura sem alterações desde o ETag enviado em If-None-Match"}},
+)
 async def get_subscription_details(
+    request: Request,
     subscription_id: str,
-    current_user: UserProfile = Depends(get_current_user),
-    supabase: Client = Depends(lambda: supabase_client)
+    expand: Optional[str] = Query(None, description="Use 'asaas' para incluir valor, próximo vencimento e últimas cobranças do Asaas"),
+    session: SessionContext = Depends(get_current_session),
+    supabase: SyncPostgrestClient = Depends(get_user_postgrest)
 ):
     """
     Retorna os detalhes de uma assinatura específica pertencente ao usuário autenticado.
     O ID da assinatura aqui se refere ao ID gerado pelo Asaas.
+    As assinaturas do usuário já vêm no contexto da sessão, então normalmente não há consulta ao banco.
+    Com ?expand=asaas, inclui os dados do Asaas (em cache por assinatura; webhooks e cancelamentos invalidam).
+    Responde com ETag; com If-None-Match igual, a resposta é 304 sem corpo. Sem expand, o corpo e o
+    ETag ficam guardados no contexto da sessão em cache, então um polling sem mudanças não serializa nada.
     """
-    try:
-        # Buscar a assinatura na tabela public.subscriptions pelo ID do Asaas e pelo ID do usuário logado
-        # A RLS já protege contra acesso a assinaturas de outros usuários, mas filtrar na query é uma boa prática.
-        response = supabase.from_('subscriptions')\
-            .select('*')\
-            .eq('subscription_id', subscription_id)\
-            .eq('user_id', str(current_user.id))\
-            .single()\
-            .execute()
+    if expand not in (None, "asaas"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Valor de expand não suportado. Use 'asaas'.")
 
-        # Verificar se a resposta da query foi bem-sucedida e contém dados
-        if not response.data:
+    try:
+        subscription = await _find_owned_subscription(subscription_id, session, supabase)
+        if subscription is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Assinatura não encontrada ou não pertence a este usuário."
             )
+        if expand is None:
+            if session.find_subscription(subscription_id) is subscription:
+                representation = session_representations.get(
+                    session, (str(session.profile.id), f"subscription:{subscription_id}"), subscription
+                )
+                return conditional_response(request, representation)
+            return conditional_response(request, json_representation(subscription))
 
-        subscription_data = response.data
-        return SubscriptionDetails(**subscription_data)
+        try:
+            asaas_info = await get_asaas_details(subscription_id)
+        except CircuitOpenError as e:
+            print(f"Asaas indisponível ao consultar assinatura {subscription_id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Asaas temporariamente indisponível. Tente novamente em instantes.",
+                headers={"Retry-After": str(int(e.retry_after) + 1)},
+            )
+        except httpx.HTTPError as e:
+            print(f"Erro na comunicação com Asaas ao consultar assinatura {subscription_id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"Erro na comunicação com Asaas: {e}"
+            )
+        return conditional_response(
+            request, json_representation(SubscriptionDetailsExpanded(**subscription.model_dump(), asaas=asaas_info))
+        )
 
     except Exception as e:
         print(f"Erro ao obter detalhes da assinatura {subscription_id}: {e}")
@@ -184,38 +324,121 @@ async def get_subscription_details(
             detail=f"Erro interno do servidor: {e}"
         )
 
-@router.post("/{subscription_id}/cancel", response_model=SubscriptionCancelResponse, summary="Cancela uma assinatura no Asaas e atualiza o status no banco de dados")
+def _asaas_read_error(e: Exception, subscription_id: str) -> HTTPException:
+    """Converte a falha de uma leitura no Asaas na resposta da API (503 com Retry-After ou 502)."""
+    if isinstance(e, CircuitOpenError):
+        print(f"Asaas indisponível ao consultar cobranças da assinatura {subscription_id}: {e}")
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Asaas temporariamente indisponível. Tente novamente em instantes.",
+            headers={"Retry-After": str(int(e.retry_after) + 1)},
+        )
+    print(f"Erro na comunicação com Asaas ao consultar cobranças da assinatura {subscription_id}: {e}")
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Erro na comunicação com Asaas: {e}")
+
+async def _payments_ndjson(subscription_id: str, first: List[AsaasPaymentSummary], pages: AsyncIterator[List[AsaasPaymentSummary]]) -> AsyncIterator[str]:
+    total = 0
+    try:
+        items = first
+        while True:
+            if items:
+                total += len(items)
+                yield "".join(json.dumps(p.model_dump(mode="json")) + "\n" for p in items)
+            items = await pages.__anext__()
+    except StopAsyncIteration:
+        yield json.dumps({"summary": {"total": total}}) + "\n"
+    except Exception as e:
+        # O status 200 já foi enviado: o erro vai como última linha
+        print(f"Erro ao transmitir cobranças da assinatura {subscription_id}: {e}")
+        yield json.dumps({"error": "Falha ao buscar as cobranças restantes no Asaas.", "summary": {"total": total}}) + "\n"
+    finally:
+        await pages.aclose()
+
+@router.get(
+    "/{subscription_id}/payments",
+    response_model=PaymentListResponse,
+    summary="Lista as cobranças de uma assinatura no Asaas (paginação por cursor)",
+    responses={304: {"description": "Página sem alterações desde o ETag enviado em If-None-Match"}},
+)
+async def list_subscription_payments(
+    request: Request,
+    subscription_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Valor de next_cursor da página anterior"),
+    full_history: bool = Query(False, alias="all", description="Com true, transmite o histórico completo em NDJSON"),
+    session: SessionContext = Depends(get_current_session),
+    supabase: SyncPostgrestClient = Depends(get_user_postgrest)
+):
+    """
+    Lista as cobranças de uma assinatura do usuário autenticado, consultadas no Asaas.
+    As páginas iniciais ficam em cache por alguns segundos; webhooks e cancelamentos da assinatura invalidam.
+    Com ?all=true, o histórico inteiro é transmitido em NDJSON (uma cobrança por linha e uma linha
+    final com o resumo); depois da primeira página, as demais são buscadas no Asaas em paralelo.
+    """
+    try:
+        offset = decode_offset_cursor(cursor) if cursor else 0
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        subscription = await _find_owned_subscription(subscription_id, session, supabase)
+    except Exception as e:
+        print(f"Erro ao obter a assinatura {subscription_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro interno do servidor: {e}")
+    if subscription is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Assinatura não encontrada ou não pertence a este usuário."
+        )
+
+    if full_history:
+        pages = iter_all_payments(subscription_id)
+        try:
+            # A primeira página é buscada antes de responder, para que falhas do Asaas virem 503/502
+            first = await pages.__anext__()
+        except BaseException as e:
+            # Sem a resposta em streaming ninguém mais consome o gerador: fecha para não deixar buscas pendentes
+            await pages.aclose()
+            if isinstance(e, (CircuitOpenError, httpx.HTTPError)):
+                raise _asaas_read_error(e, subscription_id)
+            raise
+        return StreamingResponse(_payments_ndjson(subscription_id, first, pages), media_type="application/x-ndjson")
+
+    try:
+        page = await get_payments_page(subscription_id, offset, limit)
+    except (CircuitOpenError, httpx.HTTPError) as e:
+        raise _asaas_read_error(e, subscription_id)
+    return conditional_response(request, json_representation(page))
+
+@router.post(
+    "/{subscription_id}/cancel",
+    response_model=SubscriptionCancelResponse,
+    summary="Cancela uma assinatura no Asaas e atualiza o status no banco de dados",
+    dependencies=[Depends(admission("asaas"))],
+)
 async def cancel_subscription(
     subscription_id: str,
-    current_user: UserProfile = Depends(get_current_user),
-    supabase: Client = Depends(lambda: supabase_client)
+    session: SessionContext = Depends(get_current_session),
+    supabase: SyncPostgrestClient = Depends(get_user_postgrest)
 ):
     """
     Cancela uma assinatura no Asaas e atualiza o status no banco de dados local.
     O ID da assinatura aqui se refere ao ID gerado pelo Asaas.
     """
+    current_user = session.profile
     try:
-        # 1. Verificar se a assinatura existe e pertence ao usuário autenticado no banco de dados local
-        response = supabase.from_('subscriptions')\
-            .select('*')\
-            .eq('subscription_id', subscription_id)\
-            .eq('user_id', str(current_user.id))\
-            .single()\
-            .execute()
-
-        if not response.data:
+        # 1. Verificar se a assinatura existe e pertence ao usuário autenticado (pelo contexto da sessão)
+        if await _find_owned_subscription(subscription_id, session, supabase) is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Assinatura não encontrada ou não pertence a este usuário."
             )
 
-        subscription_db_data = response.data # Dados da assinatura no nosso DB
-
         # 2. Chamar a API do Asaas para cancelar a assinatura
         # O endpoint para cancelar assinatura é DELETE /v3/subscriptions/{id}
         # Ref: https://docs.asaas.com/reference/remover-assinatura
         try:
-            asaas_response = asaas_request("DELETE", f"subscriptions/{subscription_id}")
+            asaas_response = await asaas_request("DELETE", f"subscriptions/{subscription_id}")
             # A API do Asaas retorna 200 OK em caso de sucesso na exclusão (cancelamento)
             if asaas_response.status_code != 200:
                  # Se a API do Asaas retornar um erro diferente de 200, levantar exceção
@@ -226,7 +449,14 @@ async def cancel_subscription(
             # asaas_cancel_data = asaas_response.json()
             # Verificar um campo de status na resposta se houver
 
-        except requests.exceptions.RequestException as e:
+        except CircuitOpenError as e:
+            print(f"Asaas indisponível ao cancelar assinatura {subscription_id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Asaas temporariamente indisponível. Tente novamente em instantes.",
+                headers={"Retry-After": str(int(e.retry_after) + 1)},
+            )
+        except httpx.HTTPError as e:
             # Erro na comunicação com a API do Asaas
             print(f"Erro na comunicação com Asaas ao cancelar assinatura {subscription_id}: {e}")
             detail = f"Erro na comunicação com Asaas: {e}"
@@ -238,13 +468,20 @@ async def cancel_subscription(
 
             raise HTTPException(status_code=status_code, detail=detail)
 
+        # Cancelada no Asaas: os dados do Asaas em cache (?expand=asaas) ficaram desatualizados
+        await invalidate_asaas_details(subscription_id)
+
         # 3. Atualizar o status da assinatura no banco de dados local para 'cancelled'
-        # Nota: A política RLS deve permitir que o usuário autenticado atualize seus próprios dados (feito na RLS policy)
-        update_response = supabase.from_('subscriptions')\
-             .update({'status': 'cancelled'})\
-             .eq('subscription_id', subscription_id)\
-             .eq('user_id', str(current_user.id))\
-             .execute()
+        # A RPC faz um único UPDATE ... RETURNING condicionado ao dono da assinatura; roda com a chave de
+        # serviço (os usuários não têm política de UPDATE em subscriptions) e o user_id do token verificado
+        update_response = await run_supabase(
+            get_supabase_admin().rpc('cancel_owned_subscription', {
+                'p_subscription_id': subscription_id,
+                'p_user_id': str(current_user.id),
+            }).execute
+        )
+        await invalidate_user_profile(current_user.id)
+        await invalidate_user_entitlements(current_user.id)
 
         # Verificar se a atualização no banco de dados foi bem-sucedida
         if not update_response.data:
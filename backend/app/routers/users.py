@@ -1,14 +1,22 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 
-from ..dependencies import get_current_user
-from ..models.user import UserProfile
-from ..utils.supabase import supabase_client
+from ..dependencies import get_current_session
+from ..models.user import UserProfile, SessionContext
+from ..utils.etag import conditional_response, session_representations
 
 router = APIRouter()
 
-@router.get("/me", response_model=UserProfile, summary="Retorna os dados do usuário logado")
-async def read_users_me(current_user: UserProfile = Depends(get_current_user)):
+@router.get(
+    "/me",
+    response_model=UserProfile,
+    summary="Retorna os dados do usuário logado",
+    responses={304: {"description": "Perfil sem alterações desde o ETag enviado em If-None-Match"}},
+)
+async def read_users_me(request: Request, session: SessionContext = Depends(get_current_session)):
     """
     Retorna os dados do perfil do usuário autenticado.
+    Responde com ETag; se o cliente enviar o mesmo valor em If-None-Match, a resposta é 304 sem corpo.
+    Com o contexto da sessão em cache, o corpo e o ETag são montados uma vez e reaproveitados.
     """
-    return current_user 
\ No newline at end of file
+    representation = session_representations.get(session, (str(session.profile.id), "profile"), session.profile)
+    return conditional_response(request, representation)
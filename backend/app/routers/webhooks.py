@@ -0,0 +1,52 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request, status
+
+from ..core.config import settings
+from ..utils.subscription_updates import subscription_updates, status_update_from_event, subscription_id_from_event
+from ..utils.asaas_details import invalidate_asaas_details
+
+router = APIRouter()
+
+@router.post("/asaas", summary="Recebe eventos de webhook do Asaas (cobranças e assinaturas)")
+async def asaas_webhook(request: Request, asaas_access_token: Optional[str] = Header(None)):
+    """
+    Autentica o token enviado pelo Asaas, enfileira a mudança de status e responde imediatamente.
+    A gravação em public.subscriptions é feita em lotes pelo worker de subscription_updates.
+    """
+    if not settings.asaas_webhook_token:
+        print("Webhook do Asaas recebido, mas ASAAS_WEBHOOK_TOKEN não está configurado.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Webhook não configurado.")
+    if not asaas_access_token or not hmac.compare_digest(asaas_access_token, settings.asaas_webhook_token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de webhook inválido.")
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Corpo do webhook não é um JSON válido.")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Corpo do webhook em formato inesperado.")
+
+    event_id = payload.get("id")
+    if subscription_updates.is_duplicate(event_id):
+        return {"received": True, "duplicate": True}
+
+    # Qualquer evento da assinatura ou de uma cobrança dela desatualiza os dados do Asaas em cache
+    await invalidate_asaas_details(subscription_id_from_event(payload))
+
+    update = status_update_from_event(payload)
+    if update is None:
+        # Evento que não altera assinaturas: apenas confirmamos o recebimento
+        return {"received": True}
+
+    if not subscription_updates.enqueue(update):
+        # Fila cheia: deixamos o Asaas reenviar o evento mais tarde
+        subscription_updates.forget(event_id)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Fila de eventos cheia. Tente novamente.",
+            headers={"Retry-After": "30"},
+        )
+
+    return {"received": True}
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import math
+import time
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+
+from .cache import TTLCache
+from .cache_backend import shared_caches
+from ..core.config import settings
+
+
+class AdmissionRejected(Exception):
+    """O grupo de rotas está no limite e a fila de espera está cheia (ou a espera expirou)."""
+
+    def __init__(self, group: str, retry_after: float):
+        super().__init__(f"Limite de concorrência atingido em '{group}'")
+        self.group = group
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Limite de requisições simultâneas de um grupo de rotas, usado a partir do event loop.
+
+    Até `max_concurrent` requisições rodam ao mesmo tempo; outras `max_queue` podem esperar
+    até `queue_timeout` segundos por uma vaga. Além disso a requisição é recusada na hora,
+    para que um serviço externo lento não acumule requisições até esgotar o servidor.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float, retry_after: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters = []  # futures na ordem de chegada
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.name, self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # A vaga chegou junto com o timeout/cancelamento: devolve para o próximo da fila
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            raise AdmissionRejected(self.name, self.retry_after)
+        self.admitted += 1
+
+    def release(self) -> None:
+        # A vaga passa direto para o primeiro da fila, sem reduzir in_flight
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+# Grupos de rotas que dependem de serviços externos lentos. Rotas baratas (/, /metrics,
+# /users/me com o perfil em cache) ficam fora, para continuarem respondendo sob carga.
+admission_groups: Dict[str, ConcurrencyLimiter] = {
+    # Chamam o Asaas durante a requisição: registro, criação e cancelamento de assinatura
+    "asaas": ConcurrencyLimiter(
+        "asaas", settings.admission_asaas_max_concurrent, settings.admission_asaas_max_queue, settings.admission_queue_timeout, settings.admission_retry_after
+    ),
+    # Chamam o Supabase Auth: login e logout
+    "auth": ConcurrencyLimiter(
+        "auth", settings.admission_auth_max_concurrent, settings.admission_auth_max_queue, settings.admission_queue_timeout, settings.admission_retry_after
+    ),
+}
+
+
+def admission(group: str):
+    """
+    Dependency que segura uma vaga do grupo durante a requisição, ou responde 503 com Retry-After:
+
+        @router.post("/create", dependencies=[Depends(admission("asaas"))])
+    """
+    limiter = admission_groups[group]
+
+    async def dependency():
+        try:
+            await limiter.acquire()
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor sobrecarregado. Tente novamente em instantes.",
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    return dependency
+
+
+class KeyedTokenBucket:
+    """
+    Token buckets por chave (IP, e-mail...): `rate` tokens por segundo, até `burst` acumulados.
+    Os buckets ficam em um TTLCache limitado, então chaves inativas não acumulam memória.
+
+    Com um backend de cache compartilhado (CACHE_BACKEND_URL), `acquire` conta as tentativas de
+    todos os workers em janelas fixas de burst/rate segundos com até `burst` tentativas cada: a
+    mesma rajada e o mesmo ritmo médio do bucket, com um contador atômico por janela.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_keys: int):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.rejected = 0
+        # Depois de burst/rate segundos parado o bucket estaria cheio de novo: pode sair do cache
+        ttl = (self.burst / rate) if rate > 0 else 1.0
+        self._buckets = TTLCache(max_size=max_keys, ttl=ttl)
+
+    def consume(self, key: str) -> Optional[float]:
+        """Consome um token da chave. Retorna None se permitido, ou os segundos até o próximo token."""
+        if self.rate <= 0:
+            return None
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets.set(key, (tokens, now))
+            self.rejected += 1
+            return (1 - tokens) / self.rate
+        self._buckets.set(key, (tokens - 1, now))
+        return None
+
+    async def acquire(self, key: str) -> Optional[float]:
+        """Como consume, mas compartilhado entre os workers quando o backend de cache é compartilhado."""
+        backend = shared_caches.backend
+        if self.rate <= 0 or not backend.shared:
+            return self.consume(key)
+        window = self.burst / self.rate
+        now = time.time()
+        window_id = int(now // window)
+        # Hash da chave: e-mails não ficam em claro no servidor de cache
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        try:
+            count = await backend.incr(f"ratelimit:{self.name}:{digest}:{window_id}", ttl=window)
+        except Exception as e:
+            # Sem o backend, o limite vale ao menos dentro deste worker
+            print(f"Erro no backend de cache ao aplicar o limite {self.name}; usando o limite local: {e!r}")
+            return self.consume(key)
+        if count > self.burst:
+            self.rejected += 1
+            return (window_id + 1) * window - now
+        return None
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "rejected": self.rejected}
+
+
+# LOGIN_RATE_* são tentativas por minuto
+login_ip_limiter = KeyedTokenBucket("login_ip", settings.login_rate_per_ip / 60, settings.login_burst_per_ip, settings.login_rate_limit_max_keys)
+login_email_limiter = KeyedTokenBucket("login_email", settings.login_rate_per_email / 60, settings.login_burst_per_email, settings.login_rate_limit_max_keys)
+
+
+async def check_login_rate(client_ip: Optional[str], email: str) -> None:
+    """Aplica os limites de tentativas de login por IP e por e-mail; levanta 429 com Retry-After."""
+    waits = []
+    if client_ip:
+        waits.append(await login_ip_limiter.acquire(client_ip))
+    waits.append(await login_email_limiter.acquire(email.strip().lower()))
+    retry_after = max((w for w in waits if w is not None), default=None)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Muitas tentativas de login. Tente novamente mais tarde.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def admission_stats() -> dict:
+    return {
+        "groups": {name: limiter.stats() for name, limiter in admission_groups.items()},
+        "login_rate_limits": {"ip": login_ip_limiter.stats(), "email": login_email_limiter.stats()},
+    }
@@ -1,43 +1,195 @@
-import os
-import requests
-from ..core.config import ASAAS_API_KEY
+import asyncio
+from typing import Optional
 
-ASAAS_API_URL = "https://api-sandbox.asaas.com/v3"
+import httpx
+from ..core.config import settings
+from .resilience import CircuitBreaker, CircuitOpenError, backoff_delay, parse_retry_after
+from .metrics import UpstreamTimer
 
 def get_asaas_api_key() -> str:
-    key = os.environ.get("ASAAS_API_KEY")
-    if not key:
+    if not settings.asaas_api_key:
         raise ValueError("Variável de ambiente ASAAS_API_KEY deve estar configurada.")
-    return key
+    return settings.asaas_api_key
 
-def asaas_request(method: str, endpoint: str, data: dict = None) -> requests.Response:
+# Respostas transitórias do Asaas que valem uma nova tentativa
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Métodos que podem ser repetidos com segurança; POST/PUT só com chave de idempotência
+IDEMPOTENT_METHODS = {"GET", "DELETE"}
+
+def endpoint_key(method: str, endpoint: str) -> str:
+    """
+    Normaliza método + endpoint para agrupar métricas e circuit breakers por rota do Asaas,
+    trocando IDs (ex.: sub_123, cus_abc) por {id}: "DELETE subscriptions/sub_1" -> "DELETE /subscriptions/{id}".
+    """
+    segments = [seg for seg in endpoint.strip("/").split("/") if seg]
+    normalized = [
+        seg if i == 0 or not any(c.isdigit() or c == "_" for c in seg) else "{id}"
+        for i, seg in enumerate(segments)
+    ]
+    return f"{method.upper()} /{'/'.join(normalized)}"
+
+class AsaasClient:
+    """
+    Cliente assíncrono do Asaas com um pool de conexões keep-alive compartilhado.
+    Deve ser aberto/fechado no lifespan da aplicação (start/close); se for usado antes
+    disso (scripts, shell), o pool é criado sob demanda.
+
+    Respostas 429/5xx e erros de transporte são repetidos com backoff exponencial com jitter
+    (respeitando Retry-After) para GET/DELETE e para POST/PUT com chave de idempotência.
+    Cada endpoint tem seu circuit breaker, que falha rápido enquanto o Asaas estiver fora.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        connect_timeout: float,
+        read_timeout: float,
+        pool_timeout: float,
+        max_connections: int,
+        max_keepalive_connections: int,
+        retry_max_attempts: int = 3,
+        retry_base_delay: float = 0.2,
+        retry_max_delay: float = 5.0,
+        cb_failure_threshold: int = 5,
+        cb_recovery_timeout: float = 30.0,
+        api_key: Optional[str] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+        self.retry_max_attempts = max(1, retry_max_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.cb_failure_threshold = cb_failure_threshold
+        self.cb_recovery_timeout = cb_recovery_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._breakers = {}
+        self.retry_counts = {}
+
+    def configure(self, base_url: str, api_key: Optional[str]) -> None:
+        """Troca a URL e a chave da API (usado por create_app); vale a partir do próximo start()."""
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "access_token": self.api_key or get_asaas_api_key(),
+                    "Content-Type": "application/json",
+                },
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(f"Asaas {key}", self.cb_failure_threshold, self.cb_recovery_timeout)
+            self._breakers[key] = breaker
+        return breaker
+
+    def stats(self) -> dict:
+        """Estado dos circuit breakers e total de retentativas por endpoint."""
+        return {
+            "breakers": {key: breaker.stats() for key, breaker in self._breakers.items()},
+            "retries": dict(self.retry_counts),
+        }
+
+    async def _send(self, method: str, url: str, data: Optional[dict], headers: Optional[dict]) -> httpx.Response:
+        if method in ("POST", "PUT"):
+            return await self._client.request(method, url, json=data, headers=headers)
+        if method == "GET":
+            return await self._client.get(url, params=data, headers=headers)
+        return await self._client.delete(url, headers=headers)
+
+    async def request(self, method: str, endpoint: str, data: dict = None, idempotency_key: Optional[str] = None) -> httpx.Response:
+        if self._client is None:
+            await self.start()
+
+        method = method.upper()
+        if method not in ("POST", "GET", "PUT", "DELETE"):
+            raise ValueError(f"Método HTTP não suportado: {method}")
+
+        url = f"/{endpoint.lstrip('/')}"
+        key = endpoint_key(method, endpoint)
+        breaker = self.breaker(key)
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        can_retry = method in IDEMPOTENT_METHODS or idempotency_key is not None
+        max_attempts = self.retry_max_attempts if can_retry else 1
+
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                with UpstreamTimer("asaas", key) as timer:
+                    response = await self._send(method, url, data, headers)
+                    timer.outcome = f"{response.status_code // 100}xx"
+                    if response.status_code >= 500 or response.status_code == 429:
+                        timer.error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                if attempt + 1 >= max_attempts:
+                    raise
+                delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+                reason = type(e).__name__
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt + 1 >= max_attempts:
+                    response.raise_for_status() # Lança httpx.HTTPStatusError para códigos de status HTTP de erro
+                    return response
+
+                retry_after = parse_retry_after(response)
+                if retry_after is not None and retry_after > self.retry_max_delay:
+                    # O Asaas pediu para esperar mais do que aceitamos segurar a requisição
+                    response.raise_for_status()
+                delay = retry_after if retry_after is not None else backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+                reason = f"HTTP {response.status_code}"
+
+            attempt += 1
+            self.retry_counts[key] = self.retry_counts.get(key, 0) + 1
+            print(f"Asaas {key}: {reason}, retentativa {attempt}/{max_attempts - 1} em {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+# Instância global, aberta e fechada pelo lifespan em app.main
+asaas_client = AsaasClient(
+    base_url=settings.asaas_api_url,
+    connect_timeout=settings.asaas_connect_timeout,
+    read_timeout=settings.asaas_read_timeout,
+    pool_timeout=settings.asaas_pool_timeout,
+    max_connections=settings.asaas_max_connections,
+    max_keepalive_connections=settings.asaas_max_keepalive_connections,
+    retry_max_attempts=settings.asaas_retry_max_attempts,
+    retry_base_delay=settings.asaas_retry_base_delay,
+    retry_max_delay=settings.asaas_retry_max_delay,
+    cb_failure_threshold=settings.asaas_cb_failure_threshold,
+    cb_recovery_timeout=settings.asaas_cb_recovery_timeout,
+)
+
+async def asaas_request(method: str, endpoint: str, data: dict = None, idempotency_key: Optional[str] = None) -> httpx.Response:
     """
     Função genérica para fazer requisições à API do Asaas.
+    Levanta CircuitOpenError (subclasse de httpx.HTTPError) quando o circuito do endpoint está aberto.
     """
-    api_key = get_asaas_api_key()
-    headers = {
-        "access_token": api_key,
-        "Content-Type": "application/json"
-    }
-    url = f"{ASAAS_API_URL}/{endpoint}"
-
-    if method.upper() == "POST":
-        response = requests.post(url, headers=headers, json=data)
-    elif method.upper() == "GET":
-        response = requests.get(url, headers=headers, params=data)
-    elif method.upper() == "PUT":
-        response = requests.put(url, headers=headers, json=data)
-    elif method.upper() == "DELETE":
-        response = requests.delete(url, headers=headers)
-    else:
-        raise ValueError(f"Método HTTP não suportado: {method}")
-
-    response.raise_for_status() # Lança exceção para códigos de status HTTP de erro
-    return response
-
-def create_asaas_customer(customer_data: dict) -> dict:
+    return await asaas_client.request(method, endpoint, data=data, idempotency_key=idempotency_key)
+
+async def create_asaas_customer(customer_data: dict, idempotency_key: Optional[str] = None) -> dict:
     """
     Cria um novo cliente no Asaas.
     """
-    response = asaas_request("POST", "customers", data=customer_data)
-    return response.json() 
\ No newline at end of file
+    response = await asaas_request("POST", "customers", data=customer_data, idempotency_key=idempotency_key)
+    return response.json()
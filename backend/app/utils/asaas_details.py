@@ -0,0 +1,164 @@
+import asyncio
+import uuid
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
+
+from .asaas import asaas_request
+from .bulk import map_bounded
+from .cache_backend import SharedCache
+from .pagination import encode_offset_cursor
+from .singleflight import single_flight
+from ..core.config import settings
+from ..models.subscription import AsaasPaymentSummary, AsaasSubscriptionInfo, PaymentListResponse
+
+# Dados do Asaas por subscription_id, para que atualizações seguidas de um painel não virem
+# uma rajada de chamadas ao Asaas. Webhooks e cancelamentos chamam invalidate_asaas_details;
+# o TTL limita o atraso para mudanças que não passam por aqui (painel do Asaas, webhook perdido).
+asaas_details_cache = SharedCache(
+    "asaas_details", settings.asaas_details_cache_max_size, settings.asaas_details_cache_ttl,
+    encode=lambda info: info.model_dump_json().encode(),
+    decode=AsaasSubscriptionInfo.model_validate_json,
+)
+
+# Páginas recentes do histórico de cobranças, uma entrada por (subscription_id, geração, offset, limit),
+# cada uma com o próprio TTL de ASAAS_PAYMENTS_CACHE_TTL segundos
+payment_pages_cache = SharedCache(
+    "asaas_payment_pages", settings.asaas_details_cache_max_size, settings.asaas_payments_cache_ttl,
+    encode=lambda page: page.model_dump_json().encode(),
+    decode=PaymentListResponse.model_validate_json,
+)
+# Geração atual das páginas de cada subscription_id: invalidar a geração descarta todas as páginas
+# da assinatura de uma vez, sem precisar saber quais (offset, limit) estão em cache
+payment_pages_generation = SharedCache(
+    "asaas_payment_pages_generation", settings.asaas_details_cache_max_size, settings.asaas_payments_cache_ttl,
+)
+# Só as páginas iniciais (as que um painel abre primeiro) vão para o cache
+RECENT_PAYMENTS_MAX_OFFSET = 100
+# Maior página aceita pelo Asaas
+ASAAS_MAX_PAGE_SIZE = 100
+
+async def invalidate_asaas_details(subscription_id: Optional[str]) -> None:
+    """Remove do cache os dados do Asaas da assinatura após qualquer mudança nela ou nas cobranças dela."""
+    if subscription_id:
+        await asaas_details_cache.invalidate(subscription_id)
+        await payment_pages_generation.invalidate(subscription_id)
+
+def _payment_summary(payment: dict) -> AsaasPaymentSummary:
+    return AsaasPaymentSummary(
+        id=payment["id"],
+        status=payment.get("status") or "UNKNOWN",
+        value=payment.get("value"),
+        due_date=payment.get("dueDate"),
+        payment_date=payment.get("paymentDate") or payment.get("clientPaymentDate"),
+        billing_type=payment.get("billingType"),
+        invoice_url=payment.get("invoiceUrl"),
+    )
+
+async def _fetch_asaas_details(subscription_id: str) -> AsaasSubscriptionInfo:
+    # A assinatura e as cobranças dela são buscadas ao mesmo tempo
+    subscription_response, payments_response = await asyncio.gather(
+        asaas_request("GET", f"subscriptions/{subscription_id}"),
+        asaas_request("GET", f"subscriptions/{subscription_id}/payments", data={"limit": settings.asaas_details_payments_limit}),
+    )
+    subscription = subscription_response.json()
+    payments = sorted(
+        (payments_response.json() or {}).get("data") or [],
+        key=lambda p: (p.get("dueDate") or "", p.get("dateCreated") or ""),
+        reverse=True,
+    )
+    info = AsaasSubscriptionInfo(
+        status=subscription.get("status"),
+        value=subscription.get("value"),
+        cycle=subscription.get("cycle"),
+        billing_type=subscription.get("billingType"),
+        next_due_date=subscription.get("nextDueDate"),
+        description=subscription.get("description"),
+        latest_payments=[_payment_summary(p) for p in payments[:settings.asaas_details_payments_limit]],
+    )
+    await asaas_details_cache.set(subscription_id, info)
+    return info
+
+async def get_asaas_details(subscription_id: str) -> AsaasSubscriptionInfo:
+    """
+    Dados da assinatura no Asaas (valor, próximo vencimento, últimas cobranças), do cache quando possível.
+    Levanta httpx.HTTPError (ou CircuitOpenError) se o Asaas falhar; falhas não vão para o cache.
+    """
+    cached = await asaas_details_cache.get(subscription_id)
+    if cached is not None:
+        return cached
+    # Várias abas/requisições pedindo a mesma assinatura ao mesmo tempo geram uma única ida ao Asaas
+    return await single_flight.do("asaas_subscription_details", subscription_id, lambda: _fetch_asaas_details(subscription_id))
+
+def _page_key(subscription_id: str, generation: str, offset: int, limit: int) -> str:
+    return f"{subscription_id}:{generation}:{offset}:{limit}"
+
+async def _fetch_payments_page(subscription_id: str, offset: int, limit: int) -> PaymentListResponse:
+    response = await asaas_request(
+        "GET", f"subscriptions/{subscription_id}/payments", data={"offset": offset, "limit": limit}
+    )
+    body = response.json() or {}
+    payments = body.get("data") or []
+    page = PaymentListResponse(
+        items=[_payment_summary(p) for p in payments],
+        next_cursor=encode_offset_cursor(offset + len(payments)) if body.get("hasMore") and payments else None,
+        total_count=body.get("totalCount"),
+    )
+    if offset < RECENT_PAYMENTS_MAX_OFFSET:
+        generation = await payment_pages_generation.get(subscription_id) or uuid.uuid4().hex
+        # Regravada a cada página para durar ao menos tanto quanto a página mais nova; o TTL de cada
+        # página continua só dela
+        await payment_pages_generation.set(subscription_id, generation)
+        await payment_pages_cache.set(_page_key(subscription_id, generation, offset, limit), page)
+    return page
+
+async def get_payments_page(subscription_id: str, offset: int, limit: int) -> PaymentListResponse:
+    """
+    Uma página das cobranças da assinatura no Asaas, na ordem do Asaas. As páginas iniciais vêm do cache
+    quando possível. Levanta httpx.HTTPError (ou CircuitOpenError) se o Asaas falhar.
+    """
+    generation = await payment_pages_generation.get(subscription_id)
+    if generation is not None:
+        page = await payment_pages_cache.get(_page_key(subscription_id, generation, offset, limit))
+        if page is not None:
+            return page
+    return await single_flight.do(
+        "asaas_payments_page", (subscription_id, offset, limit),
+        lambda: _fetch_payments_page(subscription_id, offset, limit),
+    )
+
+async def iter_all_payments(subscription_id: str) -> AsyncIterator[List[AsaasPaymentSummary]]:
+    """
+    Todas as cobranças da assinatura, página a página, na ordem em que as páginas chegam.
+    A primeira página informa o total; as demais são buscadas ao mesmo tempo, no máximo
+    ASAAS_PAYMENTS_PREFETCH_CONCURRENCY por vez. Cobranças repetidas entre páginas (a lista
+    mudou durante a leitura) são descartadas.
+    """
+    first = await get_payments_page(subscription_id, 0, ASAAS_MAX_PAGE_SIZE)
+    seen = {p.id for p in first.items}
+    yield first.items
+    if first.next_cursor is None:
+        return
+
+    if first.total_count is None:
+        # Sem o total não dá para calcular os offsets: segue página a página
+        offset = len(first.items)
+        while True:
+            page = await get_payments_page(subscription_id, offset, ASAAS_MAX_PAGE_SIZE)
+            new_items = [p for p in page.items if p.id not in seen]
+            seen.update(p.id for p in new_items)
+            yield new_items
+            if page.next_cursor is None or not page.items:
+                return
+            offset += len(page.items)
+
+    offsets = list(range(len(first.items), first.total_count, ASAAS_MAX_PAGE_SIZE))
+    fetch = lambda offset: get_payments_page(subscription_id, offset, ASAAS_MAX_PAGE_SIZE)
+    # aclosing: se o cliente desconectar (ou uma página falhar), as buscas em andamento são canceladas
+    # agora, e não quando o coletor de lixo finalizar o gerador
+    async with aclosing(map_bounded(offsets, fetch, settings.asaas_payments_prefetch_concurrency)) as results:
+        async for _, page, error in results:
+            if error is not None:
+                raise error
+            new_items = [p for p in page.items if p.id not in seen]
+            seen.update(p.id for p in new_items)
+            yield new_items
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from ..core.config import settings
+
+
+class RateLimiter:
+    """
+    Token bucket usado a partir do event loop: no máximo `rate` chamadas por segundo,
+    com rajadas de até `burst`. rate <= 0 desativa o limite.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Compartilhado por todas as operações em lote do processo: duas operações simultâneas dividem o mesmo ritmo
+asaas_bulk_limiter = RateLimiter(settings.asaas_bulk_rate_per_second, settings.asaas_bulk_burst)
+
+
+async def map_bounded(
+    items: List[Any],
+    func: Callable[[Any], Awaitable[Any]],
+    concurrency: int,
+    limiter: Optional[RateLimiter] = None,
+) -> AsyncIterator[Tuple[Any, Any, Optional[Exception]]]:
+    """
+    Executa func(item) com no máximo `concurrency` chamadas em voo e entrega (item, resultado, erro)
+    na ordem em que as chamadas terminam.
+    """
+    pending = iter(items)
+    done: asyncio.Queue = asyncio.Queue()
+
+    async def worker():
+        # O iterador é compartilhado pelos workers; next() não cede o event loop
+        for item in pending:
+            if limiter is not None:
+                await limiter.acquire()
+            try:
+                done.put_nowait((item, await func(item), None))
+            except Exception as e:
+                done.put_nowait((item, None, e))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))]
+    try:
+        for _ in range(len(items)):
+            yield await done.get()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+class BulkJob:
+    """
+    Operação em lote sobre uma lista de itens:
+
+    - `call(item)` roda para cada item com concorrência limitada (e pelo RateLimiter, se houver);
+      deve retornar o dado a gravar no banco, ou levantar exceção em caso de falha.
+    - Os resultados bem-sucedidos são gravados em lotes de `batch_size` com `write_batch(valores)`, que pode
+      retornar {subscription_id: motivo} com os itens que o banco não aplicou (saem como "skipped").
+    - Cada item gera uma linha em `lines()` quando termina (falhas logo, sucessos depois de gravados),
+      seguida de uma linha final com o resumo.
+
+    O trabalho roda em uma task própria: se o cliente desconectar no meio do streaming, a operação
+    continua até o fim, para que o que já foi alterado no Asaas também seja gravado no banco.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        items: List[Any],
+        call: Callable[[Any], Awaitable[dict]],
+        write_batch: Callable[[List[dict]], Awaitable[Optional[dict]]],
+        batch_size: int,
+        concurrency: int = settings.asaas_bulk_concurrency,
+        limiter: Optional[RateLimiter] = asaas_bulk_limiter,
+        describe_error: Callable[[Exception], str] = str,
+    ):
+        self.name = name
+        self.items = items
+        self.call = call
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.describe_error = describe_error
+        self.summary = {"total": 0, "succeeded": 0, "failed": 0, "skipped": 0}
+        self._output: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def emit(self, line: dict) -> None:
+        result = line.get("result")
+        if result == "ok":
+            self.summary["succeeded"] += 1
+        elif result == "skipped":
+            self.summary["skipped"] += 1
+        else:
+            self.summary["failed"] += 1
+        self.summary["total"] += 1
+        self._output.put_nowait(line)
+
+    async def _flush(self, batch: List[dict]) -> None:
+        try:
+            not_applied = await self.write_batch(batch) or {}
+        except Exception as e:
+            print(f"{self.name}: erro ao gravar lote de {len(batch)} itens no banco: {e}")
+            for value in batch:
+                self.emit({**value, "result": "error", "error": f"Alterado no Asaas, mas falhou ao gravar no banco: {e}"})
+            return
+        for value in batch:
+            reason = not_applied.get(value.get("subscription_id"))
+            if reason is None:
+                self.emit({**value, "result": "ok"})
+            else:
+                self.emit({**value, "result": "skipped", "reason": reason})
+
+    async def _run(self) -> None:
+        batch = []
+        try:
+            async with aclosing(map_bounded(self.items, self.call, self.concurrency, self.limiter)) as results:
+                async for item, value, error in results:
+                    if error is not None:
+                        self.emit({"subscription_id": item, "result": "error", "error": self.describe_error(error)})
+                        continue
+                    batch.append(value)
+                    if len(batch) >= self.batch_size:
+                        await self._flush(batch)
+                        batch = []
+            if batch:
+                await self._flush(batch)
+        except Exception as e:
+            print(f"{self.name}: erro inesperado na operação em lote: {e}")
+        finally:
+            print(f"{self.name}: concluída {self.summary}")
+            self._output.put_nowait({"summary": self.summary})
+            self._output.put_nowait(None)
+
+    def start(self) -> "BulkJob":
+        self._task = asyncio.create_task(self._run())
+        _running_jobs.add(self._task)
+        self._task.add_done_callback(_running_jobs.discard)
+        return self
+
+    async def lines(self) -> AsyncIterator[str]:
+        """Linhas NDJSON com o resultado de cada item, na ordem em que terminam."""
+        while True:
+            line = await self._output.get()
+            if line is None:
+                return
+            yield json.dumps(line, default=str) + "\n"
+
+
+# Referências às operações em andamento, para que não sejam coletadas antes de terminar
+_running_jobs = set()
+
+
+def unique(values: Iterable[str]) -> List[str]:
+    """Remove repetições preservando a ordem."""
+    return list(dict.fromkeys(values))
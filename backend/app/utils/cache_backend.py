@@ -0,0 +1,342 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .cache import TTLCache
+from ..core.config import settings
+
+_MISSING = object()
+
+# Canal das invalidações entre workers
+INVALIDATION_CHANNEL = "invalidate"
+# Identifica este processo nas mensagens de invalidação, para ignorar as que ele mesmo publicou
+WORKER_ID = uuid.uuid4().hex
+
+
+class CacheBackend(ABC):
+    """
+    Armazenamento chave/valor usado pelos caches e limites de taxa: valores em bytes com TTL em
+    segundos, contador atômico e pub/sub. `shared` indica se outros processos enxergam os mesmos dados.
+    Um backend sem algum dos métodos abstratos falha ao ser instanciado, na subida da aplicação.
+    """
+
+    name = "base"
+    shared = False
+
+    async def start(self, on_message: Callable[[str], None], on_reconnect: Callable[[], None]) -> None:
+        """Começa a entregar as mensagens do canal de invalidação para `on_message`."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    async def get_with_ttl(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        """Valor e segundos que ainda restam do TTL (None quando o backend não informa)."""
+        return await self.get(key), None
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str, ttl: float) -> int:
+        """Incrementa o contador e retorna o novo valor; o TTL vale a partir do primeiro incremento."""
+
+    @abstractmethod
+    async def publish(self, message: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Backend na memória do processo (padrão, sem CACHE_BACKEND_URL). Os caches continuam só com o
+    TTLCache local, então o comportamento é o de um único worker; aqui ficam os contadores e o pub/sub local.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_size: int = 100000):
+        self._data = TTLCache(max_size=max_size, ttl=60)
+        self._counters: Dict[str, tuple] = {}  # chave -> (expira_em, valor)
+        self._on_message: Optional[Callable[[str], None]] = None
+
+    async def start(self, on_message, on_reconnect) -> None:
+        self._on_message = on_message
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._data.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._data.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str) -> None:
+        self._data.delete(key)
+
+    async def incr(self, key: str, ttl: float) -> int:
+        now = time.monotonic()
+        expires_at, value = self._counters.get(key, (now + ttl, 0))
+        if expires_at <= now:
+            expires_at, value = now + ttl, 0
+        self._counters[key] = (expires_at, value + 1)
+        if len(self._counters) > self._data.max_size:
+            self._counters = {k: v for k, v in self._counters.items() if v[0] > now}
+        return value + 1
+
+    async def publish(self, message: str) -> None:
+        if self._on_message is not None:
+            self._on_message(message)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Backend em um servidor que fala o protocolo do Redis (Redis, Valkey, KeyDB...), compartilhado
+    por todos os workers e nós. As invalidações são publicadas em um canal e recebidas por uma
+    task de cada worker; se a assinatura cair, a task reconecta e avisa `on_reconnect`, já que
+    mensagens podem ter sido perdidas no intervalo.
+    """
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str, prefix: str = settings.cache_key_prefix, timeout: float = settings.cache_backend_timeout):
+        # Importado aqui: sem CACHE_BACKEND_URL a dependência não é carregada
+        import redis.asyncio as redis
+
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        # A assinatura fica bloqueada lendo o socket sem prazo, então usa uma conexão sem timeout de leitura
+        self._subscriber = redis.Redis.from_url(url, socket_connect_timeout=timeout, health_check_interval=30)
+        self._listener: Optional[asyncio.Task] = None
+        self.subscribed = False
+        self.reconnects = 0
+
+    async def start(self, on_message, on_reconnect) -> None:
+        self._listener = asyncio.create_task(self._listen(on_message, on_reconnect))
+
+    async def _listen(self, on_message, on_reconnect) -> None:
+        channel = self.prefix + INVALIDATION_CHANNEL
+        first = True
+        while True:
+            pubsub = self._subscriber.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(channel)
+                self.subscribed = True
+                if not first:
+                    self.reconnects += 1
+                    on_reconnect()
+                first = False
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        data = message["data"]
+                        on_message(data.decode() if isinstance(data, bytes) else data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.subscribed:
+                    print(f"Assinatura do canal de invalidação do cache perdida: {e}")
+                self.subscribed = False
+                await asyncio.sleep(1)
+            finally:
+                self.subscribed = False
+                await pubsub.aclose()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(self.prefix + key)
+
+    async def get_with_ttl(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        async with self._client.pipeline(transaction=True) as pipe:
+            value, pttl = await pipe.get(self.prefix + key).pttl(self.prefix + key).execute()
+        # PTTL é -2 para chave inexistente e -1 para chave sem expiração
+        return value, (pttl / 1000 if pttl > 0 else None)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self.prefix + key)
+
+    async def incr(self, key: str, ttl: float) -> int:
+        key = self.prefix + key
+        value = await self._client.incr(key)
+        if value == 1:
+            await self._client.pexpire(key, max(1, int(ttl * 1000)))
+        return value
+
+    async def publish(self, message: str) -> None:
+        await self._client.publish(self.prefix + INVALIDATION_CHANNEL, message)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        await self._client.aclose()
+        await self._subscriber.aclose()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "subscribed": self.subscribed, "reconnects": self.reconnects}
+
+
+class SharedCache:
+    """
+    Cache em dois níveis: o TTLCache do processo (L1) na frente do backend compartilhado (L2).
+
+    Leituras que acertam o L1 não saem do processo. Com um backend compartilhado, uma falta no L1
+    consulta o L2, gravações vão aos dois, e `invalidate` apaga a chave do L2 e publica a
+    invalidação para que os outros workers a tirem do L1. Falhas do backend só são contadas e
+    registradas no log: a leitura vira falta de cache e a requisição segue pelo caminho normal.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_size: int,
+        ttl: float,
+        encode: Callable[[Any], bytes] = lambda value: json.dumps(value).encode(),
+        decode: Callable[[bytes], Any] = json.loads,
+        registry: Optional["SharedCaches"] = None,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = TTLCache(max_size=max_size, ttl=ttl)
+        self.encode = encode
+        self.decode = decode
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.errors = 0
+        self.invalidations_received = 0
+        self.registry = shared_caches if registry is None else registry
+        self.registry.register(self)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _failed(self, operation: str, key: str, error: Exception) -> None:
+        self.errors += 1
+        print(f"Erro no backend de cache ({operation} {self._key(key)}): {error!r}")
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        backend = self.registry.backend
+        if not backend.shared:
+            return default
+        try:
+            raw, remaining = await backend.get_with_ttl(self._key(key))
+            if raw is None:
+                self.shared_misses += 1
+                return default
+            value = self.decode(raw)
+        except Exception as e:
+            self._failed("get", key, e)
+            return default
+        self.shared_hits += 1
+        # O L1 expira junto com o L2: um valor gravado com TTL curto (ex.: resultado negativo) não
+        # ganha o TTL padrão do cache ao ser copiado para outro worker
+        self.local.set(key, value, ttl=self.ttl if remaining is None else min(self.ttl, remaining))
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.local.set(key, value, ttl=ttl)
+        backend = self.registry.backend
+        if backend.shared:
+            try:
+                await backend.set(self._key(key), self.encode(value), self.ttl if ttl is None else ttl)
+            except Exception as e:
+                self._failed("set", key, e)
+
+    async def invalidate(self, key: str) -> None:
+        self.local.delete(key)
+        backend = self.registry.backend
+        if backend.shared:
+            try:
+                await backend.delete(self._key(key))
+                await backend.publish(json.dumps({"origin": self.registry.worker_id, "cache": self.namespace, "key": key}))
+            except Exception as e:
+                self._failed("invalidate", key, e)
+
+    def invalidated(self, key: str) -> None:
+        """Invalidação recebida de outro worker: só o L1 precisa ser limpo."""
+        self.invalidations_received += 1
+        self.local.delete(key)
+
+    def stats(self) -> dict:
+        return {
+            **self.local.stats(),
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+            "errors": self.errors,
+            "invalidations_received": self.invalidations_received,
+        }
+
+
+class SharedCaches:
+    """
+    Backend em uso pelos SharedCache e limites de taxa do processo. Começa na memória; a subida da
+    aplicação chama start(CACHE_BACKEND_URL) e o desligamento, close(). `worker_id` identifica o processo
+    nas mensagens de invalidação.
+    """
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.backend: CacheBackend = MemoryCacheBackend()
+        self.worker_id = worker_id
+        self._caches: Dict[str, SharedCache] = {}
+
+    def register(self, cache: SharedCache) -> None:
+        if cache.namespace in self._caches:
+            raise ValueError(f"Já existe um cache com o namespace '{cache.namespace}'")
+        self._caches[cache.namespace] = cache
+
+    @property
+    def caches(self) -> List[SharedCache]:
+        return list(self._caches.values())
+
+    async def start(self, url: Optional[str] = None, backend: Optional[CacheBackend] = None) -> None:
+        if backend is not None:
+            self.backend = backend
+        elif url:
+            self.backend = RedisCacheBackend(url)
+            print(f"Caches compartilhados entre workers via {self.backend.name}")
+        await self.backend.start(self._on_message, self._on_reconnect)
+
+    async def close(self) -> None:
+        await self.backend.close()
+        self.backend = MemoryCacheBackend()
+
+    def _on_message(self, message: str) -> None:
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return
+        if data.get("origin") == self.worker_id:
+            return
+        cache = self._caches.get(data.get("cache"))
+        if cache is not None:
+            cache.invalidated(data.get("key"))
+
+    def _on_reconnect(self) -> None:
+        # Invalidações publicadas enquanto a assinatura estava fora se perderam: descarta o L1
+        for cache in self._caches.values():
+            cache.local.clear()
+
+    def stats(self) -> dict:
+        return {**self.backend.stats(), "caches": {name: cache.stats() for name, cache in self._caches.items()}}
+
+
+# Instância global: os caches de user_caches.py e asaas_details.py e os limites de login usam este backend
+shared_caches = SharedCaches()
@@ -0,0 +1,59 @@
+import hashlib
+import weakref
+from typing import Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from .cache import TTLCache
+from ..core.config import settings
+
+# Respostas por usuário: nenhum cache compartilhado (proxy/CDN) pode guardá-las, e o cliente
+# revalida a cada uso com If-None-Match, recebendo 304 sem corpo se nada mudou.
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+def json_representation(model: BaseModel) -> Tuple[bytes, str]:
+    """Corpo JSON do modelo e o ETag forte correspondente (hash do conteúdo)."""
+    body = model.model_dump_json().encode()
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+class RepresentationCache:
+    """
+    Corpo JSON e ETag de respostas montadas a partir de um objeto em cache (ex.: o SessionContext de
+    profile_cache), calculados uma vez por objeto. A entrada só vale enquanto `source` for o mesmo
+    objeto: o contexto recarregado após uma invalidação gera a representação de novo.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def get(self, source: object, key: Hashable, model: BaseModel) -> Tuple[bytes, str]:
+        entry = self._cache.get(key)
+        if entry is not None and entry[0]() is source:
+            return entry[1]
+        representation = json_representation(model)
+        # Referência fraca: a entrada não mantém vivo um contexto que já saiu do profile_cache
+        self._cache.set(key, (weakref.ref(source), representation))
+        return representation
+
+# Representações de GET /users/me e GET /subscriptions/{id} montadas a partir do contexto da sessão
+session_representations = RepresentationCache(settings.profile_cache_max_size, settings.profile_cache_ttl)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match usa comparação fraca (RFC 9110): W/"x" casa com "x"."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+def conditional_response(request: Request, representation: Tuple[bytes, str], cache_control: str = PRIVATE_CACHE_CONTROL) -> Response:
+    """
+    Responde 304 (sem corpo) se o cliente já tem esta versão, ou 200 com o corpo.
+    As respostas dependem do token, então variam por Authorization.
+    """
+    body, etag = representation
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Authorization"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
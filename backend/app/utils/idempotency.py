@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+from .cache import TTLCache
+from ..core.config import settings
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Respostas que não são guardadas: o cliente pode (e deve) tentar de novo com a mesma chave
+NON_CACHEABLE_STATUS_CODES = {status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS}
+
+
+def request_fingerprint(payload) -> str:
+    """Hash do corpo da requisição, para recusar a mesma chave usada com outro corpo."""
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def scoped_key(scope: str, owner: str, key: str) -> str:
+    """
+    Chave interna para a Idempotency-Key do cliente, separada por rota e por dono (usuário ou e-mail),
+    para que clientes diferentes usando a mesma chave não recebam a resposta um do outro.
+    Também é a chave repassada ao Asaas, sem expor o e-mail no cabeçalho.
+    """
+    digest = hashlib.sha256(f"{owner}:{key}".encode()).hexdigest()
+    return f"{scope}-{digest}"
+
+
+class StoredResponse:
+    __slots__ = ("fingerprint", "status_code", "body", "media_type", "headers")
+
+    def __init__(self, fingerprint: str, status_code: int, body: bytes, media_type: str, headers: dict):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.body = body
+        self.media_type = media_type
+        self.headers = headers
+
+    def to_response(self, replayed: bool) -> Response:
+        headers = dict(self.headers)
+        if replayed:
+            headers["Idempotent-Replayed"] = "true"
+        return Response(content=self.body, status_code=self.status_code, media_type=self.media_type, headers=headers)
+
+
+class IdempotencyStore:
+    """
+    Respostas de POSTs com cabeçalho Idempotency-Key, guardadas por chave em um cache LRU+TTL.
+
+    - Chave já concluída: devolve a resposta guardada, sem chamar o handler (nem Asaas/Supabase).
+    - Chave em andamento: espera a primeira requisição terminar e devolve a mesma resposta.
+    - Respostas 5xx, 409 e 429 não são guardadas; quem estava esperando executa o handler de novo.
+
+    O armazenamento é por processo: com vários workers, repetições que caem em outro
+    processo não são deduplicadas aqui (a chave também é repassada ao Asaas).
+    """
+
+    def __init__(self, max_size: int, ttl: float, wait_timeout: float):
+        self._responses = TTLCache(max_size=max_size, ttl=ttl)
+        self._in_flight = {}
+        self.wait_timeout = wait_timeout
+        self.replays = 0
+        self.waits = 0
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        handler: Callable[[], Awaitable],
+        status_code: int = status.HTTP_200_OK,
+    ) -> Response:
+        while True:
+            stored = self._responses.get(key)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    raise HTTPException(
+                        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        detail="Idempotency-Key já utilizada com outro corpo de requisição.",
+                    )
+                self.replays += 1
+                return stored.to_response(replayed=True)
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            self.waits += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(in_flight), self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Uma requisição com esta Idempotency-Key ainda está em andamento.",
+                )
+            # Volta ao início: a resposta foi guardada ou a chave ficou livre para nova tentativa
+
+        in_flight = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = in_flight
+        try:
+            stored = await self._execute(fingerprint, handler, status_code)
+        finally:
+            del self._in_flight[key]
+            in_flight.set_result(None)
+
+        if stored.status_code < 500 and stored.status_code not in NON_CACHEABLE_STATUS_CODES:
+            self._responses.set(key, stored)
+        return stored.to_response(replayed=False)
+
+    async def _execute(self, fingerprint: str, handler: Callable[[], Awaitable], status_code: int) -> StoredResponse:
+        try:
+            result = await handler()
+        except HTTPException as e:
+            body = json.dumps({"detail": jsonable_encoder(e.detail)}).encode()
+            return StoredResponse(fingerprint, e.status_code, body, "application/json", dict(e.headers or {}))
+
+        if isinstance(result, Response):
+            headers = {k: v for k, v in result.headers.items() if k.lower() not in ("content-length", "content-type")}
+            return StoredResponse(fingerprint, result.status_code, result.body, result.media_type or "application/json", headers)
+        body = json.dumps(jsonable_encoder(result)).encode()
+        return StoredResponse(fingerprint, status_code, body, "application/json", {})
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "replays": self.replays,
+            "waits": self.waits,
+            "responses": self._responses.stats(),
+        }
+
+
+def validate_idempotency_key(key: Optional[str]) -> Optional[str]:
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key deve ter entre 1 e {IDEMPOTENCY_KEY_MAX_LENGTH} caracteres.",
+        )
+    return key
+
+
+# Instância global compartilhada pelas rotas de registro e de criação de assinatura
+idempotency_store = IdempotencyStore(
+    max_size=settings.idempotency_cache_max_size,
+    ttl=settings.idempotency_ttl,
+    wait_timeout=settings.idempotency_wait_timeout,
+)
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import jwt
+import requests
+
+from .metrics import UpstreamTimer
+from .singleflight import single_flight
+from ..core.config import settings
+
+# Algoritmos aceitos. Nunca aceitar "none" nem misturar HS* com chaves públicas.
+HMAC_ALGORITHMS = ["HS256"]
+ASYMMETRIC_ALGORITHMS = ["RS256", "ES256"]
+
+# Intervalo mínimo entre recargas do JWKS disparadas por "kid" desconhecido,
+# para que tokens forjados com kids aleatórios não virem uma chamada por requisição.
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+
+class TokenInvalidError(Exception):
+    """O token foi verificado localmente e deve ser rejeitado (assinatura, exp, aud ou sub inválidos)."""
+
+
+class TokenVerificationUnavailable(Exception):
+    """Não foi possível verificar o token localmente (sem segredo, JWKS indisponível, etc.)."""
+
+
+class JWTVerifier:
+    """
+    Verifica JWTs emitidos pelo Supabase Auth sem ida e volta ao GoTrue.
+    Tokens HS256 usam o segredo do projeto; tokens RS256/ES256 usam o JWKS em cache,
+    que é recarregado quando expira ou quando aparece um "kid" desconhecido.
+    """
+
+    def __init__(self, secret: Optional[str], jwks_url: Optional[str], audience: str, jwks_ttl: int = 600, leeway: int = 0):
+        self.secret = secret
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.jwks_ttl = jwks_ttl
+        self.leeway = leeway
+        self._keys = {}
+        self._jwks_fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, secret: Optional[str], jwks_url: Optional[str]) -> None:
+        """Troca o segredo e a URL do JWKS (usado por create_app); as chaves em cache são descartadas."""
+        with self._lock:
+            self.secret = secret
+            self.jwks_url = jwks_url
+            self._keys = {}
+            self._jwks_fetched_at = 0.0
+
+    async def verify(self, token: str) -> dict:
+        """
+        Retorna as claims do token. Levanta TokenInvalidError se o token deve ser rejeitado
+        ou TokenVerificationUnavailable se a verificação local não pôde ser concluída.
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError as e:
+            raise TokenInvalidError(f"Cabeçalho JWT inválido: {e}")
+
+        alg = header.get("alg")
+        if alg in HMAC_ALGORITHMS:
+            if not self.secret:
+                raise TokenVerificationUnavailable("SUPABASE_JWT_SECRET não configurado para tokens HS256.")
+            key = self.secret
+        elif alg in ASYMMETRIC_ALGORITHMS:
+            key = await self._get_signing_key(header.get("kid"))
+        else:
+            raise TokenInvalidError(f"Algoritmo JWT não suportado: {alg}")
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[alg],
+                audience=self.audience,
+                leeway=self.leeway,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.ExpiredSignatureError:
+            raise TokenInvalidError("Token expirado")
+        except jwt.InvalidTokenError as e:
+            raise TokenInvalidError(f"Token inválido: {e}")
+
+        if not claims.get("sub"):
+            raise TokenInvalidError("Claim 'sub' vazia no token")
+        return claims
+
+    async def _get_signing_key(self, kid: Optional[str]):
+        if not kid:
+            raise TokenInvalidError("Token assimétrico sem 'kid' no cabeçalho")
+        if not self.jwks_url:
+            raise TokenVerificationUnavailable("URL do JWKS não configurada.")
+
+        now = time.monotonic()
+        expired = now - self._jwks_fetched_at > self.jwks_ttl
+        refreshed = None
+        if expired or kid not in self._keys:
+            # Requisições simultâneas que precisam recarregar compartilham uma única busca
+            refreshed = await single_flight.do("supabase_jwks", self.jwks_url, lambda: self._fetch_jwks(expired))
+
+        key = self._keys.get(kid)
+        if key is None:
+            if refreshed is False:
+                raise TokenVerificationUnavailable(f"JWKS indisponível para validar kid={kid}")
+            raise TokenInvalidError(f"Chave de assinatura desconhecida (kid={kid})")
+        return key
+
+    async def _fetch_jwks(self, force: bool) -> Optional[bool]:
+        # A busca é bloqueante (requests) e roda numa thread própria (asyncio.to_thread): uma recarga lenta
+        # não ocupa o pool de threads do Supabase nem entra nas métricas do supabase_auth
+        with UpstreamTimer("supabase_jwks", "GET jwks") as timer:
+            refreshed = await asyncio.to_thread(self._refresh_jwks, force)
+            if refreshed is False:
+                timer.outcome = "error"
+            elif refreshed is None:
+                timer.outcome = "throttled"
+        return refreshed
+
+    def _refresh_jwks(self, force: bool) -> Optional[bool]:
+        """Retorna True se recarregou, False se a busca falhou e None se foi limitada pelo intervalo mínimo."""
+        with self._lock:
+            now = time.monotonic()
+            # Outra thread pode ter recarregado enquanto esperávamos o lock
+            if not force and now - self._jwks_fetched_at < JWKS_MIN_REFRESH_INTERVAL:
+                return None
+            try:
+                response = requests.get(self.jwks_url, timeout=5)
+                response.raise_for_status()
+                jwk_set = jwt.PyJWKSet.from_dict(response.json())
+            except (requests.exceptions.RequestException, ValueError, jwt.PyJWKSetError) as e:
+                if self._keys:
+                    # Mantém as chaves antigas; um JWKS indisponível não deve derrubar tokens válidos
+                    print(f"Erro ao recarregar JWKS do Supabase, usando chaves em cache: {e}")
+                    self._jwks_fetched_at = now
+                    return False
+                raise TokenVerificationUnavailable(f"Não foi possível obter o JWKS do Supabase: {e}")
+
+            self._keys = {k.key_id: k.key for k in jwk_set.keys if k.key_id}
+            self._jwks_fetched_at = now
+            return True
+
+
+# Instância global, no mesmo padrão dos clientes Supabase
+jwt_verifier = JWTVerifier(
+    secret=settings.supabase_jwt_secret,
+    jwks_url=settings.jwks_url,
+    audience=settings.supabase_jwt_audience,
+    jwks_ttl=settings.supabase_jwks_cache_ttl,
+)
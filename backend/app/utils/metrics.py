@@ -0,0 +1,287 @@
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Registro próprio (em vez do global do prometheus_client) com tudo que /metrics expõe
+registry = CollectorRegistry(auto_describe=True)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duração das requisições HTTP atendidas pela API",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requisições HTTP em andamento",
+    registry=registry,
+)
+HTTP_REQUEST_ERRORS = Counter(
+    "http_request_errors_total",
+    "Requisições HTTP que terminaram com status 5xx",
+    ["method", "route", "status"],
+    registry=registry,
+)
+UPSTREAM_REQUEST_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "Duração das chamadas ao Supabase Auth, PostgREST e Asaas",
+    ["upstream", "operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry,
+)
+UPSTREAM_REQUESTS_IN_FLIGHT = Gauge(
+    "upstream_requests_in_flight",
+    "Chamadas a serviços externos em andamento",
+    ["upstream"],
+    registry=registry,
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total",
+    "Chamadas a serviços externos que falharam (exceção ou resposta de erro)",
+    ["upstream", "operation", "error"],
+    registry=registry,
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class UpstreamTimer:
+    """
+    Mede uma chamada a um serviço externo:
+
+        with UpstreamTimer("asaas", "GET /subscriptions/{id}") as timer:
+            response = await ...
+            timer.outcome = "2xx"
+
+    Uma exceção dentro do bloco é registrada com outcome "error" e o nome da exceção.
+    """
+
+    __slots__ = ("upstream", "operation", "outcome", "error", "_started", "_in_flight")
+
+    def __init__(self, upstream: str, operation: str):
+        self.upstream = upstream
+        self.operation = operation
+        self.outcome = "ok"
+        self.error: Optional[str] = None
+
+    def __enter__(self) -> "UpstreamTimer":
+        self._in_flight = UPSTREAM_REQUESTS_IN_FLIGHT.labels(self.upstream)
+        self._in_flight.inc()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        elapsed = time.perf_counter() - self._started
+        self._in_flight.dec()
+        if exc_type is not None:
+            self.outcome = "error"
+            self.error = exc_type.__name__
+        UPSTREAM_REQUEST_DURATION.labels(self.upstream, self.operation, self.outcome).observe(elapsed)
+        if self.error is not None:
+            UPSTREAM_ERRORS.labels(self.upstream, self.operation, self.error).inc()
+
+
+def supabase_operation(func: Callable[..., Any]) -> Tuple[str, str]:
+    """
+    Rótulos (upstream, operation) de uma chamada do supabase-py passada para run_supabase:
+    `query.execute` vira ("postgrest", "GET /users") ou ("postgrest", "POST /rpc/insert_new_user");
+    métodos do cliente de auth viram ("supabase_auth", "sign_up").
+    """
+    owner = getattr(func, "__self__", None)
+    path = getattr(owner, "path", None)
+    if isinstance(path, str):
+        return "postgrest", f"{owner.http_method} {path}"
+    return "supabase_auth", getattr(func, "__name__", "unknown")
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que registra duração, status e requisições em andamento por rota.
+    A rota é o template do path (ex.: /subscriptions/{subscription_id}), para manter a cardinalidade baixa.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = None
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if self._route_paths is None:
+            # As rotas não mudam depois da subida: o mapa endpoint -> template é montado uma vez
+            self._route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(endpoint, UNMATCHED_ROUTE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500 # Se a aplicação levantar exceção, o ServerErrorMiddleware responde 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            labels = (scope["method"], self._route_label(scope), str(status_code))
+            HTTP_REQUEST_DURATION.labels(*labels).observe(elapsed)
+            if status_code >= 500:
+                HTTP_REQUEST_ERRORS.labels(*labels).inc()
+
+
+def _cache_metrics(families: dict, name: str, stats: dict) -> None:
+    families["size"].add_metric([name], stats["size"])
+    for key in ("hits", "misses", "evictions", "expirations"):
+        families[key].add_metric([name], stats[key])
+
+
+class AppStatsCollector:
+    """
+    Exporta no /metrics os contadores que os componentes já mantêm em stats():
+    caches, circuit breakers e retentativas do Asaas, fila de webhooks, worker de
+    provisionamento e Idempotency-Key. Os valores são lidos só quando /metrics é consultado.
+    """
+
+    def __init__(self, shared_caches, supabase_clients, asaas_client, subscription_updates, provisioning_worker, idempotency_store, admission_stats, single_flight):
+        self.shared_caches = shared_caches
+        self.supabase_clients = supabase_clients
+        self.asaas_client = asaas_client
+        self.subscription_updates = subscription_updates
+        self.provisioning_worker = provisioning_worker
+        self.idempotency_store = idempotency_store
+        self.admission_stats = admission_stats
+        self.single_flight = single_flight
+
+    def collect(self):
+        webhook = self.subscription_updates.stats()
+        idempotency = self.idempotency_store.stats()
+
+        caches = {
+            "size": GaugeMetricFamily("cache_entries", "Entradas em cache", labels=["cache"]),
+            "hits": CounterMetricFamily("cache_hits", "Acertos de cache", labels=["cache"]),
+            "misses": CounterMetricFamily("cache_misses", "Faltas de cache", labels=["cache"]),
+            "evictions": CounterMetricFamily("cache_evictions", "Entradas removidas por limite de tamanho", labels=["cache"]),
+            "expirations": CounterMetricFamily("cache_expirations", "Entradas removidas por TTL", labels=["cache"]),
+        }
+        shared = self.shared_caches.stats()
+        for name, stats in shared["caches"].items():
+            _cache_metrics(caches, name, stats)
+        _cache_metrics(caches, "supabase_user_clients", self.supabase_clients.stats())
+        _cache_metrics(caches, "webhook_dedup", webhook["dedup"])
+        _cache_metrics(caches, "idempotency", idempotency["responses"])
+        yield from caches.values()
+
+        shared_hits = CounterMetricFamily("cache_shared_hits", "Faltas no cache do processo atendidas pelo backend compartilhado", labels=["cache"])
+        shared_misses = CounterMetricFamily("cache_shared_misses", "Faltas também no backend compartilhado", labels=["cache"])
+        backend_errors = CounterMetricFamily("cache_backend_errors", "Operações no backend de cache que falharam", labels=["cache"])
+        invalidations = CounterMetricFamily(
+            "cache_invalidations_received", "Invalidações recebidas de outros workers", labels=["cache"],
+        )
+        for name, stats in shared["caches"].items():
+            shared_hits.add_metric([name], stats["shared_hits"])
+            shared_misses.add_metric([name], stats["shared_misses"])
+            backend_errors.add_metric([name], stats["errors"])
+            invalidations.add_metric([name], stats["invalidations_received"])
+        yield shared_hits
+        yield shared_misses
+        yield backend_errors
+        yield invalidations
+        backend = GaugeMetricFamily("cache_backend_info", "Backend de cache em uso (1 no atual)", labels=["backend"])
+        backend.add_metric([shared["backend"]], 1)
+        yield backend
+        if "subscribed" in shared:
+            yield GaugeMetricFamily(
+                "cache_invalidation_subscribed", "1 se o worker está recebendo as invalidações dos outros", value=1 if shared["subscribed"] else 0,
+            )
+            yield CounterMetricFamily("cache_invalidation_reconnects", "Reconexões do canal de invalidação", value=shared["reconnects"])
+
+        asaas = self.asaas_client.stats()
+        breaker_state = GaugeMetricFamily(
+            "asaas_circuit_breaker_state", "Estado do circuit breaker por endpoint do Asaas (1 no estado atual)",
+            labels=["endpoint", "state"],
+        )
+        breaker_failures = GaugeMetricFamily(
+            "asaas_circuit_breaker_consecutive_failures", "Falhas seguidas por endpoint do Asaas", labels=["endpoint"],
+        )
+        for endpoint, breaker in asaas["breakers"].items():
+            for state in ("closed", "open", "half_open"):
+                breaker_state.add_metric([endpoint, state], 1 if breaker["state"] == state else 0)
+            breaker_failures.add_metric([endpoint], breaker["consecutive_failures"])
+        retries = CounterMetricFamily("asaas_retries", "Retentativas de chamadas ao Asaas", labels=["endpoint"])
+        for endpoint, count in asaas["retries"].items():
+            retries.add_metric([endpoint], count)
+        yield breaker_state
+        yield breaker_failures
+        yield retries
+
+        yield GaugeMetricFamily("webhook_queue_size", "Atualizações de webhook aguardando gravação", value=webhook["queued"])
+        yield CounterMetricFamily("webhook_duplicate_events", "Eventos de webhook repetidos descartados", value=webhook["duplicates"])
+        yield CounterMetricFamily("webhook_batches_written", "Lotes gravados em public.subscriptions", value=webhook["batches_written"])
+        yield CounterMetricFamily("webhook_rows_updated", "Assinaturas atualizadas pelos webhooks", value=webhook["rows_updated"])
+        yield CounterMetricFamily("webhook_updates_dropped", "Atualizações descartadas após falhas de gravação", value=webhook["updates_dropped"])
+
+        provisioning = self.provisioning_worker.stats()
+        jobs = CounterMetricFamily("provisioning_jobs", "Jobs de provisionamento do registro assíncrono", labels=["result"])
+        for result in ("claimed", "completed", "retried", "failed"):
+            jobs.add_metric([result], provisioning[result])
+        yield jobs
+
+        yield GaugeMetricFamily("idempotency_in_flight", "Requisições com Idempotency-Key em andamento", value=idempotency["in_flight"])
+        yield CounterMetricFamily("idempotency_replays", "Respostas devolvidas a partir do Idempotency-Key", value=idempotency["replays"])
+        yield CounterMetricFamily("idempotency_waits", "Repetições que esperaram a requisição original", value=idempotency["waits"])
+
+        admission = self.admission_stats()
+        admission_in_flight = GaugeMetricFamily("admission_in_flight", "Requisições em andamento por grupo de rotas", labels=["group"])
+        admission_waiting = GaugeMetricFamily("admission_waiting", "Requisições na fila de espera por grupo de rotas", labels=["group"])
+        admission_rejected = CounterMetricFamily(
+            "admission_rejected", "Requisições recusadas com 503 por grupo de rotas", labels=["group", "reason"],
+        )
+        for group, stats in admission["groups"].items():
+            admission_in_flight.add_metric([group], stats["in_flight"])
+            admission_waiting.add_metric([group], stats["waiting"])
+            admission_rejected.add_metric([group, "queue_full"], stats["rejected"])
+            admission_rejected.add_metric([group, "queue_timeout"], stats["timed_out"])
+        login_limited = CounterMetricFamily("login_rate_limited", "Tentativas de login recusadas com 429", labels=["key"])
+        for key, stats in admission["login_rate_limits"].items():
+            login_limited.add_metric([key], stats["rejected"])
+        yield admission_in_flight
+        yield admission_waiting
+        yield admission_rejected
+        yield login_limited
+
+        flights = self.single_flight.stats()["operations"]
+        flight_calls = CounterMetricFamily("singleflight_calls", "Leituras que foram ao serviço externo", labels=["operation"])
+        flight_coalesced = CounterMetricFamily(
+            "singleflight_coalesced", "Leituras que reaproveitaram uma chamada idêntica em andamento", labels=["operation"],
+        )
+        flight_ratio = GaugeMetricFamily(
+            "singleflight_coalescing_ratio", "Fração das leituras atendidas por uma chamada já em andamento", labels=["operation"],
+        )
+        for operation, stats in flights.items():
+            flight_calls.add_metric([operation], stats["calls"])
+            flight_coalesced.add_metric([operation], stats["coalesced"])
+            flight_ratio.add_metric([operation], stats["ratio"])
+        yield flight_calls
+        yield flight_coalesced
+        yield flight_ratio
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,74 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: str, row_id: str) -> str:
+    """Cursor opaco com a chave (created_at, id) da última linha da página."""
+    raw = json.dumps([created_at, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Cursor inválido: {e}")
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise InvalidCursorError("Cursor inválido")
+    # Os valores vão para o filtro do PostgREST, então só aceitamos data e UUID bem formados
+    try:
+        datetime.fromisoformat(created_at)
+        row_id = str(uuid.UUID(row_id))
+    except ValueError:
+        raise InvalidCursorError("Cursor inválido")
+    return created_at, row_id
+
+
+def apply_keyset(query, cursor: Optional[str], desc: bool = True):
+    """
+    Aplica paginação keyset em (created_at, id) a uma query de select do PostgREST:
+    ordenação estável pelas duas colunas e, se houver cursor, apenas as linhas depois dele.
+    """
+    query = query.order('created_at', desc=desc).order('id', desc=desc)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        op = "lt" if desc else "gt"
+        # postgrest-py 0.13 não tem or_(); montamos o filtro "or" do PostgREST diretamente
+        query.params = query.params.add(
+            "or",
+            f'(created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{row_id}))',
+        )
+    return query
+
+
+def next_cursor(rows: list, limit: int) -> Optional[str]:
+    """Cursor da próxima página; as queries pedem limit + 1 linhas para saber se há mais."""
+    if len(rows) <= limit:
+        return None
+    last = rows[limit - 1]
+    return encode_cursor(str(last["created_at"]), str(last["id"]))
+
+
+def encode_offset_cursor(offset: int) -> str:
+    """Cursor opaco para listagens paginadas por offset no serviço de origem (ex.: cobranças do Asaas)."""
+    raw = json.dumps({"offset": offset}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode()))["offset"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursorError(f"Cursor inválido: {e}")
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise InvalidCursorError("Cursor inválido")
+    return offset
@@ -0,0 +1,225 @@
+import asyncio
+from typing import Optional
+
+import httpx
+
+from .asaas import asaas_request, create_asaas_customer
+from .resilience import backoff_delay
+from .supabase import get_supabase_admin, run_supabase
+from .user_caches import invalidate_user_profile
+from ..core.config import settings
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+def asaas_customer_payload(user: dict) -> dict:
+    """Payload de criação do cliente no Asaas a partir dos dados do usuário (mesmo formato do registro síncrono)."""
+    return {
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "mobilePhone": user.get("phone"),
+        "cpfCnpj": user.get("cpf_cnpj"),
+        "externalReference": str(user.get("user_id") or user.get("id")),
+        "address": user.get("address"),
+        "description": user.get("description"),
+    }
+
+
+def _is_permanent(error: Exception) -> bool:
+    # Erros 4xx do Asaas (ex.: CPF inválido) não se resolvem com nova tentativa; 429 sim
+    if isinstance(error, httpx.HTTPStatusError):
+        code = error.response.status_code
+        return 400 <= code < 500 and code != 429
+    return isinstance(error, ProvisioningError)
+
+
+def _error_message(error: Exception) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}: {error.response.text[:500]}"
+    return str(error)[:500] or type(error).__name__
+
+
+class ProvisioningWorker:
+    """
+    Worker do registro assíncrono (REGISTRATION_MODE=async).
+
+    Os jobs ficam em public.user_provisioning_jobs, então nada se perde se a API reiniciar:
+    claim_provisioning_jobs reserva os jobs vencidos por PROVISIONING_LEASE_SECONDS e, se o
+    processo morrer no meio, a reserva expira e o job é retomado. Antes de criar o cliente no
+    Asaas o worker procura um cliente com externalReference = user_id, para que uma tentativa
+    repetida não crie clientes duplicados.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float,
+        batch_size: int,
+        lease_seconds: int,
+        max_attempts: int,
+        retry_base_delay: float,
+        retry_max_delay: float,
+    ):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._worker: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.claimed = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._wake = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Jobs em andamento ficam como 'processing' e são retomados quando a reserva expirar
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def notify(self) -> None:
+        """Acorda o worker logo após um registro, sem esperar o próximo ciclo de polling."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                print(f"Erro inesperado no worker de provisionamento: {e}")
+                processed = 0
+            if processed >= self.batch_size:
+                continue # Provavelmente há mais jobs vencidos
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_once(self) -> int:
+        response = await run_supabase(
+            get_supabase_admin().rpc(
+                'claim_provisioning_jobs',
+                {'p_limit': self.batch_size, 'p_lease_seconds': self.lease_seconds},
+            ).execute
+        )
+        jobs = response.data or []
+        self.claimed += len(jobs)
+        if jobs:
+            await asyncio.gather(*(self._process(job) for job in jobs))
+        return len(jobs)
+
+    async def _find_customer(self, user_id: str) -> Optional[str]:
+        response = await asaas_request("GET", "customers", data={"externalReference": user_id})
+        customers = response.json().get("data") or []
+        return customers[0]["id"] if customers else None
+
+    async def _process(self, job: dict) -> None:
+        user_id = str(job["user_id"])
+        try:
+            customer_id = await self._find_customer(user_id)
+            if not customer_id:
+                customer = await create_asaas_customer(asaas_customer_payload(job), idempotency_key=f"register-{user_id}")
+                customer_id = customer.get("id")
+                if not customer_id:
+                    raise ProvisioningError(f"ID do cliente não retornado pelo Asaas. Resposta: {customer}")
+            await run_supabase(
+                get_supabase_admin().rpc(
+                    'complete_provisioning_job',
+                    {'p_user_id': user_id, 'p_asaas_customer_id': customer_id},
+                ).execute
+            )
+        except Exception as e:
+            await self._record_failure(job, e)
+            return
+
+        self.completed += 1
+        await invalidate_user_profile(user_id)
+        print(f"Provisionamento do usuário {user_id} concluído (cliente Asaas {customer_id}, tentativa {job['attempts']})")
+
+    async def _record_failure(self, job: dict, error: Exception) -> None:
+        user_id = str(job["user_id"])
+        message = _error_message(error)
+        permanent = _is_permanent(error) or job["attempts"] >= self.max_attempts
+        retry_in = None
+        if permanent:
+            self.failed += 1
+            print(f"ERRO: provisionamento do usuário {user_id} falhou definitivamente após {job['attempts']} tentativa(s): {message}")
+            if await self._compensate(user_id):
+                return # O job foi removido junto com o perfil (ON DELETE CASCADE)
+        else:
+            self.retried += 1
+            retry_in = max(1, int(backoff_delay(job["attempts"] - 1, self.retry_base_delay, self.retry_max_delay)))
+            print(f"Provisionamento do usuário {user_id} falhou (tentativa {job['attempts']}): {message}. Nova tentativa em {retry_in}s")
+        try:
+            await run_supabase(
+                get_supabase_admin().rpc(
+                    'fail_provisioning_job',
+                    {'p_user_id': user_id, 'p_error': message, 'p_retry_in_seconds': retry_in},
+                ).execute
+            )
+        except Exception as e:
+            # A reserva expira e o job volta a ser processado
+            print(f"Erro ao registrar falha do provisionamento do usuário {user_id}: {e}")
+
+    async def _compensate(self, user_id: str) -> bool:
+        """
+        Desfaz o registro que não pôde ser concluído: remove o cliente do Asaas (se chegou a ser criado),
+        o usuário do Supabase Auth e o perfil em public.users, para que o e-mail, o username e o CPF/CNPJ
+        possam ser usados em um novo registro. Retorna True se o usuário foi removido.
+        """
+        # Um cliente criado no Asaas mas nunca gravado no perfil não deve ficar órfão
+        try:
+            customer_id = await self._find_customer(user_id)
+            if customer_id:
+                await asaas_request("DELETE", f"customers/{customer_id}")
+                print(f"Cliente Asaas {customer_id} do usuário {user_id} removido (compensação)")
+        except Exception as e:
+            print(f"Erro ao remover cliente Asaas do usuário {user_id} durante a compensação: {e}")
+
+        admin = get_supabase_admin()
+        try:
+            await run_supabase(admin.auth.admin.delete_user, user_id)
+            # public.users e o job já saem pelo ON DELETE CASCADE; o delete explícito cobre bancos sem a FK
+            await run_supabase(admin.from_('users').delete().eq('id', user_id).execute)
+        except Exception as e:
+            # O job fica como failed, com o motivo, para ser tratado manualmente
+            print(f"Erro ao remover o usuário {user_id} durante a compensação: {e}")
+            return False
+        await invalidate_user_profile(user_id)
+        print(f"Usuário {user_id} removido do Supabase Auth e de public.users (compensação)")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": self._worker is not None,
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+# Instância global; iniciada pelo lifespan em app.main quando REGISTRATION_MODE=async
+provisioning_worker = ProvisioningWorker(
+    poll_interval=settings.provisioning_poll_interval,
+    batch_size=settings.provisioning_batch_size,
+    lease_seconds=settings.provisioning_lease_seconds,
+    max_attempts=settings.provisioning_max_attempts,
+    retry_base_delay=settings.provisioning_retry_base_delay,
+    retry_max_delay=settings.provisioning_retry_max_delay,
+)
@@ -0,0 +1,102 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """O circuito do endpoint está aberto; a chamada falhou rápido sem ir ao serviço externo."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito aberto para {name}; tente novamente em {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Disjuntor simples por endpoint, usado a partir do event loop.
+
+    - closed: chamadas passam; após `failure_threshold` falhas seguidas, abre.
+    - open: chamadas falham rápido com CircuitOpenError até passar `recovery_timeout`.
+    - half_open: deixa passar uma única chamada de teste; sucesso fecha, falha reabre.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.transitions = {}  # "closed->open" -> quantidade
+
+    def before_call(self) -> None:
+        """Levanta CircuitOpenError se a chamada não deve seguir para o serviço externo."""
+        if self.state == OPEN:
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed < self.recovery_timeout:
+                raise CircuitOpenError(self.name, self.recovery_timeout - elapsed)
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self.probe_in_flight:
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self.probe_in_flight = True
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        if self.state != CLOSED:
+            self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != OPEN:
+                self._transition(OPEN)
+
+    def release(self) -> None:
+        """Libera a vaga de teste quando a chamada terminou sem resultado (ex.: requisição cancelada)."""
+        self.probe_in_flight = False
+
+    def _transition(self, new_state: str) -> None:
+        key = f"{self.state}->{new_state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        print(f"Circuit breaker {self.name}: {self.state} -> {new_state} (falhas seguidas: {self.consecutive_failures})")
+        self.state = new_state
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "transitions": dict(self.transitions),
+        }
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Backoff exponencial com "full jitter": aleatório entre 0 e min(cap, base * 2^attempt)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(response: httpx.Response) -> Optional[float]:
+    """Interpreta o cabeçalho Retry-After (segundos ou data HTTP). Retorna None se ausente/inválido."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Junta chamadas idênticas simultâneas: enquanto uma leitura com a mesma chave está em
+    andamento, as demais esperam por ela e recebem o mesmo resultado (ou a mesma exceção).
+
+    A chamada roda em uma task própria, então o cancelamento da requisição que a iniciou
+    (ex.: cliente desconectou) não derruba as que estão esperando. Nada é guardado depois
+    que a chamada termina; para isso existem os caches (TTLCache).
+    Use apenas para leituras: escritas nunca devem ser compartilhadas entre requisições.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = {}      # operação -> chamadas feitas ao serviço externo
+        self.coalesced = {}  # operação -> chamadas que reaproveitaram uma já em andamento
+
+    async def do(self, operation: str, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        flight_key = (operation, key)
+        task = self._in_flight.get(flight_key)
+        if task is not None:
+            self.coalesced[operation] = self.coalesced.get(operation, 0) + 1
+        else:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[flight_key] = task
+            task.add_done_callback(lambda done: self._finished(flight_key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, flight_key: tuple, task: asyncio.Task) -> None:
+        self._in_flight.pop(flight_key, None)
+        if not task.cancelled():
+            task.exception() # Evita o aviso de exceção não lida se todos que esperavam foram cancelados
+
+    def stats(self) -> dict:
+        operations = {}
+        for operation in set(self.calls) | set(self.coalesced):
+            calls = self.calls.get(operation, 0)
+            coalesced = self.coalesced.get(operation, 0)
+            operations[operation] = {
+                "calls": calls,
+                "coalesced": coalesced,
+                # Fração das requisições atendidas por uma chamada já em andamento
+                "ratio": coalesced / (calls + coalesced) if calls + coalesced else 0.0,
+            }
+        return {"in_flight": len(self._in_flight), "operations": operations}
+
+
+# Instância global compartilhada por dependencies.py e pelos routers
+single_flight = SingleFlight()
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from .cache import TTLCache
+from .supabase import get_supabase_admin, run_supabase
+from .user_caches import invalidate_user_profile, invalidate_user_entitlements
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Fuso das datas do Asaas: "dateCreated" vem sem offset, no horário de Brasília
+ASAAS_TIMEZONE = ZoneInfo("America/Sao_Paulo")
+
+# Eventos de cobrança do Asaas que mudam o status da assinatura à qual a cobrança pertence
+PAYMENT_EVENT_STATUS = {
+    "PAYMENT_CONFIRMED": "ACTIVE",
+    "PAYMENT_RECEIVED": "ACTIVE",
+    "PAYMENT_OVERDUE": "OVERDUE",
+}
+# Eventos de assinatura com status fixo; SUBSCRIPTION_CREATED/UPDATED usam o status do payload
+SUBSCRIPTION_EVENT_STATUS = {
+    "SUBSCRIPTION_INACTIVATED": "INACTIVE",
+    "SUBSCRIPTION_DELETED": "cancelled", # Mesmo valor gravado por POST /subscriptions/{id}/cancel
+}
+
+
+class StatusUpdate:
+    __slots__ = ("subscription_id", "status", "event_at")
+
+    def __init__(self, subscription_id: str, status: str, event_at: datetime):
+        self.subscription_id = subscription_id
+        self.status = status
+        self.event_at = event_at
+
+
+def _parse_event_date(value: Optional[str]) -> Optional[datetime]:
+    # O Asaas envia "dateCreated" como "AAAA-MM-DD HH:MM:SS", no horário de Brasília. A data volta com
+    # fuso, para ser comparada no banco (status_event_at é timestamptz) com o NOW() dos cancelamentos
+    if value:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+        return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=ASAAS_TIMEZONE)
+    return None
+
+
+def subscription_id_from_event(payload: dict) -> Optional[str]:
+    """ID da assinatura a que o evento se refere (direto ou pela cobrança), ou None."""
+    if (payload.get("event") or "").startswith("SUBSCRIPTION_"):
+        return (payload.get("subscription") or {}).get("id")
+    return (payload.get("payment") or {}).get("subscription")
+
+
+def status_update_from_event(payload: dict) -> Optional[StatusUpdate]:
+    """Extrai a mudança de status de um evento de webhook do Asaas, ou None se o evento não interessa."""
+    event = payload.get("event")
+
+    if event in PAYMENT_EVENT_STATUS:
+        subscription_id = (payload.get("payment") or {}).get("subscription")
+        if not subscription_id:
+            return None # Cobrança avulsa, sem assinatura
+        status = PAYMENT_EVENT_STATUS[event]
+    elif event and event.startswith("SUBSCRIPTION_"):
+        subscription = payload.get("subscription") or {}
+        subscription_id = subscription.get("id")
+        status = SUBSCRIPTION_EVENT_STATUS.get(event, subscription.get("status"))
+        if not subscription_id or not status:
+            return None
+    else:
+        return None
+
+    # Sem a data do evento não há como ordená-lo: usar a hora atual faria um evento reenviado ou
+    # atrasado vencer eventos mais novos, então ele é descartado
+    event_at = _parse_event_date(payload.get("dateCreated"))
+    if event_at is None:
+        logger.warning(
+            "Evento %s (id %s) da assinatura %s sem dateCreated válido; status não atualizado",
+            event, payload.get("id"), subscription_id,
+        )
+        return None
+    return StatusUpdate(subscription_id, status, event_at)
+
+
+class SubscriptionUpdateQueue:
+    """
+    Fila em processo para as atualizações de status vindas dos webhooks do Asaas.
+
+    O endpoint apenas enfileira e responde; um worker agrupa as atualizações por
+    subscription_id (ficando com o evento mais recente) e grava em lotes via RPC
+    apply_subscription_status_updates, que ignora eventos mais antigos que o status já gravado.
+    IDs de evento repetidos são descartados com um cache LRU+TTL limitado.
+    """
+
+    def __init__(self, max_size: int, batch_max_size: int, batch_max_wait: float, dedup_max_size: int, dedup_ttl: float):
+        self.batch_max_size = batch_max_size
+        self.batch_max_wait = batch_max_wait
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._seen_events = TTLCache(max_size=dedup_max_size, ttl=dedup_ttl)
+        self._worker: Optional[asyncio.Task] = None
+        self._current_batch: Optional[list] = None
+        self.duplicates = 0
+        self.batches_written = 0
+        self.rows_updated = 0
+        self.updates_dropped = 0
+
+    def start(self) -> None:
+        if self._worker is None:
+            # A fila é recriada dentro do event loop que vai consumi-la
+            self._queue = asyncio.Queue(maxsize=self._queue.maxsize)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        # Grava o lote interrompido e o que ainda estiver na fila antes de encerrar o worker
+        pending = self._current_batch or []
+        self._current_batch = None
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending:
+            try:
+                await asyncio.wait_for(self._flush(pending), timeout)
+            except asyncio.TimeoutError:
+                print(f"ERRO: {len(pending)} atualizações de webhook não gravadas no desligamento")
+
+    def is_duplicate(self, event_id: Optional[str]) -> bool:
+        """Marca o evento como visto e retorna True se ele já tinha sido recebido."""
+        if not event_id:
+            return False
+        if self._seen_events.get(event_id) is not None:
+            self.duplicates += 1
+            return True
+        self._seen_events.set(event_id, True)
+        return False
+
+    def forget(self, event_id: Optional[str]) -> None:
+        # Permite que o Asaas reenvie um evento que não conseguimos enfileirar
+        if event_id:
+            self._seen_events.delete(event_id)
+
+    def enqueue(self, update: StatusUpdate) -> bool:
+        """Enfileira sem bloquear. Retorna False se a fila estiver cheia."""
+        try:
+            self._queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_max_wait
+            while len(batch) < self.batch_max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self._current_batch = batch
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                print(f"Erro inesperado no worker de atualizações de assinatura: {e}")
+            self._current_batch = None
+
+    async def _flush(self, batch: list) -> None:
+        # Coalescência: apenas o evento mais recente de cada assinatura vai para o banco
+        latest = {}
+        for update in batch:
+            current = latest.get(update.subscription_id)
+            if current is None or update.event_at >= current.event_at:
+                latest[update.subscription_id] = update
+
+        rows = [
+            {"subscription_id": u.subscription_id, "status": u.status, "event_at": u.event_at.isoformat()}
+            for u in latest.values()
+        ]
+        for attempt in range(3):
+            try:
+                response = await run_supabase(
+                    get_supabase_admin().rpc('apply_subscription_status_updates', {'updates': rows}).execute
+                )
+                break
+            except Exception as e:
+                print(f"Erro ao gravar lote de {len(rows)} atualizações de assinatura (tentativa {attempt + 1}): {e}")
+                await asyncio.sleep(0.5 * (2 ** attempt))
+        else:
+            # Desiste do lote: os eventos já foram confirmados ao Asaas, então ficam só no log
+            self.updates_dropped += len(rows)
+            print(f"ERRO: lote de {len(rows)} atualizações de assinatura descartado após 3 tentativas")
+            return
+
+        self.batches_written += 1
+        updated = response.data or []
+        self.rows_updated += len(updated)
+        for row in updated:
+            if row.get("user_id"):
+                await invalidate_user_profile(row["user_id"])
+                await invalidate_user_entitlements(row["user_id"])
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "duplicates": self.duplicates,
+            "batches_written": self.batches_written,
+            "rows_updated": self.rows_updated,
+            "updates_dropped": self.updates_dropped,
+            "dedup": self._seen_events.stats(),
+        }
+
+
+# Instância global; o worker é iniciado e parado pelo lifespan em app.main
+subscription_updates = SubscriptionUpdateQueue(
+    max_size=settings.webhook_queue_max_size,
+    batch_max_size=settings.webhook_batch_max_size,
+    batch_max_wait=settings.webhook_batch_max_wait,
+    dedup_max_size=settings.webhook_dedup_max_size,
+    dedup_ttl=settings.webhook_dedup_ttl,
+)
@@ -1,15 +1,195 @@
-import os
-from supabase import create_client, Client
-from ..core.config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_KEY
-
-# Instâncias dos clientes Supabase
-supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-supabase_admin: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-
-# Remover a função get_supabase_client, pois usaremos as instâncias globais
-# def get_supabase_client() -> Client:
-#     url: str = os.environ.get("SUPABASE_URL")
-#     key: str = os.environ.get("SUPABASE_KEY")
-#     if not url or not key:
-#         raise ValueError("Variáveis de ambiente SUPABASE_URL e SUPABASE_KEY devem estar configuradas.")
-#     return create_client(url, key) 
\ No newline at end of file
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import httpx
+import jwt
+from postgrest import SyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_TIMEOUT
+from postgrest.utils import SyncClient
+from supabase import Client
+from supabase.lib.client_options import ClientOptions
+from ..core.config import Settings, get_settings, settings
+from .cache import TTLCache
+from .metrics import UpstreamTimer, supabase_operation
+
+class _ServerClient(Client):
+    """
+    Client compartilhado por todas as requisições. No supabase-py, sign_in/sign_up guardam a sessão
+    no cliente e o PostgREST passa a mandar o JWT desse usuário nas consultas seguintes; aqui o
+    PostgREST sempre usa a chave do projeto, e a sessão guardada não afeta as outras requisições.
+    """
+
+    def _get_token_header(self):
+        return {"Authorization": f"Bearer {self.supabase_key}"}
+
+    def _listen_to_auth_events(self, event, session):
+        pass
+
+class UserPostgrestClient(SyncPostgrestClient):
+    """PostgREST com o JWT de um usuário, usando o pool de conexões HTTP compartilhado."""
+
+    def __init__(self, base_url: str, transport: httpx.BaseTransport, **kwargs):
+        self._transport = transport
+        super().__init__(base_url, **kwargs)
+
+    def create_session(self, base_url, headers, timeout) -> SyncClient:
+        return SyncClient(base_url=base_url, headers=headers, timeout=timeout, transport=self._transport)
+
+    def aclose(self) -> None:
+        # O transporte é de todos os clientes do pool; quem o fecha é SupabaseClients.close
+        pass
+
+def _token_ttl(token: str) -> float:
+    """Segundos até o token expirar (claim exp), limitado a SUPABASE_USER_CLIENT_TTL."""
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        return 0
+    if not isinstance(exp, (int, float)):
+        return settings.supabase_user_client_ttl
+    return min(exp - time.time(), settings.supabase_user_client_ttl)
+
+class SupabaseClients:
+    """
+    Clientes Supabase (chave anon e service role) criados sob demanda, no primeiro uso.
+    Importar o pacote não cria clientes nem exige as variáveis de ambiente; create_app chama
+    configure(settings) na subida e os clientes passam a usar essas configurações.
+
+    Consultas feitas em nome do usuário usam for_token(token): clientes PostgREST leves, com o JWT
+    do usuário (a RLS vale), guardados em um LRU limitado até o token expirar. Todos compartilham
+    um único pool de conexões HTTP, então obter um cliente novo não abre conexões.
+    """
+
+    def __init__(self, user_pool_size: int = settings.supabase_user_client_pool_size):
+        self._settings: Optional[Settings] = None
+        self._client: Optional[Client] = None
+        self._admin: Optional[Client] = None
+        self._lock = threading.Lock()
+        self._transport: Optional[httpx.HTTPTransport] = None
+        self._user_clients = TTLCache(max_size=user_pool_size, ttl=settings.supabase_user_client_ttl)
+
+    def configure(self, settings: Settings) -> None:
+        self.close()
+        with self._lock:
+            self._settings = settings
+            self._client = None
+            self._admin = None
+
+    @property
+    def settings(self) -> Settings:
+        # Sem configure (scripts, jobs), usa as variáveis de ambiente
+        return self._settings or get_settings()
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create(self.settings.supabase_key)
+        return self._client
+
+    @property
+    def admin(self) -> Client:
+        if self._admin is None:
+            with self._lock:
+                if self._admin is None:
+                    self._admin = self._create(self.settings.supabase_service_key)
+        return self._admin
+
+    def _create(self, key: str) -> Client:
+        # Sem renovação automática da sessão: o servidor não mantém usuários logados (nem timers por login)
+        options = ClientOptions(auto_refresh_token=False, persist_session=False)
+        return _ServerClient(self.settings.supabase_url, key, options=options)
+
+    def for_token(self, token: str) -> UserPostgrestClient:
+        """Cliente PostgREST que faz as consultas com o JWT do usuário."""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        client = self._user_clients.get(key)
+        if client is None:
+            client = UserPostgrestClient(
+                f"{self.settings.supabase_url}/rest/v1",
+                self._get_transport(),
+                headers={"apiKey": self.settings.supabase_key, "Authorization": f"Bearer {token}"},
+                timeout=DEFAULT_POSTGREST_CLIENT_TIMEOUT,
+            )
+            ttl = _token_ttl(token)
+            if ttl > 0:
+                self._user_clients.set(key, client, ttl=ttl)
+        return client
+
+    def _get_transport(self) -> httpx.HTTPTransport:
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    # Uma conexão por thread do pool do supabase-py basta
+                    limits = httpx.Limits(
+                        max_connections=settings.supabase_executor_max_workers,
+                        max_keepalive_connections=settings.supabase_executor_max_workers,
+                    )
+                    self._transport = httpx.HTTPTransport(limits=limits)
+        return self._transport
+
+    def close(self) -> None:
+        """Descarta os clientes por token e fecha o pool de conexões compartilhado."""
+        self._user_clients.clear()
+        with self._lock:
+            transport, self._transport = self._transport, None
+        if transport is not None:
+            transport.close()
+
+    def stats(self) -> dict:
+        return self._user_clients.stats()
+
+    def warm_up(self) -> None:
+        """Cria os dois clientes agora (na subida da aplicação), e não na primeira requisição."""
+        self.client
+        self.admin
+
+# Instância global, configurada pelo lifespan em app.main
+supabase_clients = SupabaseClients()
+
+def get_supabase_client() -> Client:
+    """
+    Dependency com o cliente da chave anon, para o Supabase Auth (login, get_user, logout).
+    Consultas a tabelas do usuário usam get_user_postgrest (dependencies.py), com o JWT dele.
+    """
+    return supabase_clients.client
+
+def get_supabase_admin() -> Client:
+    """Cliente com a chave service role (ignora RLS); só para rotinas do servidor e rotas /admin."""
+    return supabase_clients.admin
+
+# O supabase-py 2.0 é síncrono. Para não bloquear o event loop nas rotas async,
+# toda chamada ao Supabase (auth, PostgREST e RPC) roda neste pool limitado de threads.
+# O tamanho do pool é o máximo de chamadas simultâneas ao Supabase por worker.
+_supabase_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _supabase_executor
+    if _supabase_executor is None:
+        _supabase_executor = ThreadPoolExecutor(
+            max_workers=settings.supabase_executor_max_workers,
+            thread_name_prefix="supabase",
+        )
+    return _supabase_executor
+
+async def run_supabase(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Executa uma chamada síncrona do supabase-py no pool de threads e aguarda o resultado.
+    Ex.: `await run_supabase(query.execute)` ou `await run_supabase(supabase.auth.get_user, jwt=token)`.
+    A duração (incluindo a espera por uma thread livre) vai para upstream_request_duration_seconds.
+    """
+    loop = asyncio.get_running_loop()
+    with UpstreamTimer(*supabase_operation(func)):
+        return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+def shutdown_supabase_executor() -> None:
+    global _supabase_executor
+    if _supabase_executor is not None:
+        _supabase_executor.shutdown(wait=False, cancel_futures=True)
+        _supabase_executor = None
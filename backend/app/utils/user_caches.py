@@ -0,0 +1,35 @@
+import json
+
+from .cache_backend import SharedCache
+from ..core.config import settings
+from ..models.user import SessionContext
+
+# Cache do contexto da sessão (perfil de public.users + assinaturas) por user_id. Perfis quase
+# nunca mudam, então evitamos uma RPC por requisição; qualquer escrita no perfil/assinaturas do
+# usuário deve chamar invalidate_user_profile, que também vale para os outros workers quando
+# CACHE_BACKEND_URL está configurado. Use profile_cache.stats() para acompanhar acertos e despejos.
+profile_cache = SharedCache(
+    "profile", settings.profile_cache_max_size, settings.profile_cache_ttl,
+    encode=lambda context: context.model_dump_json().encode(),
+    decode=SessionContext.model_validate_json,
+)
+
+async def invalidate_user_profile(user_id) -> None:
+    """Remove o perfil do usuário do cache após qualquer escrita relacionada a ele."""
+    await profile_cache.invalidate(str(user_id))
+
+# Status de public.subscriptions que liberam acesso ao plano
+ACTIVE_SUBSCRIPTION_STATUSES = ("ACTIVE",)
+
+# Planos com assinatura ativa por user_id (frozenset, vazio quando não há nenhuma).
+# Qualquer escrita em public.subscriptions deve chamar invalidate_user_entitlements;
+# o TTL curto limita o atraso para escritas feitas fora deste processo (ex.: reconciliação).
+entitlement_cache = SharedCache(
+    "entitlement", settings.entitlement_cache_max_size, settings.entitlement_cache_ttl,
+    encode=lambda plans: json.dumps(sorted(plans)).encode(),
+    decode=lambda raw: frozenset(json.loads(raw)),
+)
+
+async def invalidate_user_entitlements(user_id) -> None:
+    """Remove do cache os planos ativos do usuário após qualquer mudança nas assinaturas dele."""
+    await entitlement_cache.invalidate(str(user_id))
@@ -0,0 +1,224 @@
+"""
+Benchmark das rotas principais contra Supabase e Asaas falsos (benchmarks/fakes.py).
+
+Sobe um Supabase falso (GoTrue + PostgREST) e um Asaas falso em portas locais, aponta
+SUPABASE_URL e ASAAS_API_URL para eles e dispara cada cenário contra a aplicação real
+(app.main:app, com lifespan) em níveis fixos de concorrência. Para cada cenário e nível
+imprime throughput e latências p50/p95/p99.
+
+Cenários: login (POST /auth/login), refresh (POST /auth/refresh), users_me (GET /users/me),
+subscription_create (POST /subscriptions/create), subscription_details
+(GET /subscriptions/{id}), subscription_details_asaas (GET /subscriptions/{id}?expand=asaas),
+subscription_payments (GET /subscriptions/{id}/payments), subscription_payments_all
+(GET /subscriptions/{id}/payments?all=true) e subscription_cancel (POST /subscriptions/{id}/cancel).
+
+Para acompanhar regressões, salve uma execução com --output e compare as próximas com
+--compare: linhas com queda de throughput ou alta de p99 acima de --tolerance são
+marcadas e o processo termina com código 1.
+
+Uso (no diretório backend/):
+    python -m benchmarks.bench_endpoints --levels 1,8,32 --output baseline.json
+    python -m benchmarks.bench_endpoints --levels 1,8,32 --compare baseline.json
+    python -m benchmarks.bench_endpoints --scenarios subscription_create --asaas-latency-ms 150 --asaas-error-rate 0.05
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Optional
+
+from .fakes import (
+    BENCH_EMAIL,
+    BENCH_REFRESH_TOKEN,
+    BENCH_SUBSCRIPTION_ID,
+    FaultProfile,
+    start_fake_asaas,
+    start_fake_supabase,
+)
+
+BENCH_JWT_SECRET = "bench-jwt-secret"
+
+SUBSCRIPTION_PAYLOAD = {
+    "billing_type": "BOLETO",
+    "next_due_date": "2030-01-10",
+    "value": 49.9,
+    "cycle": "MONTHLY",
+    "plan": "premium",
+    "description": "Assinatura de benchmark",
+}
+
+
+def build_scenarios(token: str) -> dict:
+    auth = {"Authorization": f"Bearer {token}"}
+    return {
+        "login": ("POST", "/auth/login", {"json": {"email": BENCH_EMAIL, "password": "bench-password"}}),
+        "refresh": ("POST", "/auth/refresh", {"json": {"refresh_token": BENCH_REFRESH_TOKEN}}),
+        "users_me": ("GET", "/users/me", {"headers": auth}),
+        "subscription_create": ("POST", "/subscriptions/create", {"headers": auth, "json": SUBSCRIPTION_PAYLOAD}),
+        "subscription_details": ("GET", f"/subscriptions/{BENCH_SUBSCRIPTION_ID}", {"headers": auth}),
+        "subscription_details_asaas": ("GET", f"/subscriptions/{BENCH_SUBSCRIPTION_ID}?expand=asaas", {"headers": auth}),
+        "subscription_payments": ("GET", f"/subscriptions/{BENCH_SUBSCRIPTION_ID}/payments", {"headers": auth}),
+        "subscription_payments_all": ("GET", f"/subscriptions/{BENCH_SUBSCRIPTION_ID}/payments?all=true", {"headers": auth}),
+        "subscription_cancel": ("POST", f"/subscriptions/{BENCH_SUBSCRIPTION_ID}/cancel", {"headers": auth}),
+    }
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_level(client, request: tuple, concurrency: int, total: int) -> dict:
+    method, path, kwargs = request
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def find_regression(result: dict, baseline: Optional[dict], tolerance: float) -> Optional[str]:
+    if baseline is None:
+        return None
+    problems = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        problems.append(f"req/s {baseline['throughput']:.1f} -> {result['throughput']:.1f}")
+    if result["p99_ms"] > baseline["p99_ms"] * (1 + tolerance):
+        problems.append(f"p99 {baseline['p99_ms']:.1f} -> {result['p99_ms']:.1f} ms")
+    return "; ".join(problems) or None
+
+
+async def run_suite(args, scenarios: list, levels: list, baseline: dict) -> tuple:
+    import httpx
+    from app.main import app
+
+    results = []
+    regressions = 0
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            login = await client.post("/auth/login", json={"email": BENCH_EMAIL, "password": "bench-password"})
+            login.raise_for_status()
+            requests = build_scenarios(login.json()["access_token"])
+
+            print(f"{'cenário':<22} {'em voo':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>6}")
+            for name in scenarios:
+                # Aquecimento: popula caches e abre as conexões antes de medir
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    await run_level(client, requests[name], min(levels), args.warmup)
+                for level in levels:
+                    # Os prints de debug das rotas iriam poluir a tabela
+                    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                        result = await run_level(client, requests[name], level, args.requests)
+                    result["scenario"] = name
+                    results.append(result)
+                    regression = find_regression(result, baseline.get((name, level)), args.tolerance)
+                    regressions += regression is not None
+                    print(
+                        f"{name:<22} {level:>6} {result['throughput']:>9.1f} {result['p50_ms']:>8.1f} "
+                        f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>6}"
+                        + (f"  REGRESSÃO: {regression}" if regression else "")
+                    )
+                    sys.stdout.flush()
+
+    # O login pelo supabase-py agenda a renovação do token em threads não-daemon (threading.Timer),
+    # e logins concorrentes podem deixar mais de uma; sem cancelá-las o processo não termina
+    for thread in threading.enumerate():
+        if isinstance(thread, threading.Timer):
+            thread.cancel()
+    return results, regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="login,refresh,users_me,subscription_create,subscription_details,subscription_details_asaas,subscription_payments,subscription_payments_all,subscription_cancel",
+                        help="cenários separados por vírgula")
+    parser.add_argument("--levels", default="1,8,32", help="níveis de concorrência separados por vírgula")
+    parser.add_argument("--requests", type=int, default=300, help="requisições por cenário e nível")
+    parser.add_argument("--warmup", type=int, default=20, help="requisições de aquecimento por cenário (não medidas)")
+    parser.add_argument("--supabase-latency-ms", type=float, default=20.0, help="latência base do Supabase falso")
+    parser.add_argument("--asaas-latency-ms", type=float, default=80.0, help="latência base do Asaas falso")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="jitter uniforme somado à latência dos dois serviços")
+    parser.add_argument("--supabase-error-rate", type=float, default=0.0, help="fração de respostas 503 do Supabase falso")
+    parser.add_argument("--asaas-error-rate", type=float, default=0.0, help="fração de respostas 503 do Asaas falso")
+    parser.add_argument("--seed", type=int, default=1, help="semente do jitter e das falhas simuladas")
+    parser.add_argument("--output", help="grava os resultados em JSON")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="variação aceita antes de marcar regressão (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(build_scenarios("").keys())
+    if unknown:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(unknown))}")
+    levels = [int(x) for x in args.levels.split(",")]
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {(row["scenario"], row["concurrency"]): row for row in json.load(f)["results"]}
+
+    jwt_secret = os.environ.setdefault("SUPABASE_JWT_SECRET", BENCH_JWT_SECRET)
+    supabase = start_fake_supabase(FaultProfile(args.supabase_latency_ms, args.jitter_ms, args.supabase_error_rate), jwt_secret)
+    asaas = start_fake_asaas(FaultProfile(args.asaas_latency_ms, args.jitter_ms, args.asaas_error_rate))
+    # Precisa acontecer antes de importar a aplicação: a configuração é lida no import
+    os.environ["SUPABASE_URL"] = supabase.url
+    os.environ["ASAAS_API_URL"] = f"{asaas.url}/v3"
+    os.environ.setdefault("SUPABASE_KEY", "bench.anon.key")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.service.key")
+    os.environ.setdefault("ASAAS_API_KEY", "bench")
+    os.environ.setdefault("AUTH_VERIFY_MODE", "local")
+    # O cenário de login repete o mesmo e-mail e IP: sem isso o limite de tentativas responderia 429
+    os.environ.setdefault("LOGIN_RATE_PER_IP", "0")
+    os.environ.setdefault("LOGIN_RATE_PER_EMAIL", "0")
+
+    print(f"Supabase falso em {supabase.url} ({args.supabase_latency_ms:.0f} ms, erro {args.supabase_error_rate:.0%})")
+    print(f"Asaas falso em {asaas.url}/v3 ({args.asaas_latency_ms:.0f} ms, erro {args.asaas_error_rate:.0%}), jitter {args.jitter_ms:.0f} ms")
+    try:
+        results, regressions = asyncio.run(run_suite(args, scenarios, levels, baseline))
+    finally:
+        supabase.stop()
+        asaas.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+        print(f"Resultados gravados em {args.output}")
+    if regressions:
+        print(f"{regressions} regressão(ões) em relação a {args.compare}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark do tempo de importação de app.main (cold start de cada worker do Uvicorn).
+
+Cada amostra roda em um processo Python novo, sem as variáveis SUPABASE_*/ASAAS_* (um .env
+local ainda é lido pelo load_dotenv): importar a aplicação não pode exigir configuração nem
+criar clientes. Imprime a mediana e o pior tempo de
+`import app.main` e os módulos mais caros segundo `python -X importtime`.
+
+Com --max-ms, termina com código 1 se a mediana passar do limite (para uso em CI).
+
+Uso (no diretório backend/):
+    python -m benchmarks.bench_import --runs 10
+    python -m benchmarks.bench_import --runs 10 --max-ms 600
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MEASURE = "import time; t = time.perf_counter(); import app.main; print((time.perf_counter() - t) * 1000)"
+ENV_PREFIXES = ("SUPABASE_", "ASAAS_")
+
+
+def clean_env() -> dict:
+    return {k: v for k, v in os.environ.items() if not k.startswith(ENV_PREFIXES)}
+
+
+def run(args: list) -> subprocess.CompletedProcess:
+    result = subprocess.run([sys.executable, *args], env=clean_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"Falha ao importar app.main sem variáveis de ambiente:\n{result.stderr}")
+    return result
+
+
+def slowest_modules(top: int) -> list:
+    """(self_us, cumulativo_us, módulo) dos `top` módulos com maior tempo cumulativo."""
+    stderr = run(["-X", "importtime", "-c", "import app.main"]).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, module = (part.strip() for part in line[len("import time:"):].split("|"))
+        if self_us.isdigit():
+            rows.append((int(self_us), int(cumulative_us), module))
+    return sorted(rows, key=lambda row: row[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="módulos mais caros a listar")
+    parser.add_argument("--max-ms", type=float, default=None, help="falha se a mediana passar deste tempo")
+    args = parser.parse_args()
+
+    samples = [float(run(["-c", MEASURE]).stdout.strip().splitlines()[-1]) for _ in range(args.runs)]
+    median = statistics.median(samples)
+    print(f"import app.main: mediana {median:.1f} ms, pior {max(samples):.1f} ms ({args.runs} processos)")
+
+    print(f"\n{'cumulativo ms':>14} {'próprio ms':>11}  módulo")
+    for self_us, cumulative_us, module in slowest_modules(args.top):
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>11.1f}  {module}")
+
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"\nREGRESSÃO: mediana {median:.1f} ms acima do limite de {args.max_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
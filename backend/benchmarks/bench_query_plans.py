@@ -0,0 +1,229 @@
+"""
+Planos e tempos das consultas mais frequentes em public.subscriptions, antes e depois da
+migração migrations/0001_subscription_query_indexes.sql, em um Postgres local.
+
+Cria um schema descartável com users/subscriptions no formato do script SQL do projeto e os
+índices originais, insere --rows assinaturas (1 milhão por padrão) distribuídas entre --users
+usuários, mais um usuário com --heavy-user-rows assinaturas, e roda cada consulta com
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) para uma amostra de chaves. Em seguida aplica a migração
+no mesmo schema e repete as medições. O schema public não é tocado. Requer o psql.
+
+Uso (no diretório backend/):
+    python -m benchmarks.bench_query_plans --dsn postgresql://postgres@localhost:5432/postgres
+    python -m benchmarks.bench_query_plans --rows 200000 --output plans.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+MIGRATION = Path(__file__).resolve().parents[2] / "migrations" / "0001_subscription_query_indexes.sql"
+
+# Mesmas colunas e índices originais do "Script SQL para Aplicação no Supabase.txt"
+SCHEMA_SQL = """
+DROP SCHEMA IF EXISTS {schema} CASCADE;
+CREATE SCHEMA {schema};
+CREATE TABLE {schema}.users (
+  id UUID PRIMARY KEY,
+  email TEXT NOT NULL
+);
+CREATE TABLE {schema}.subscriptions (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  user_id UUID REFERENCES {schema}.users(id) ON DELETE CASCADE,
+  subscription_id TEXT NOT NULL,
+  status TEXT NOT NULL,
+  plan TEXT NOT NULL,
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX idx_subscriptions_user_id ON {schema}.subscriptions (user_id);
+CREATE INDEX idx_subscriptions_subscription_id ON {schema}.subscriptions (subscription_id);
+"""
+
+# Usuário de índice 0 é o "pesado"; os demais recebem as assinaturas ao acaso.
+# Status: 30% ACTIVE, 60% cancelled, 10% OVERDUE
+SEED_SQL = """
+SELECT setseed(0.42);
+INSERT INTO {schema}.users (id, email)
+SELECT md5('user-' || g)::uuid, 'user' || g || '@example.com' FROM generate_series(0, {users}) g;
+INSERT INTO {schema}.subscriptions (user_id, subscription_id, status, plan, created_at)
+SELECT md5('user-' || CASE WHEN g <= {heavy_user_rows} THEN 0 ELSE 1 + floor(random() * {users})::int END)::uuid,
+       'sub_' || substr(md5('sub-' || g), 1, 16),
+       CASE WHEN r < 0.3 THEN 'ACTIVE' WHEN r < 0.9 THEN 'cancelled' ELSE 'OVERDUE' END,
+       (ARRAY['basic', 'premium', 'enterprise'])[1 + floor(random() * 3)::int],
+       NOW() - random() * INTERVAL '3 years'
+  FROM (SELECT g, random() AS r FROM generate_series(1, {rows} + {heavy_user_rows}) g) seed;
+ANALYZE {schema}.users;
+ANALYZE {schema}.subscriptions;
+"""
+
+SAMPLE_SQL = """
+SELECT subscription_id || ' ' || user_id FROM {schema}.subscriptions TABLESAMPLE SYSTEM (1) REPEATABLE (42)
+ WHERE user_id <> md5('user-0')::uuid LIMIT {samples};
+"""
+
+# Consultas da aplicação, na forma que o PostgREST e as funções do script SQL executam.
+# "key": chaves da amostra; "heavy": só o usuário com muitas assinaturas. As escritas rodam em ROLLBACK.
+QUERIES = {
+    "subscription_details": (
+        "key", False,
+        "SELECT * FROM {schema}.subscriptions WHERE subscription_id = '{sid}' AND user_id = '{uid}' LIMIT 1",
+    ),
+    "cancel_owned_subscription": (
+        "key", True,
+        "UPDATE {schema}.subscriptions SET status = 'cancelled' WHERE subscription_id = '{sid}' AND user_id = '{uid}' RETURNING *",
+    ),
+    "webhook_status_update": (
+        "key", True,
+        "UPDATE {schema}.subscriptions SET status = 'ACTIVE' WHERE subscription_id = '{sid}' RETURNING user_id",
+    ),
+    "active_plans": (
+        "key", False,
+        "SELECT plan FROM {schema}.subscriptions WHERE user_id = '{uid}' AND status IN ('ACTIVE')",
+    ),
+    "list_first_page": (
+        "key", False,
+        "SELECT * FROM {schema}.subscriptions WHERE user_id = '{uid}' ORDER BY created_at DESC, id DESC LIMIT 21",
+    ),
+    "active_plans_heavy_user": (
+        "heavy", False,
+        "SELECT plan FROM {schema}.subscriptions WHERE user_id = '{uid}' AND status IN ('ACTIVE')",
+    ),
+    "list_first_page_heavy_user": (
+        "heavy", False,
+        "SELECT * FROM {schema}.subscriptions WHERE user_id = '{uid}' ORDER BY created_at DESC, id DESC LIMIT 21",
+    ),
+}
+
+INDEX_SIZE_SQL = """
+SELECT COALESCE(SUM(pg_relation_size(indexrelid)), 0) FROM pg_index WHERE indrelid = '{schema}.subscriptions'::regclass;
+"""
+
+SEPARATOR = "--8<--"
+
+
+def psql(args, sql: str) -> str:
+    result = subprocess.run(
+        [args.psql, args.dsn, "-X", "-q", "-A", "-t", "-v", "ON_ERROR_STOP=1"],
+        input=sql, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"psql falhou: {result.stderr.strip()}")
+    return result.stdout
+
+
+def plan_shape(node: dict) -> str:
+    """Nós de acesso do plano, ex.: 'Limit > Index Scan (idx_subscriptions_user_id)'."""
+    label = node["Node Type"]
+    if node.get("Index Name"):
+        label += f" ({node['Index Name']})"
+    children = [plan_shape(child) for child in node.get("Plans", [])]
+    return label + (" > " + ", ".join(children) if children else "")
+
+
+def measure(args, keys: list, heavy_user: str) -> dict:
+    statements = []
+    for name, (kind, write, template) in QUERIES.items():
+        targets = [(None, heavy_user)] if kind == "heavy" else keys
+        for sid, uid in targets:
+            query = template.format(schema=args.schema, sid=sid, uid=uid)
+            explain = f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query};"
+            if write:
+                explain = f"BEGIN;\n{explain}\nROLLBACK;"
+            # A primeira execução aquece o cache; só a segunda é medida
+            statements.append(f"\\echo {SEPARATOR}{name}\n{explain}\n{explain}")
+    output = psql(args, "\n".join(statements))
+
+    # Cada bloco começa com o nome da consulta, seguido dos dois planos em JSON
+    samples = {name: [] for name in QUERIES}
+    for block in output.split(SEPARATOR)[1:]:
+        name, text = block.split("\n", 1)
+        samples[name.strip()].append(_json_documents(text)[-1][0])
+
+    results = {}
+    for name, explained in samples.items():
+        times = sorted(e["Execution Time"] for e in explained)
+        buffers = [e["Plan"].get("Shared Hit Blocks", 0) + e["Plan"].get("Shared Read Blocks", 0) for e in explained]
+        results[name] = {
+            "samples": len(times),
+            "p50_ms": statistics.median(times),
+            "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))],
+            "buffers_p50": statistics.median(buffers),
+            "plan": plan_shape(explained[0]["Plan"]),
+        }
+    return results
+
+
+def _json_documents(text: str) -> list:
+    decoder = json.JSONDecoder()
+    documents, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        document, position = decoder.raw_decode(text, position)
+        documents.append(document)
+        while position < len(text) and text[position].isspace():
+            position += 1
+    return documents
+
+
+def print_results(before: dict, after: dict) -> None:
+    print(f"\n{'consulta':<28} {'antes p50':>10} {'depois p50':>11} {'antes p95':>10} {'depois p95':>11} {'buffers':>13}")
+    for name in QUERIES:
+        b, a = before[name], after[name]
+        buffers = f"{b['buffers_p50']:.0f} -> {a['buffers_p50']:.0f}"
+        print(f"{name:<28} {b['p50_ms']:>8.3f}ms {a['p50_ms']:>9.3f}ms {b['p95_ms']:>8.3f}ms {a['p95_ms']:>9.3f}ms {buffers:>13}")
+    print("\nPlanos (primeira chave da amostra):")
+    for name in QUERIES:
+        print(f"  {name}\n    antes:  {before[name]['plan']}\n    depois: {after[name]['plan']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.getenv("BENCH_DATABASE_URL", "postgresql://postgres@localhost:5432/postgres"),
+                        help="Postgres local descartável (padrão: $BENCH_DATABASE_URL)")
+    parser.add_argument("--psql", default="psql", help="caminho do psql")
+    parser.add_argument("--schema", default="bench_query_plans", help="schema criado (e apagado) pelo benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="assinaturas distribuídas entre os usuários")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--heavy-user-rows", type=int, default=20_000, help="assinaturas de um único usuário")
+    parser.add_argument("--samples", type=int, default=50, help="chaves (subscription_id, user_id) medidas por consulta")
+    parser.add_argument("--keep", action="store_true", help="não apaga o schema no final")
+    parser.add_argument("--output", help="grava os resultados em JSON")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    psql(args, SCHEMA_SQL.format(schema=args.schema))
+    psql(args, SEED_SQL.format(schema=args.schema, rows=args.rows, users=args.users, heavy_user_rows=args.heavy_user_rows))
+    print(f"{args.rows + args.heavy_user_rows} assinaturas inseridas em {time.perf_counter() - started:.1f}s")
+
+    keys = [tuple(line.split()) for line in psql(args, SAMPLE_SQL.format(schema=args.schema, samples=args.samples)).split("\n") if line]
+    heavy_user = psql(args, "SELECT md5('user-0')::uuid;").strip()
+    try:
+        index_bytes_before = int(psql(args, INDEX_SIZE_SQL.format(schema=args.schema)))
+        before = measure(args, keys, heavy_user)
+
+        started = time.perf_counter()
+        migration = MIGRATION.read_text(encoding="utf-8").replace("public.", f"{args.schema}.")
+        psql(args, migration + f"\nANALYZE {args.schema}.subscriptions;")
+        print(f"Migração {MIGRATION.name} aplicada em {time.perf_counter() - started:.1f}s")
+        index_bytes_after = int(psql(args, INDEX_SIZE_SQL.format(schema=args.schema)))
+        after = measure(args, keys, heavy_user)
+    finally:
+        if not args.keep:
+            psql(args, f"DROP SCHEMA IF EXISTS {args.schema} CASCADE;")
+
+    print_results(before, after)
+    print(f"\nÍndices de subscriptions: {index_bytes_before / 2**20:.1f} MB -> {index_bytes_after / 2**20:.1f} MB")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "before": before, "after": after,
+                       "index_bytes": {"before": index_bytes_before, "after": index_bytes_after}}, f, indent=2)
+        print(f"Resultados gravados em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
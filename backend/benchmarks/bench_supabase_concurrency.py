@@ -0,0 +1,113 @@
+"""
+Benchmark de concorrência das chamadas ao Supabase.
+
+Sobe um PostgREST falso local (com latência configurável), aponta SUPABASE_URL para ele
+e dispara GET /subscriptions/{id} contra a aplicação real com N requisições em voo.
+Com as chamadas do supabase-py rodando no pool de threads, o throughput deve crescer
+quase linearmente com N até o tamanho do pool (SUPABASE_EXECUTOR_MAX_WORKERS).
+
+Uso (no diretório backend/):
+    python -m benchmarks.bench_supabase_concurrency --latency-ms 50 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUBSCRIPTION_ROW = {
+    "id": "f9a8e7d6-c5b4-3a21-9876-543210fedcba",
+    "user_id": "a1b2c3d4-e5f6-7890-1234-567890abcdef",
+    "subscription_id": "sub_bench",
+    "status": "ACTIVE",
+    "plan": "premium",
+    "created_at": "2024-01-01T00:00:00",
+    "updated_at": "2024-01-01T00:00:00",
+}
+
+
+def start_fake_postgrest(latency_s: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency_s)
+            single = "vnd.pgrst.object" in (self.headers.get("Accept") or "")
+            body = json.dumps(SUBSCRIPTION_ROW if single else [SUBSCRIPTION_ROW]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 256
+
+    server = Server(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def run_level(app, concurrency: int, total: int) -> float:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue = asyncio.Queue()
+        for _ in range(total):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                response = await client.get(f"/subscriptions/{SUBSCRIPTION_ROW['subscription_id']}")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="latência simulada do PostgREST por chamada")
+    parser.add_argument("--requests", type=int, default=200, help="requisições por nível de concorrência")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="níveis de concorrência separados por vírgula")
+    args = parser.parse_args()
+
+    server = start_fake_postgrest(args.latency_ms / 1000)
+    host, port = server.server_address
+    os.environ["SUPABASE_URL"] = f"http://{host}:{port}"
+    os.environ.setdefault("SUPABASE_KEY", "bench.anon.key")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.service.key")
+    os.environ.setdefault("ASAAS_API_KEY", "bench")
+
+    from app.main import app
+    from app.dependencies import get_current_user
+    from app.models.user import UserProfile
+
+    bench_user = UserProfile(
+        id=SUBSCRIPTION_ROW["user_id"], email="bench@example.com", username="bench",
+        name="Bench", cpf_cnpj="00000000000",
+    )
+    app.dependency_overrides[get_current_user] = lambda: bench_user
+
+    print(f"PostgREST falso em {os.environ['SUPABASE_URL']} com {args.latency_ms:.0f} ms por chamada")
+    print(f"{'em voo':>8} {'req/s':>10} {'speedup':>8}")
+    baseline = None
+    for level in (int(x) for x in args.levels.split(",")):
+        throughput = asyncio.run(run_level(app, level, args.requests))
+        baseline = baseline or throughput
+        print(f"{level:>8} {throughput:>10.1f} {throughput / baseline:>7.1f}x")
+        sys.stdout.flush()
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
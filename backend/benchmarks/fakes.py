@@ -0,0 +1,315 @@
+"""
+Servidores HTTP locais que imitam o Supabase (GoTrue + PostgREST) e o Asaas nos benchmarks.
+
+Cada servidor roda em uma thread própria (ThreadingHTTPServer), responde com dados fixos
+no formato que o supabase-py e a aplicação esperam, e simula latência, jitter e uma taxa
+de erros (503) configuráveis. Não há estado persistente: basta o suficiente para que as
+rotas da aplicação percorram o mesmo caminho que percorreriam contra os serviços reais.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+
+BENCH_USER_ID = "a1b2c3d4-e5f6-7890-1234-567890abcdef"
+BENCH_EMAIL = "bench@example.com"
+BENCH_CUSTOMER_ID = "cus_bench"
+BENCH_SUBSCRIPTION_ID = "sub_bench"
+BENCH_TIMESTAMP = "2024-01-01T00:00:00"
+BENCH_REFRESH_TOKEN = "bench-refresh-token"
+INVALID_REFRESH_TOKEN = "used-refresh-token"
+
+
+class FaultProfile:
+    """Latência base, jitter (uniforme em [0, jitter]) e fração de respostas 503 de um serviço falso."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def delay(self) -> None:
+        total = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if total > 0:
+            time.sleep(total / 1000)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, como os serviços reais
+    # Cabeçalhos e corpo saem em escritas separadas; com Nagle ligado cada resposta esperaria o ACK atrasado (~40 ms)
+    disable_nagle_algorithm = True
+    profile: FaultProfile = FaultProfile()
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def _send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode() if status != 204 else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method: str) -> None:
+        self.profile.delay()
+        body = self._read_json()
+        if self.profile.should_fail():
+            self._send_json(503, {"message": "falha simulada"})
+            return
+        parts = urlsplit(self.path)
+        status, payload = self.route(method, parts.path, parse_qs(parts.query), body)
+        self._send_json(status, payload)
+
+    def route(self, method: str, path: str, query: dict, body):
+        raise NotImplementedError
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+def _eq_filter(query: dict, column: str) -> Optional[str]:
+    # Filtros do PostgREST chegam como ?coluna=eq.valor
+    for value in query.get(column, []):
+        if value.startswith("eq."):
+            return value[3:]
+    return None
+
+
+def _in_filter(query: dict, column: str) -> Optional[list]:
+    # ?coluna=in.(a,b,c)
+    for value in query.get(column, []):
+        if value.startswith("in.(") and value.endswith(")"):
+            return [v.strip('"') for v in value[4:-1].split(",") if v]
+    return None
+
+
+def _user_row() -> dict:
+    return {
+        "id": BENCH_USER_ID,
+        "email": BENCH_EMAIL,
+        "username": "bench",
+        "name": "Bench",
+        "cpf_cnpj": "00000000000",
+        "asaas_customer_id": BENCH_CUSTOMER_ID,
+        "address": None,
+        "phone": None,
+        "description": None,
+        "created_at": BENCH_TIMESTAMP,
+        "updated_at": BENCH_TIMESTAMP,
+    }
+
+
+def _subscription_row(subscription_id: str, status: str = "ACTIVE", plan: str = "premium") -> dict:
+    return {
+        "id": str(uuid.uuid5(uuid.NAMESPACE_URL, subscription_id)),
+        "user_id": BENCH_USER_ID,
+        "subscription_id": subscription_id,
+        "status": status,
+        "plan": plan,
+        "created_at": BENCH_TIMESTAMP,
+        "updated_at": BENCH_TIMESTAMP,
+    }
+
+
+def make_supabase_handler(profile: FaultProfile, jwt_secret: str):
+    """GoTrue (/auth/v1) e PostgREST (/rest/v1) no mesmo servidor, como em um projeto Supabase."""
+
+    def auth_user() -> dict:
+        return {
+            "id": BENCH_USER_ID,
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": BENCH_EMAIL,
+            "app_metadata": {"provider": "email"},
+            "user_metadata": {},
+            "created_at": BENCH_TIMESTAMP,
+        }
+
+    def session() -> dict:
+        now = int(time.time())
+        token = jwt.encode(
+            {"sub": BENCH_USER_ID, "aud": "authenticated", "role": "authenticated", "email": BENCH_EMAIL,
+             "iat": now, "exp": now + 3600},
+            jwt_secret,
+            algorithm="HS256",
+        )
+        return {
+            "access_token": token,
+            "refresh_token": uuid.uuid4().hex,
+            "expires_in": 3600,
+            "expires_at": now + 3600,
+            "token_type": "bearer",
+            "user": auth_user(),
+        }
+
+    class SupabaseHandler(_FakeHandler):
+        def route(self, method, path, query, body):
+            if path == "/auth/v1/token":
+                # Sem estado: qualquer refresh token é aceito, exceto este, que imita um token já usado
+                if query.get("grant_type") == ["refresh_token"] and (body or {}).get("refresh_token") == INVALID_REFRESH_TOKEN:
+                    return 400, {"error": "invalid_grant", "error_description": "Invalid Refresh Token: Already Used"}
+                return 200, session()
+            if path == "/auth/v1/signup":
+                return 200, {**session(), "user": {**auth_user(), "id": str(uuid.uuid4())}}
+            if path == "/auth/v1/user":
+                return 200, auth_user()
+            if path == "/auth/v1/logout":
+                return 204, {}
+
+            single = "vnd.pgrst.object" in (self.headers.get("Accept") or "")
+            if path == "/rest/v1/rpc/get_session_context":
+                return 200, {"profile": _user_row(), "subscriptions": [_subscription_row(BENCH_SUBSCRIPTION_ID)]}
+            if path == "/rest/v1/rpc/cancel_owned_subscription":
+                return 200, [_subscription_row((body or {}).get("p_subscription_id") or BENCH_SUBSCRIPTION_ID, "cancelled")]
+            if path.startswith("/rest/v1/rpc/"):
+                return 200, {"success": True}
+            if path == "/rest/v1/users":
+                row = _user_row()
+                return 200, row if single else [row]
+            if path == "/rest/v1/subscriptions":
+                if method == "POST":
+                    rows = body if isinstance(body, list) else [body]
+                    return 201, [_subscription_row(r["subscription_id"], r.get("status") or "ACTIVE", r.get("plan") or "premium") for r in rows]
+                subscription_ids = _in_filter(query, "subscription_id")
+                if subscription_ids is not None:
+                    return 200, [_subscription_row(sid) for sid in subscription_ids]
+                subscription_id = _eq_filter(query, "subscription_id") or BENCH_SUBSCRIPTION_ID
+                status = "cancelled" if method == "PATCH" else "ACTIVE"
+                row = _subscription_row(subscription_id, status)
+                return 200, row if single else [row]
+            return 404, {"message": f"rota falsa inexistente: {method} {path}"}
+
+    SupabaseHandler.profile = profile
+    return SupabaseHandler
+
+
+ASAAS_SUBSCRIPTION_PATH = re.compile(r"^/v3/subscriptions/([^/]+)$")
+ASAAS_SUBSCRIPTION_PAYMENTS_PATH = re.compile(r"^/v3/subscriptions/([^/]+)/payments$")
+ASAAS_CUSTOMER_PATH = re.compile(r"^/v3/customers/([^/]+)$")
+
+
+# Histórico de cobranças de cada assinatura falsa, da mais recente (índice 0) para a mais antiga
+FAKE_PAYMENTS_PER_SUBSCRIPTION = 250
+
+
+def _fake_payment(subscription_id: str, index: int) -> dict:
+    year, month = divmod(2030 * 12 + 11 - index, 12)
+    return {
+        "id": f"pay_{subscription_id}_{index}", "subscription": subscription_id, "status": "RECEIVED",
+        "value": 49.9, "billingType": "BOLETO",
+        "dueDate": f"{year}-{month + 1:02d}-10", "paymentDate": f"{year}-{month + 1:02d}-09",
+    }
+
+
+def _int_param(query: dict, name: str, default: int) -> int:
+    values = query.get(name)
+    return int(values[0]) if values else default
+
+
+def make_asaas_handler(profile: FaultProfile):
+    class AsaasHandler(_FakeHandler):
+        def route(self, method, path, query, body):
+            if path == "/v3/subscriptions" and method == "POST":
+                return 200, {
+                    "id": f"sub_{uuid.uuid4().hex[:12]}",
+                    "customer": (body or {}).get("customer"),
+                    "status": "ACTIVE",
+                    "value": (body or {}).get("value"),
+                    "externalReference": (body or {}).get("externalReference"),
+                }
+            if path == "/v3/subscriptions" and method == "GET":
+                return 200, {"data": [], "hasMore": False, "totalCount": 0}
+            match = ASAAS_SUBSCRIPTION_PAYMENTS_PATH.match(path)
+            if match and method == "GET":
+                # Paginação do Asaas: ?offset=&limit= (máximo 100), com hasMore e totalCount
+                offset = _int_param(query, "offset", 0)
+                limit = min(_int_param(query, "limit", 10), 100)
+                end = min(offset + limit, FAKE_PAYMENTS_PER_SUBSCRIPTION)
+                return 200, {
+                    "data": [_fake_payment(match.group(1), index) for index in range(offset, end)],
+                    "hasMore": end < FAKE_PAYMENTS_PER_SUBSCRIPTION,
+                    "totalCount": FAKE_PAYMENTS_PER_SUBSCRIPTION,
+                    "offset": offset,
+                    "limit": limit,
+                }
+            match = ASAAS_SUBSCRIPTION_PATH.match(path)
+            if match and method == "GET":
+                return 200, {
+                    "id": match.group(1), "status": "ACTIVE", "value": 49.9, "cycle": "MONTHLY",
+                    "billingType": "BOLETO", "nextDueDate": "2030-04-10", "description": "Assinatura de benchmark",
+                }
+            if match and method == "DELETE":
+                return 200, {"deleted": True, "id": match.group(1)}
+            if match and method == "POST":
+                return 200, {"id": match.group(1), "status": "ACTIVE", **(body or {})}
+            if path == "/v3/customers" and method == "POST":
+                return 200, {"id": f"cus_{uuid.uuid4().hex[:12]}", "name": (body or {}).get("name")}
+            if path == "/v3/customers" and method == "GET":
+                return 200, {"data": [], "hasMore": False, "totalCount": 0}
+            match = ASAAS_CUSTOMER_PATH.match(path)
+            if match and method == "DELETE":
+                return 200, {"deleted": True, "id": match.group(1)}
+            return 404, {"errors": [{"code": "not_found", "description": f"{method} {path}"}]}
+
+    AsaasHandler.profile = profile
+    return AsaasHandler
+
+
+class FakeServer:
+    def __init__(self, handler_class):
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256
+            daemon_threads = True
+            # As conexões keep-alive ficam presas em leitura; não esperar por elas no server_close()
+            block_on_close = False
+
+        self._server = Server(("127.0.0.1", 0), handler_class)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def start_fake_supabase(profile: FaultProfile, jwt_secret: str) -> FakeServer:
+    return FakeServer(make_supabase_handler(profile, jwt_secret)).start()
+
+
+def start_fake_asaas(profile: FaultProfile) -> FakeServer:
+    """O Asaas falso responde em <url>/v3, o mesmo formato de ASAAS_API_URL."""
+    return FakeServer(make_asaas_handler(profile)).start()
@@ -0,0 +1,96 @@
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+
+from app.utils.cache_backend import RedisCacheBackend, SharedCache, SharedCaches
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _redis_backend(server: fakeredis.FakeServer) -> RedisCacheBackend:
+    # O RedisCacheBackend só conecta no primeiro comando; os clientes passam a apontar para o servidor falso
+    backend = RedisCacheBackend("redis://localhost:6379/0", prefix="test:")
+    backend._client = fakeredis.aioredis.FakeRedis(server=server)
+    backend._subscriber = fakeredis.aioredis.FakeRedis(server=server)
+    return backend
+
+
+async def _worker(server: fakeredis.FakeServer, worker_id: str) -> tuple:
+    """Um worker da API: registro próprio, conectado ao mesmo Redis dos demais."""
+    registry = SharedCaches(worker_id=worker_id)
+    cache = SharedCache("profile", max_size=100, ttl=60, registry=registry)
+    await registry.start(backend=_redis_backend(server))
+    for _ in range(100):
+        if registry.backend.subscribed:
+            break
+        await asyncio.sleep(0.01)
+    return registry, cache
+
+
+async def _eventually(condition) -> bool:
+    for _ in range(100):
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+async def workers():
+    server = fakeredis.FakeServer()
+    a_registry, a = await _worker(server, "worker-a")
+    b_registry, b = await _worker(server, "worker-b")
+    yield a, b
+    await a_registry.close()
+    await b_registry.close()
+
+
+@pytest.mark.anyio
+async def test_set_is_visible_to_other_worker(workers):
+    a, b = workers
+    await a.set("u1", {"name": "Ana"})
+
+    assert await b.get("u1") == {"name": "Ana"}
+    assert b.shared_hits == 1
+    # A segunda leitura já vem do L1
+    assert await b.get("u1") == {"name": "Ana"}
+    assert b.shared_hits == 1
+
+
+@pytest.mark.anyio
+async def test_get_missing_key_returns_default(workers):
+    _, b = workers
+    assert await b.get("ausente", "padrão") == "padrão"
+    assert b.shared_misses == 1
+
+
+@pytest.mark.anyio
+async def test_l2_hit_keeps_remaining_ttl(workers):
+    a, b = workers
+    await a.set("u1", [], ttl=0.2)
+
+    assert await b.get("u1") == []
+    await asyncio.sleep(0.3)
+    # Com o TTL padrão (60s) o L1 de b ainda teria o valor
+    assert b.local.get("u1") is None
+    assert await b.get("u1") is None
+
+
+@pytest.mark.anyio
+async def test_invalidate_evicts_other_worker_l1(workers):
+    a, b = workers
+    await a.set("u1", {"name": "Ana"})
+    assert await b.get("u1") == {"name": "Ana"}
+
+    await a.invalidate("u1")
+
+    assert await _eventually(lambda: b.local.get("u1") is None)
+    assert b.invalidations_received == 1
+    assert await b.get("u1") is None
+    # O worker que publicou ignora a própria mensagem
+    assert a.invalidations_received == 0
@@ -0,0 +1,42 @@
+-- 0001: índices das consultas mais frequentes em public.subscriptions
+--
+-- Para bancos criados com uma versão anterior do "Script SQL para Aplicação no Supabase.txt"; o script
+-- atual já cria este estado. Pode ser executado mais de uma vez (IF NOT EXISTS / IF EXISTS).
+--
+-- CREATE INDEX bloqueia as escritas na tabela enquanto o índice é montado. Em tabelas grandes, crie antes
+-- cada índice com CREATE INDEX CONCURRENTLY, um comando por vez e fora de transação (ex.: pelo psql);
+-- depois este arquivo só remove os índices antigos.
+
+-- Cada assinatura do Asaas pertence a um único usuário: interrompe a migração se houver linhas repetidas
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1
+      FROM public.subscriptions
+     WHERE user_id IS NOT NULL
+     GROUP BY subscription_id, user_id
+    HAVING COUNT(*) > 1
+  ) THEN
+    RAISE EXCEPTION 'public.subscriptions tem linhas repetidas para (subscription_id, user_id); remova-as antes de aplicar esta migração';
+  END IF;
+END $$;
+
+-- Detalhes (GET /subscriptions/{id}) e cancelamento (cancel_owned_subscription) filtram pelas duas colunas;
+-- com subscription_id na frente, o índice também atende webhooks e reconciliação, que filtram só por ele
+CREATE UNIQUE INDEX IF NOT EXISTS idx_subscriptions_subscription_id_user_id
+  ON public.subscriptions (subscription_id, user_id);
+
+-- Planos com assinatura ativa (require_active_subscription): só as linhas ativas, com o plano no próprio
+-- índice. O predicado acompanha ACTIVE_SUBSCRIPTION_STATUSES em app/dependencies.py
+CREATE INDEX IF NOT EXISTS idx_subscriptions_active_user_plan
+  ON public.subscriptions (user_id, plan)
+  WHERE status = 'ACTIVE';
+
+-- Listagem paginada (GET /subscriptions) e get_session_context: assinaturas do usuário em
+-- ORDER BY created_at DESC, id DESC, lidas direto do índice, sem ordenação
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user_created_at_id
+  ON public.subscriptions (user_id, created_at, id);
+
+-- Cobertos pelos índices acima
+DROP INDEX IF EXISTS public.idx_subscriptions_user_id;
+DROP INDEX IF EXISTS public.idx_subscriptions_subscription_id;
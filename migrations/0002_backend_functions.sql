@@ -0,0 +1,314 @@
+-- 0002: tabelas e funções dos webhooks, da reconciliação, do registro assíncrono, do contexto da sessão
+-- e das operações em lote do /admin
+--
+-- Para bancos criados com o script original (só users e subscriptions). As funções são criadas como na
+-- primeira versão do script que as trouxe; as migrações seguintes as alteram até o estado atual, então
+-- aplique todas em ordem. Em bancos que já têm esses objetos, recria as funções nessa primeira versão e
+-- as seguintes voltam a atualizá-las. Pode ser executado mais de uma vez.
+--
+-- As funções SECURITY DEFINER já nascem sem EXECUTE para PUBLIC, anon e authenticated (ver 0003).
+
+-- Webhooks do Asaas: data do último evento aplicado ao status da assinatura.
+-- Eventos que chegam fora de ordem (mais antigos que este valor) não sobrescrevem o status.
+ALTER TABLE public.subscriptions ADD COLUMN IF NOT EXISTS status_event_at TIMESTAMP;
+
+-- Aplica em lote as mudanças de status recebidas pelos webhooks do Asaas.
+-- updates: [{"subscription_id": "sub_...", "status": "ACTIVE", "event_at": "2024-06-12T16:45:03"}, ...]
+-- Retorna apenas as linhas efetivamente alteradas.
+CREATE OR REPLACE FUNCTION public.apply_subscription_status_updates(updates JSONB)
+RETURNS TABLE (subscription_id TEXT, user_id UUID, status TEXT)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.subscriptions AS s
+     SET status = u.status,
+         status_event_at = u.event_at
+    FROM jsonb_to_recordset(updates) AS u(subscription_id TEXT, status TEXT, event_at TIMESTAMP)
+   WHERE s.subscription_id = u.subscription_id
+     AND (s.status_event_at IS NULL OR s.status_event_at < u.event_at)
+  RETURNING s.subscription_id, s.user_id, s.status;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.apply_subscription_status_updates(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_subscription_status_updates TO service_role;
+
+
+-- Reconciliação com o Asaas (python -m app.jobs.reconcile_subscriptions).
+-- IDs de assinatura vistos no Asaas durante uma execução; apagados ao final por reconcile_finish.
+CREATE TABLE IF NOT EXISTS public.subscription_reconcile_seen (
+  run_id UUID NOT NULL,
+  subscription_id TEXT NOT NULL,
+  PRIMARY KEY (run_id, subscription_id)
+);
+-- Sem políticas: apenas o service_role acessa
+ALTER TABLE public.subscription_reconcile_seen ENABLE ROW LEVEL SECURITY;
+
+-- Marca uma página de IDs do Asaas como vista e devolve as linhas locais correspondentes
+CREATE OR REPLACE FUNCTION public.reconcile_compare_page(p_run_id UUID, p_subscription_ids TEXT[])
+RETURNS SETOF public.subscriptions
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO public.subscription_reconcile_seen (run_id, subscription_id)
+  SELECT p_run_id, unnest(p_subscription_ids)
+  ON CONFLICT DO NOTHING;
+
+  RETURN QUERY
+  SELECT * FROM public.subscriptions WHERE subscription_id = ANY(p_subscription_ids);
+END;
+$$;
+
+-- Linhas locais que não apareceram no Asaas nesta execução, paginadas por subscription_id
+CREATE OR REPLACE FUNCTION public.reconcile_missing_in_asaas(p_run_id UUID, p_after TEXT, p_limit INT)
+RETURNS SETOF public.subscriptions
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT s.*
+    FROM public.subscriptions s
+   WHERE s.subscription_id > p_after
+     AND NOT EXISTS (
+       SELECT 1 FROM public.subscription_reconcile_seen r
+        WHERE r.run_id = p_run_id AND r.subscription_id = s.subscription_id
+     )
+   ORDER BY s.subscription_id
+   LIMIT p_limit;
+$$;
+
+-- Aplica um lote de correções: atualiza status/plano das linhas existentes e insere as que faltam
+-- fixes: [{"subscription_id": "sub_...", "user_id": "<uuid ou null>", "status": "ACTIVE", "plan": "premium"}, ...]
+CREATE OR REPLACE FUNCTION public.reconcile_apply_fixes(fixes JSONB)
+RETURNS JSONB
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH f AS (
+    SELECT * FROM jsonb_to_recordset(fixes) AS f(subscription_id TEXT, user_id UUID, status TEXT, plan TEXT)
+  ),
+  updated AS (
+    UPDATE public.subscriptions s
+       SET status = f.status,
+           plan = f.plan
+      FROM f
+     WHERE s.subscription_id = f.subscription_id
+    RETURNING s.subscription_id
+  ),
+  inserted AS (
+    INSERT INTO public.subscriptions (user_id, subscription_id, status, plan)
+    SELECT f.user_id, f.subscription_id, f.status, f.plan
+      FROM f
+     WHERE f.user_id IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM public.subscriptions s WHERE s.subscription_id = f.subscription_id)
+    RETURNING subscription_id
+  )
+  SELECT jsonb_build_object(
+    'updated', (SELECT count(*) FROM updated),
+    'inserted', (SELECT count(*) FROM inserted)
+  );
+$$;
+
+CREATE OR REPLACE FUNCTION public.reconcile_finish(p_run_id UUID)
+RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  DELETE FROM public.subscription_reconcile_seen WHERE run_id = p_run_id;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.reconcile_compare_page(UUID, TEXT[]) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.reconcile_missing_in_asaas(UUID, TEXT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.reconcile_apply_fixes(JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.reconcile_finish(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.reconcile_compare_page TO service_role;
+GRANT EXECUTE ON FUNCTION public.reconcile_missing_in_asaas TO service_role;
+GRANT EXECUTE ON FUNCTION public.reconcile_apply_fixes TO service_role;
+GRANT EXECUTE ON FUNCTION public.reconcile_finish TO service_role;
+
+
+-- Registro assíncrono (REGISTRATION_MODE=async): o cliente do Asaas é criado por um worker em segundo plano.
+-- Uma linha por usuário com o estado do provisionamento; sobrevive a reinícios da API.
+CREATE TABLE IF NOT EXISTS public.user_provisioning_jobs (
+  user_id UUID PRIMARY KEY REFERENCES public.users(id) ON DELETE CASCADE,
+  status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processing', 'completed', 'failed')),
+  attempts INT NOT NULL DEFAULT 0,
+  last_error TEXT,
+  next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),  -- Próxima tentativa (status pending)
+  locked_until TIMESTAMP,                            -- Fim da reserva do worker (status processing)
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_user_provisioning_jobs_due
+  ON public.user_provisioning_jobs (next_attempt_at)
+  WHERE status IN ('pending', 'processing');
+-- Sem políticas: apenas o service_role acessa
+ALTER TABLE public.user_provisioning_jobs ENABLE ROW LEVEL SECURITY;
+
+DROP TRIGGER IF EXISTS update_user_provisioning_jobs_updated_at ON public.user_provisioning_jobs;
+CREATE TRIGGER update_user_provisioning_jobs_updated_at
+BEFORE UPDATE ON public.user_provisioning_jobs
+FOR EACH ROW
+EXECUTE FUNCTION update_updated_at_column();
+
+-- Insere o perfil (ainda sem asaas_customer_id) e o job de provisionamento na mesma transação.
+-- Remove a versão de 9 parâmetros, se houver, para que a 0003 possa referenciar a função só pelo nome;
+-- a 0005 a recria
+DROP FUNCTION IF EXISTS public.insert_new_user_pending(UUID, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT);
+CREATE OR REPLACE FUNCTION public.insert_new_user_pending(
+  user_id UUID,
+  user_email TEXT,
+  user_username TEXT,
+  user_name TEXT,
+  user_cpf_cnpj TEXT,
+  user_address TEXT,
+  user_phone TEXT,
+  user_description TEXT
+) RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO public.users (id, email, username, name, cpf_cnpj, address, phone, description)
+  VALUES (user_id, user_email, user_username, user_name, user_cpf_cnpj, user_address, user_phone, user_description);
+
+  INSERT INTO public.user_provisioning_jobs (user_id) VALUES (user_id);
+
+  RETURN jsonb_build_object('success', true, 'user_id', user_id);
+EXCEPTION
+  WHEN others THEN
+    RETURN jsonb_build_object('success', false, 'error', SQLERRM);
+END;
+$$;
+
+-- Reserva até p_limit jobs vencidos (ou com reserva expirada) e devolve os dados do cliente para o Asaas.
+-- SKIP LOCKED permite vários workers/instâncias da API consumindo a mesma tabela.
+CREATE OR REPLACE FUNCTION public.claim_provisioning_jobs(p_limit INT, p_lease_seconds INT)
+RETURNS TABLE (
+  user_id UUID, attempts INT, email TEXT, name TEXT, cpf_cnpj TEXT,
+  phone TEXT, address TEXT, description TEXT
+)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH claimed AS (
+    UPDATE public.user_provisioning_jobs j
+       SET status = 'processing',
+           attempts = j.attempts + 1,
+           locked_until = NOW() + make_interval(secs => p_lease_seconds)
+     WHERE j.user_id IN (
+       SELECT user_id FROM public.user_provisioning_jobs
+        WHERE (status = 'pending' AND next_attempt_at <= NOW())
+           OR (status = 'processing' AND locked_until < NOW())
+        ORDER BY next_attempt_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+     )
+    RETURNING j.user_id, j.attempts
+  )
+  SELECT c.user_id, c.attempts, u.email, u.name, u.cpf_cnpj, u.phone, u.address, u.description
+    FROM claimed c
+    JOIN public.users u ON u.id = c.user_id;
+$$;
+
+-- Grava o cliente do Asaas no perfil e encerra o job
+CREATE OR REPLACE FUNCTION public.complete_provisioning_job(p_user_id UUID, p_asaas_customer_id TEXT)
+RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.users SET asaas_customer_id = p_asaas_customer_id WHERE id = p_user_id;
+  UPDATE public.user_provisioning_jobs
+     SET status = 'completed', last_error = NULL, locked_until = NULL
+   WHERE user_id = p_user_id;
+$$;
+
+-- Registra a falha de uma tentativa: volta para pending daqui a p_retry_in_seconds, ou failed se for NULL
+CREATE OR REPLACE FUNCTION public.fail_provisioning_job(p_user_id UUID, p_error TEXT, p_retry_in_seconds INT)
+RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.user_provisioning_jobs
+     SET status = CASE WHEN p_retry_in_seconds IS NULL THEN 'failed' ELSE 'pending' END,
+         last_error = p_error,
+         next_attempt_at = COALESCE(NOW() + make_interval(secs => p_retry_in_seconds), next_attempt_at),
+         locked_until = NULL
+   WHERE user_id = p_user_id;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.insert_new_user_pending(UUID, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.claim_provisioning_jobs(INT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.complete_provisioning_job(UUID, TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.fail_provisioning_job(UUID, TEXT, INT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.insert_new_user_pending TO service_role;
+GRANT EXECUTE ON FUNCTION public.claim_provisioning_jobs TO service_role;
+GRANT EXECUTE ON FUNCTION public.complete_provisioning_job TO service_role;
+GRANT EXECUTE ON FUNCTION public.fail_provisioning_job TO service_role;
+
+-- Contexto da sessão: perfil + assinaturas do usuário em uma única ida ao banco (get_current_session).
+-- Roda com as permissões de quem chama (SECURITY INVOKER), então a RLS de users/subscriptions continua valendo.
+-- Retorna NULL se o perfil não existir.
+CREATE OR REPLACE FUNCTION public.get_session_context(p_user_id UUID)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SET search_path = public
+AS $$
+  SELECT jsonb_build_object(
+           'profile', to_jsonb(u),
+           'subscriptions', COALESCE(
+             (SELECT jsonb_agg(to_jsonb(s) ORDER BY s.created_at DESC, s.id DESC)
+                FROM public.subscriptions s
+               WHERE s.user_id = u.id),
+             '[]'::jsonb)
+         )
+    FROM public.users u
+   WHERE u.id = p_user_id;
+$$;
+
+-- Cancela a assinatura no banco somente se ela pertencer ao usuário, em um único UPDATE ... RETURNING.
+-- Sem linhas no retorno: a assinatura não existe ou é de outro usuário.
+CREATE OR REPLACE FUNCTION public.cancel_owned_subscription(p_subscription_id TEXT, p_user_id UUID)
+RETURNS SETOF public.subscriptions
+LANGUAGE sql
+SET search_path = public
+AS $$
+  UPDATE public.subscriptions
+     SET status = 'cancelled'
+   WHERE subscription_id = p_subscription_id
+     AND user_id = p_user_id
+  RETURNING *;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.get_session_context TO authenticated;
+GRANT EXECUTE ON FUNCTION public.get_session_context TO service_role;
+GRANT EXECUTE ON FUNCTION public.cancel_owned_subscription TO authenticated;
+GRANT EXECUTE ON FUNCTION public.cancel_owned_subscription TO service_role;
+
+-- Troca de plano em lote (POST /admin/subscriptions/bulk-update).
+-- updates: [{"subscription_id": "sub_...", "plan": "premium"}, ...]
+CREATE OR REPLACE FUNCTION public.update_subscription_plans(updates JSONB)
+RETURNS TABLE (subscription_id TEXT, user_id UUID, plan TEXT)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.subscriptions AS s
+     SET plan = u.plan
+    FROM jsonb_to_recordset(updates) AS u(subscription_id TEXT, plan TEXT)
+   WHERE s.subscription_id = u.subscription_id
+  RETURNING s.subscription_id, s.user_id, s.plan;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.update_subscription_plans(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.update_subscription_plans TO service_role;
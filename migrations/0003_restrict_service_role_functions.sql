@@ -0,0 +1,35 @@
+-- 0003: funções SECURITY DEFINER usadas só pelo backend (service_role) deixam de ser executáveis por
+-- PUBLIC, anon e authenticated
+--
+-- O Postgres concede EXECUTE a PUBLIC em toda função nova, e o Supabase expõe as funções do schema
+-- public em /rest/v1/rpc. Como estas funções rodam com as permissões do dono e ignoram a RLS, qualquer
+-- um com a chave anon poderia chamá-las. Pode ser executado mais de uma vez.
+
+-- Webhooks do Asaas: status das assinaturas
+REVOKE EXECUTE ON FUNCTION public.apply_subscription_status_updates(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_subscription_status_updates(JSONB) TO service_role;
+
+-- Reconciliação com o Asaas (app.jobs.reconcile_subscriptions)
+REVOKE EXECUTE ON FUNCTION public.reconcile_compare_page(UUID, TEXT[]) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.reconcile_missing_in_asaas(UUID, TEXT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.reconcile_apply_fixes(JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.reconcile_finish(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.reconcile_compare_page(UUID, TEXT[]) TO service_role;
+GRANT EXECUTE ON FUNCTION public.reconcile_missing_in_asaas(UUID, TEXT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.reconcile_apply_fixes(JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION public.reconcile_finish(UUID) TO service_role;
+
+-- Registro assíncrono e worker de provisionamento. insert_new_user_pending vai sem a lista de parâmetros,
+-- que muda na 0005: o nome basta enquanto houver uma única versão da função (a 0002 garante isso)
+REVOKE EXECUTE ON FUNCTION public.insert_new_user_pending FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.claim_provisioning_jobs(INT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.complete_provisioning_job(UUID, TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.fail_provisioning_job(UUID, TEXT, INT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.insert_new_user_pending TO service_role;
+GRANT EXECUTE ON FUNCTION public.claim_provisioning_jobs(INT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.complete_provisioning_job(UUID, TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.fail_provisioning_job(UUID, TEXT, INT) TO service_role;
+
+-- Troca de plano em lote (POST /admin/subscriptions/bulk-update)
+REVOKE EXECUTE ON FUNCTION public.update_subscription_plans(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.update_subscription_plans(JSONB) TO service_role;
@@ -0,0 +1,19 @@
+-- 0004: cancel_owned_subscription grava status_event_at
+--
+-- Sem a data, a proteção contra eventos fora de ordem de apply_subscription_status_updates
+-- (status_event_at < event_at) não enxergava o cancelamento feito pelo usuário, e um webhook
+-- PAYMENT_CONFIRMED/PAYMENT_RECEIVED atrasado voltava a assinatura cancelada para ACTIVE.
+-- Pode ser executado mais de uma vez.
+
+CREATE OR REPLACE FUNCTION public.cancel_owned_subscription(p_subscription_id TEXT, p_user_id UUID)
+RETURNS SETOF public.subscriptions
+LANGUAGE sql
+SET search_path = public
+AS $$
+  UPDATE public.subscriptions
+     SET status = 'cancelled',
+         status_event_at = NOW()
+   WHERE subscription_id = p_subscription_id
+     AND user_id = p_user_id
+  RETURNING *;
+$$;
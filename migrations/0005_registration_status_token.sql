@@ -0,0 +1,43 @@
+-- 0005: token de consulta do registro assíncrono (GET /auth/register/status/{token})
+--
+-- A consulta pelo user_id passou a exigir a sessão do próprio usuário. Logo após o registro o cliente
+-- pode ainda não ter token de acesso (ex.: confirmação de e-mail pendente), então o 202 do registro
+-- devolve um token aleatório; aqui fica só o hash SHA-256 dele. Pode ser executado mais de uma vez.
+
+ALTER TABLE public.user_provisioning_jobs ADD COLUMN IF NOT EXISTS status_token_hash TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS user_provisioning_jobs_status_token_hash_key
+  ON public.user_provisioning_jobs (status_token_hash);
+
+-- Novo parâmetro: a versão anterior, com 8 parâmetros, é removida para não ficar uma sobrecarga exposta
+DROP FUNCTION IF EXISTS public.insert_new_user_pending(UUID, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT);
+
+CREATE OR REPLACE FUNCTION public.insert_new_user_pending(
+  user_id UUID,
+  user_email TEXT,
+  user_username TEXT,
+  user_name TEXT,
+  user_cpf_cnpj TEXT,
+  user_address TEXT,
+  user_phone TEXT,
+  user_description TEXT,
+  user_status_token_hash TEXT
+) RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO public.users (id, email, username, name, cpf_cnpj, address, phone, description)
+  VALUES (user_id, user_email, user_username, user_name, user_cpf_cnpj, user_address, user_phone, user_description);
+
+  INSERT INTO public.user_provisioning_jobs (user_id, status_token_hash) VALUES (user_id, user_status_token_hash);
+
+  RETURN jsonb_build_object('success', true, 'user_id', user_id);
+EXCEPTION
+  WHEN others THEN
+    RETURN jsonb_build_object('success', false, 'error', SQLERRM);
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.insert_new_user_pending(UUID, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.insert_new_user_pending(UUID, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT, TEXT) TO service_role;
@@ -0,0 +1,41 @@
+-- 0006: reconcile_apply_fixes só altera os campos corrigidos e grava status_event_at
+--
+-- status/plan NULL no lote mantêm o valor atual: a reconciliação não sobrescreve o plano de assinaturas
+-- antigas, que não têm o plano no externalReference do Asaas. Quando o status muda (inclusive o
+-- cancelamento de linhas que não existem mais no Asaas), status_event_at recebe NOW(), para que webhooks
+-- mais antigos que a correção não a desfaçam. Pode ser executado mais de uma vez.
+
+CREATE OR REPLACE FUNCTION public.reconcile_apply_fixes(fixes JSONB)
+RETURNS JSONB
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  WITH f AS (
+    SELECT * FROM jsonb_to_recordset(fixes) AS f(subscription_id TEXT, user_id UUID, status TEXT, plan TEXT)
+  ),
+  updated AS (
+    UPDATE public.subscriptions s
+       SET status = COALESCE(f.status, s.status),
+           plan = COALESCE(f.plan, s.plan),
+           status_event_at = CASE
+             WHEN f.status IS NOT NULL AND f.status IS DISTINCT FROM s.status THEN NOW()
+             ELSE s.status_event_at
+           END
+      FROM f
+     WHERE s.subscription_id = f.subscription_id
+    RETURNING s.subscription_id
+  ),
+  inserted AS (
+    INSERT INTO public.subscriptions (user_id, subscription_id, status, plan)
+    SELECT f.user_id, f.subscription_id, f.status, f.plan
+      FROM f
+     WHERE f.user_id IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM public.subscriptions s WHERE s.subscription_id = f.subscription_id)
+    RETURNING subscription_id
+  )
+  SELECT jsonb_build_object(
+    'updated', (SELECT count(*) FROM updated),
+    'inserted', (SELECT count(*) FROM inserted)
+  );
+$$;
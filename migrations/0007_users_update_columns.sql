@@ -0,0 +1,9 @@
+-- 0007: usuários só alteram as colunas editáveis do próprio perfil
+--
+-- A política "Usuários podem atualizar seus próprios dados" deixava o usuário mudar qualquer coluna da
+-- própria linha em public.users pela API REST, inclusive o e-mail, o CPF/CNPJ e o asaas_customer_id.
+-- A RLS filtra linhas, não colunas: a restrição vem dos privilégios de coluna. Pode ser executado mais de
+-- uma vez.
+
+REVOKE UPDATE ON public.users FROM anon, authenticated;
+GRANT UPDATE (username, name, address, phone, description) ON public.users TO authenticated;
@@ -0,0 +1,12 @@
+-- 0008: só o backend grava em public.subscriptions
+--
+-- Com as políticas de INSERT e UPDATE, um usuário podia gravar status = 'ACTIVE' e qualquer plano na
+-- própria assinatura pela API REST e passar por require_active_subscription. A criação e o cancelamento
+-- já são feitos pelo backend com a chave de serviço (cancel_owned_subscription recebe o user_id do token
+-- verificado), assim como webhooks, reconciliação e operações em lote. Pode ser executado mais de uma vez.
+
+DROP POLICY IF EXISTS "Usuários podem criar suas próprias assinaturas" ON public.subscriptions;
+DROP POLICY IF EXISTS "Usuários podem atualizar suas próprias assinaturas" ON public.subscriptions;
+
+REVOKE EXECUTE ON FUNCTION public.cancel_owned_subscription(TEXT, UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.cancel_owned_subscription(TEXT, UUID) TO service_role;
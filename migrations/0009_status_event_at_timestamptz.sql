@@ -0,0 +1,42 @@
+-- 0009: status_event_at passa a ter fuso (timestamptz)
+--
+-- A proteção contra eventos fora de ordem compara datas de relógios diferentes: o dateCreated dos webhooks
+-- (horário de Brasília, sem offset), o NOW() do banco (cancelamento pelo usuário e reconciliação) e a hora
+-- do servidor da API (cancelamento em lote). Em TIMESTAMP, sem fuso, a diferença de 3 horas fazia um webhook
+-- mais novo ser rejeitado ou um antigo vencer. Agora cada valor carrega o fuso e o backend envia as datas
+-- com offset. Pode ser executado mais de uma vez.
+--
+-- Os valores já gravados não dizem de qual relógio vieram e são lidos como UTC (o fuso do NOW() no
+-- Supabase). As datas de webhooks antigos ficam 3 horas mais cedo do que eram, então no pior caso um
+-- evento reenviado dessa janela ainda é aplicado, mas nenhum evento mais novo é rejeitado.
+
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1
+      FROM information_schema.columns
+     WHERE table_schema = 'public'
+       AND table_name = 'subscriptions'
+       AND column_name = 'status_event_at'
+       AND data_type = 'timestamp without time zone'
+  ) THEN
+    ALTER TABLE public.subscriptions
+      ALTER COLUMN status_event_at TYPE TIMESTAMPTZ USING status_event_at AT TIME ZONE 'UTC';
+  END IF;
+END $$;
+
+-- event_at do lote também com fuso; valores sem offset seriam lidos no fuso da sessão do banco
+CREATE OR REPLACE FUNCTION public.apply_subscription_status_updates(updates JSONB)
+RETURNS TABLE (subscription_id TEXT, user_id UUID, status TEXT)
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.subscriptions AS s
+     SET status = u.status,
+         status_event_at = u.event_at
+    FROM jsonb_to_recordset(updates) AS u(subscription_id TEXT, status TEXT, event_at TIMESTAMPTZ)
+   WHERE s.subscription_id = u.subscription_id
+     AND (s.status_event_at IS NULL OR s.status_event_at < u.event_at)
+  RETURNING s.subscription_id, s.user_id, s.status;
+$$;